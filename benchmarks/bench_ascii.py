@@ -0,0 +1,97 @@
+"""Drawing images as ASCII art at 100, 200 and 400 columns, against the per-pixel loop ascii_magic used.
+
+Needs Pillow and NumPy, which the app loads from pyodide's packages, and is skipped without them.
+"""
+
+from io import BytesIO
+
+import ascii_image
+import numpy as np
+from PIL import Image
+
+WIDTH, HEIGHT = 1000, 750  # About the size of a feed image
+
+
+def _photo() -> bytes:
+    """Make a JPEG with smooth gradients and some noise, so it compresses like a photo."""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    pixels = np.stack([x * 255 // WIDTH, y * 255 // HEIGHT, (x + y) * 255 // (WIDTH + HEIGHT)], axis=-1)
+    pixels = np.clip(pixels + rng.integers(-20, 20, pixels.shape), 0, 255).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+PHOTO = _photo()
+GRAY = {columns: ascii_image.decode(PHOTO, columns) for columns in (100, 200, 400)}
+RGB = {columns: ascii_image.decode(PHOTO, columns, "RGB") for columns in (100, 200, 400)}
+
+
+def _per_pixel(image: Image.Image) -> str:
+    """Map one pixel at a time, the way ascii_magic's `to_ascii` did, to compare against."""
+    chars = ascii_image.CHARS
+    return "\n".join(
+        "".join(chars[int(image.getpixel((x, y)) / 255 * (len(chars) - 1))] for x in range(image.width))
+        for y in range(image.height)
+    )
+
+
+def time_convert_100() -> None:
+    """Decode a 1000x750 JPEG and draw it 100 columns wide, as the modal does."""
+    ascii_image.convert(PHOTO, 100)
+
+
+def time_convert_400() -> None:
+    """Decode a 1000x750 JPEG and draw it 400 columns wide."""
+    ascii_image.convert(PHOTO, 400)
+
+
+def time_render_100() -> None:
+    """Map a 100 column grayscale grid to characters."""
+    ascii_image.render(GRAY[100])
+
+
+def time_render_200() -> None:
+    """Map a 200 column grayscale grid to characters."""
+    ascii_image.render(GRAY[200])
+
+
+def time_render_400() -> None:
+    """Map a 400 column grayscale grid to characters."""
+    ascii_image.render(GRAY[400])
+
+
+def time_render_colour_100() -> None:
+    """Map a 100 column RGB grid to coloured characters with NumPy."""
+    ascii_image.render_colour(RGB[100])
+
+
+def time_render_colour_200() -> None:
+    """Map a 200 column RGB grid to coloured characters with NumPy."""
+    ascii_image.render_colour(RGB[200])
+
+
+def time_render_colour_400() -> None:
+    """Map a 400 column RGB grid to coloured characters with NumPy."""
+    ascii_image.render_colour(RGB[400])
+
+
+def time_render_per_pixel_100() -> None:
+    """Map a 100 column grayscale grid a pixel at a time."""
+    _per_pixel(GRAY[100])
+
+
+def time_render_per_pixel_200() -> None:
+    """Map a 200 column grayscale grid a pixel at a time."""
+    _per_pixel(GRAY[200])
+
+
+def time_render_per_pixel_400() -> None:
+    """Map a 400 column grayscale grid a pixel at a time."""
+    _per_pixel(GRAY[400])
+
+
+def track_rows_at_100_columns() -> int:
+    """Lines in the art at 100 columns, so a change to the width ratio shows up."""
+    return ascii_image.convert(PHOTO, 100).count("\n") + 1
@@ -0,0 +1,45 @@
+"""Building result table rows, counted in calls across pyodide's FFI against the counting DOM in fakedom.py."""
+
+import fakedom
+
+fakedom.install()
+
+import frontend  # noqa: E402 Has to import against the fake DOM
+
+HEADERS = ["post_author_handle", "post_record_text", "post_likecount", "post_images"]
+IMAGE = "https://cdn.bsky.app/img/feed_thumbnail/plain/did/cid@jpeg,https://cdn.bsky.app/img/feed_fullsize/plain/did/cid@jpeg,alt"
+ROWS = [
+    {
+        "post_author_handle": f"user{i}.test",
+        "post_record_text": f"Post {i}",
+        "post_likecount": i,
+        "post_images": IMAGE if i % 5 == 0 else "",
+    }
+    for i in range(100)
+]
+
+
+def _build(rows: list[dict]) -> int:
+    """Build the rows into a fragment, returning the FFI calls it took."""
+    rows = [row.copy() for row in rows]
+    fragment = frontend.document.createDocumentFragment()
+    fakedom.CALLS.clear()
+    frontend._create_table_rows(HEADERS, rows, fragment)  # noqa: SLF001 The function the app renders with
+    return fakedom.CALLS.total()
+
+
+def time_build_rows() -> None:
+    """Build 100 rows of 4 columns, a fifth with an image link."""
+    _build(ROWS)
+
+
+def track_ffi_calls_per_row() -> float:
+    """FFI calls building a row of 4 text columns."""
+    rows = [{**row, "post_images": ""} for row in ROWS]
+    return _build(rows) / len(rows)
+
+
+def track_ffi_calls_per_image_row() -> float:
+    """FFI calls building a row with an image link, which also attaches a click handler and is watched for prefetch."""
+    rows = [{**row, "post_images": IMAGE} for row in ROWS]
+    return _build(rows) / len(rows)
@@ -0,0 +1,170 @@
+"""Whole queries, planned and executed over HTTP against mock_appview.py on a background thread."""
+
+import asyncio
+
+import feed_cache
+import text_index
+from auth_session import BskySession
+from executor import compile_query, execute, scan_stats
+from mock_appview import Dataset, start_server
+from scheduler import follow
+
+FEED = "SELECT post_uri, post_likecount FROM feed WHERE author = 'user1.test' AND post_likecount > 500 LIMIT 300"
+ACTORS = ", ".join(f"'user{i}.test'" for i in range(100))
+PROFILES = f"SELECT handle, followerscount FROM profile WHERE actor IN ({ACTORS})"  # noqa: S608 Not sql injection
+# the same posts found by pushing the filters down to searchPosts, then by filtering a feed client-side
+SEARCH = "SELECT post_uri FROM posts WHERE text MATCH 'sql' AND author = 'user1.test' LIMIT 100"
+SCAN = "SELECT post_uri FROM feed WHERE author = 'user1.test' AND post_record_text MATCH 'sql' LIMIT 100"
+# a feed read again after a few new posts, fetching only those with REFRESH
+REFRESH = "SELECT post_uri FROM feed WHERE author = 'user1.test' LIMIT 300 REFRESH"
+# three queries watching two feeds, which the scheduler refreshes with a call each
+WATCHES = [
+    "SELECT post_uri FROM feed WHERE author = 'user1.test' WATCH 5",
+    "SELECT post_uri FROM feed WHERE author = 'user1.test' AND post_likecount > 500 WATCH 5",
+    "SELECT post_uri FROM feed WHERE author = 'user2.test' WATCH 5",
+]
+WATCH_SECONDS = 0.2  # Used instead of the queries' own, for a refresh soon but not two before they're read
+# posts from the live stream, filtered by the subscription before they're sent
+STREAM = "SELECT did, record_text FROM stream WHERE collection = 'app.bsky.feed.post' LIMIT 200"
+
+server = None
+session = None
+data = None
+
+
+def setup() -> None:
+    """Start the stand-in server and a session that keeps its connections open between runs."""
+    global server, session, data  # noqa: PLW0603 Shared by every benchmark in the module, like asv's setup
+    data = Dataset(actors=500, posts=1000)
+    # the stream's events as fast as they can be sent, so its benchmark times the client
+    server = start_server(data, events_per_second=0)
+    session = BskySession("", "", pds_host=f"http://localhost:{server.server_address[1]}")
+
+
+def teardown() -> None:
+    """Stop the server and close the session's connections."""
+    session.client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def _run(query: str) -> int:
+    """Run a query, returning how many HTTP calls it made."""
+    before = session.client.stats["http_calls"]
+    asyncio.run(execute(compile_query(query), session))
+    return session.client.stats["http_calls"] - before
+
+
+def time_feed_query() -> None:
+    """Page through a feed, filtering each page until 300 rows are found."""
+    _run(FEED)
+
+
+def time_profiles_uncached() -> None:
+    """Look up 100 profiles with an empty profile cache."""
+    session.hydrator.invalidate()
+    _run(PROFILES)
+
+
+def time_profiles_cached() -> None:
+    """Look up 100 profiles that are all in the profile cache."""
+    _run(PROFILES)
+
+
+def track_feed_http_calls() -> int:
+    """HTTP calls the feed query makes."""
+    return _run(FEED)
+
+
+def track_profiles_http_calls() -> int:
+    """HTTP calls looking up 100 uncached profiles makes."""
+    session.hydrator.invalidate()
+    return _run(PROFILES)
+
+
+def time_search_pushdown() -> None:
+    """Find 100 of an author's posts on a topic with the filters sent to searchPosts."""
+    _run(SEARCH)
+
+
+def time_search_client_side() -> None:
+    """Find the same 100 posts by paging through the author's feed and filtering each page."""
+    text_index.clear()
+    _run(SCAN)
+
+
+def time_search_indexed() -> None:
+    """Find them again from the text index the first scan of the feed built."""
+    _run(SCAN)
+
+
+def track_search_http_calls() -> int:
+    """HTTP calls the pushed down search makes."""
+    return _run(SEARCH)
+
+
+def track_search_client_side_http_calls() -> int:
+    """HTTP calls finding the same posts by filtering the feed makes."""
+    text_index.clear()
+    return _run(SCAN)
+
+
+def track_search_indexed_http_calls() -> int:
+    """HTTP calls finding them again, once the feed's text is indexed, makes."""
+    _run(SCAN)
+    return _run(SCAN)
+
+
+def time_feed_reread() -> None:
+    """Read 300 of a feed's posts again after 3 new ones, fetching every page."""
+    data.newer += 3
+    _run(REFRESH.removesuffix(" REFRESH"))
+
+
+def time_feed_refresh() -> None:
+    """Read them again through the feed cache, warm from the run before, fetching only the page with the new posts."""
+    data.newer += 3
+    _run(REFRESH)
+
+
+def track_feed_refresh_http_calls() -> int:
+    """HTTP calls reading 300 posts of a feed again after 3 new ones, through a warm feed cache, makes."""
+    feed_cache.clear()
+    _run(REFRESH)
+    data.newer += 3
+    return _run(REFRESH)
+
+
+async def _watch_refresh() -> int:
+    """Run the WATCH queries, then wait for a refresh of each, returning the HTTP calls the refreshes made."""
+    followers = []
+    for query in WATCHES:
+        plan = compile_query(query)
+        await execute(plan, session)
+        plan.watch = WATCH_SECONDS
+        followers.append(follow(query, plan, session))
+    data.newer += 3
+    before = session.client.stats["http_calls"]
+    try:
+        await asyncio.gather(*(anext(follower) for follower in followers))
+        return session.client.stats["http_calls"] - before
+    finally:
+        for follower in followers:
+            await follower.aclose()
+
+
+def track_watch_http_calls() -> int:
+    """HTTP calls a refresh of three WATCH queries over two feeds makes."""
+    return asyncio.run(_watch_refresh())
+
+
+def time_stream_posts() -> None:
+    """Subscribe to the stream and take 200 posts from it."""
+    _run(STREAM)
+
+
+def track_stream_connections() -> int:
+    """Count the connections a query of the stream opens before its LIMIT ends it."""
+    plan = compile_query(STREAM)
+    asyncio.run(execute(plan, session))
+    return scan_stats(plan)["http_calls"]
@@ -0,0 +1,91 @@
+"""The local operators: flattening API payloads, evaluating WHERE and ORDER BY ... LIMIT."""
+
+import json
+
+from executor import Filter, Flatten, TopK, walk_where
+from mock_appview import Dataset
+from parser import parse, tokenize
+from temp_tables import TempTable
+from text_index import TextIndex, words
+
+ROWS = 1000
+
+# getAuthorFeed pages as the stand-in serves them, round-tripped through JSON like a real response
+data = Dataset(actors=50, posts=ROWS // 10)
+pages = [json.loads(json.dumps({"feed": [data.post(i, j) for j in range(data.posts)]})) for i in range(10)]
+rows = Flatten().process([item for page in pages for item in page["feed"]])
+
+
+def _predicates(where: str) -> list[tuple[str, str, str]]:
+    tree = parse(tokenize(f"SELECT * FROM feed WHERE {where}"))  # noqa: S608 Not sql injection
+    return [p for p in walk_where(tree) if isinstance(p, tuple)]
+
+
+numeric = Filter(predicates=_predicates("post_likecount > 500 AND post_replycount < 4"))
+text = Filter(predicates=_predicates("post_author_handle = 'user7.test'"))
+in_list = Filter(
+    predicates=_predicates(f"post_author_handle IN ({', '.join(repr(f'user{i}.test') for i in range(5, 25))})")
+)
+match = Filter(predicates=_predicates("post_record_text MATCH 'sql hi'"))
+index = TextIndex("post_record_text")
+index.add(rows)
+temp = TempTable("posts")
+temp.append(rows)
+
+
+def time_flatten_feed_page() -> None:
+    """Flatten one page of 100 feed items, a fifth of them with images."""
+    Flatten().process(pages[0]["feed"])
+
+
+def time_where_numeric() -> None:
+    """Evaluate two numeric comparisons over 1000 rows."""
+    numeric.process(rows)
+
+
+def time_where_text() -> None:
+    """Evaluate a string equality over 1000 rows."""
+    text.process(rows)
+
+
+def time_where_in() -> None:
+    """Evaluate a 20 item IN list over 1000 rows."""
+    in_list.process(rows)
+
+
+def time_where_match() -> None:
+    """Evaluate a two word MATCH over 1000 rows."""
+    match.process(rows)
+
+
+def time_index_build() -> None:
+    """Index the words of the text of 1000 rows."""
+    TextIndex("post_record_text").add(rows)
+
+
+def time_index_match() -> None:
+    """Answer the same MATCH from the index of those rows."""
+    index.search(words("sql hi"))
+
+
+def time_temp_table_build() -> None:
+    """Store 1000 rows in a temp table, column by column."""
+    TempTable("posts").append(rows)
+
+
+def time_temp_table_scan() -> None:
+    """Rebuild the 1000 rows of a temp table for a query to read."""
+    for _ in temp.pages():
+        pass
+
+
+def time_topk() -> None:
+    """Keep the 20 most liked of 1000 rows."""
+    top = TopK(column="post_likecount", descending=True, k=20)
+    top.process(rows)
+    top.flush()
+
+
+def track_flattened_columns() -> int:
+    """Columns a flattened feed row has, so a change to flattening that adds or drops some shows up."""
+    return max(len(row) for row in rows)
@@ -0,0 +1,47 @@
+"""Tokenizing and parsing, on a typical query and on one far bigger than anyone types."""
+
+from itertools import product
+from string import ascii_lowercase
+
+from parser import parse, tokenize
+
+SMALL = "SELECT handle, followerscount FROM profile WHERE actor = 'bsky.app' AND followerscount > 10 LIMIT 5"
+# identifiers can't hold digits, so the 500 column names are spelled with letters
+NAMES = ["".join(letters) for letters in product(ascii_lowercase, repeat=2)][:500]
+HUGE = (
+    "SELECT "  # noqa: S608 Not sql injection
+    + ", ".join(f"post_{name}" for name in NAMES)
+    + " FROM feed WHERE author = 'bsky.app' AND "
+    + " AND ".join(f"post_likecount > {i}" for i in range(200))
+    + " AND post_record_text IN ("
+    + ", ".join(f"'word{i}'" for i in range(200))
+    + ") ORDER BY post_likecount DESC LIMIT 100"
+)
+
+small_tokens = tokenize(SMALL)
+huge_tokens = tokenize(HUGE)
+
+
+def time_tokenize_small() -> None:
+    """Tokenize a short query."""
+    tokenize(SMALL)
+
+
+def time_parse_small() -> None:
+    """Parse a short query's tokens."""
+    parse(small_tokens)
+
+
+def time_tokenize_huge() -> None:
+    """Tokenize a query with 500 columns, 200 comparisons and a 200 item IN list."""
+    tokenize(HUGE)
+
+
+def time_parse_huge() -> None:
+    """Parse a query with 500 columns, 200 comparisons and a 200 item IN list."""
+    parse(huge_tokens)
+
+
+def track_huge_tokens() -> int:
+    """Tokens in the huge query, so a tokenizer change that splits differently shows up."""
+    return len(huge_tokens)
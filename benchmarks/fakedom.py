@@ -0,0 +1,105 @@
+"""A DOM that counts every call crossing from Python into JavaScript, so frontend.py can be measured under CPython.
+
+In pyodide each attribute read, attribute write and call on a JsProxy, and each `create_proxy`, is a trip
+through the FFI, and those trips dominate row-building time in the browser. `install()` puts stand-ins for
+`js`, `pyodide` and `pyodide_js` into `sys.modules` that count them in `CALLS`, with no browser timing involved.
+"""
+
+import sys
+from collections import Counter
+from types import ModuleType
+
+CALLS = Counter()  # FFI crossings by kind, e.g. "get createElement", "call createElement", "set textContent"
+
+
+class JsObject:
+    """A JavaScript object, remembering what's set on it and making up anything read from it."""
+
+    def __init__(self, name: str) -> None:
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_attrs", {})
+
+    def __getattr__(self, name: str) -> "JsObject":
+        CALLS[f"get {name}"] += 1
+        attrs = object.__getattribute__(self, "_attrs")
+        if name not in attrs:
+            attrs[name] = JsObject(name)
+        return attrs[name]
+
+    def __setattr__(self, name: str, value: object) -> None:
+        CALLS[f"set {name}"] += 1
+        object.__getattribute__(self, "_attrs")[name] = value
+
+    def __call__(self, *_args: object) -> "JsObject":
+        """Call the object as a function, getting back a new object."""
+        name = object.__getattribute__(self, "_name")
+        CALLS[f"call {name}"] += 1
+        return JsObject(name)
+
+
+def create_proxy(func: object) -> object:
+    """Count wrapping a Python callable for JavaScript."""
+    CALLS["create_proxy"] += 1
+    return func
+
+
+def to_js(value: object, **_kwargs: object) -> object:
+    """Count converting a Python object to JavaScript."""
+    CALLS["to_js"] += 1
+    return value
+
+
+def set_timeout(_func: object, _delay: int) -> int:
+    """Count scheduling a callback, without ever running it."""
+    CALLS["set_timeout"] += 1
+    return 0
+
+
+async def pyfetch(url: str, **_kwargs: object) -> None:
+    """Fail any fetch, nothing measured here goes to the network."""
+    msg = f"No network in the fake DOM: {url}"
+    raise OSError(msg)
+
+
+def install() -> None:
+    """Put the fake modules in `sys.modules`, so the ui modules import against them."""
+    js = ModuleType("js")
+    for name in (
+        "document",
+        "window",
+        "Element",
+        "Event",
+        "Math",
+        "Object",
+        "Blob",
+        "URL",
+        "Worker",
+        "IntersectionObserver",
+        "URLSearchParams",
+    ):
+        setattr(js, name, JsObject(name))
+
+    pyodide = ModuleType("pyodide")
+    ffi = ModuleType("pyodide.ffi")
+    ffi.create_proxy = ffi.create_once_callable = create_proxy
+    ffi.to_js = to_js
+    ffi.JsProxy = JsObject
+    ffi.JsException = type("JsException", (Exception,), {})
+    wrappers = ModuleType("pyodide.ffi.wrappers")
+    wrappers.set_timeout = wrappers.set_interval = set_timeout
+    http = ModuleType("pyodide.http")
+    http.pyfetch = pyfetch
+    pyodide.ffi, pyodide.http = ffi, http
+    pyodide_js = ModuleType("pyodide_js")
+    pyodide_js.loadPackage = JsObject("loadPackage")
+
+    sys.modules.update(
+        {
+            "js": js,
+            "pyodide": pyodide,
+            "pyodide.ffi": ffi,
+            "pyodide.ffi.wrappers": wrappers,
+            "pyodide.http": http,
+            "pyodide_js": pyodide_js,
+        }
+    )
@@ -0,0 +1,201 @@
+"""Run the benchmarks and compare them with the stored baseline.
+
+Benchmarks follow asv's naming: every `time_*` function in a `bench_*.py` module is timed, and every
+`track_*` function returns a number, like HTTP or FFI calls, that is recorded as it is. A module's `setup()`
+and `teardown()` run around its benchmarks.
+
+    python benchmarks/run.py              # run everything and compare with baseline.json
+    python benchmarks/run.py bench_dom    # only names containing "bench_dom"
+    python benchmarks/run.py --save       # record the results as the new baseline
+
+Any change to a `track_*` number fails the run. A time is the median of --repeat timings, and only fails when
+it's slower than the baseline by more than --tolerance and by more than MIN_SLOWDOWN, still is when timed again,
+and only on the machine and interpreter the baseline was recorded on, since it means nothing elsewhere.
+"""
+
+import argparse
+import importlib
+import json
+import platform
+import statistics
+import sys
+import timeit
+from collections.abc import Callable
+from pathlib import Path
+from types import ModuleType
+
+BENCH_DIR = Path(__file__).parent
+ROOT = BENCH_DIR.parent
+BASELINE = BENCH_DIR / "baseline.json"
+# The app's modules import each other by flat name, as they're laid out in the pyodide FS
+sys.path[:0] = [str(BENCH_DIR), str(ROOT), *(str(ROOT / "src" / package) for package in ("core", "api", "ui"))]
+
+DEFAULT_TOLERANCE = 0.25  # Fraction a time may grow by before it counts as a regression
+DEFAULT_REPEAT = 9  # Timings taken of each benchmark, the median is kept so one noisy timing can't move it
+MIN_SLOWDOWN = 50e-6  # Seconds a time must grow by to regress, smaller changes of the quick ones are noise
+RECHECKS = 2  # Times a slow benchmark is timed again, the fastest counting, so a burst of load doesn't fail it
+
+
+def machine() -> str:
+    """Describe this machine and interpreter, to tell whether times are comparable with the baseline."""
+    return f"{platform.system()} {platform.machine()} {platform.python_implementation()} {platform.python_version()}"
+
+
+def discover(pattern: str) -> list[tuple[ModuleType, list[tuple[str, Callable]]]]:
+    """Import every bench module, pairing it with its benchmarks whose names contain the pattern.
+
+    A module that needs a package that isn't installed, like Pillow for bench_ascii, is skipped.
+    """
+    result = []
+    for path in sorted(BENCH_DIR.glob("bench_*.py")):
+        try:
+            module = importlib.import_module(path.stem)
+        except ModuleNotFoundError as e:
+            print(f"[-] Skipping {path.stem}, {e.name} isn't installed", file=sys.stderr)
+            continue
+        benchmarks = [
+            (f"{path.stem}.{name}", func)
+            for name, func in vars(module).items()
+            if name.startswith(("time_", "track_")) and callable(func) and pattern in f"{path.stem}.{name}"
+        ]
+        if benchmarks:
+            result.append((module, benchmarks))
+    return result
+
+
+def measure(func: Callable, repeat: int) -> float:
+    """Time one call of the function in seconds, running it enough times to get past the timer's resolution."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return statistics.median(timer.repeat(repeat, number)) / number
+
+
+def format_value(name: str, value: float | None) -> str:
+    """Show a time in a readable unit, and a tracked number as it is."""
+    if value is None:
+        return "-"
+    if ".track_" in name:
+        return f"{value:g}"
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if value >= scale:
+            return f"{value / scale:.2f}{unit}"
+    return f"{value / 1e-9:.0f}ns"
+
+
+def compare(name: str, value: float, base: float | None, tolerance: float, *, same_machine: bool) -> str:
+    """Judge a result against its baseline, returning a status starting with "!" for a regression."""
+    if base is None:
+        return "new"
+    if ".track_" in name:
+        return "ok" if value == base else "! changed"
+    if not same_machine:
+        return f"x{value / base:.2f}"
+    if value > base * (1 + tolerance) and value - base > MIN_SLOWDOWN:
+        return f"! slower x{value / base:.2f}"
+    return f"ok x{value / base:.2f}"
+
+
+def run(
+    name: str, func: Callable, base: float | None, args: argparse.Namespace, *, same_machine: bool
+) -> tuple[float, str]:
+    """Run one benchmark and judge it, timing a slow one again before it counts as a regression.
+
+    A time being saved is taken as the median of as many runs, so the baseline isn't one that happened to be quick.
+    """
+    if ".track_" in name:
+        value = func()
+        return value, compare(name, value, base, args.tolerance, same_machine=same_machine)
+    if args.save:
+        value = statistics.median(measure(func, args.repeat) for _ in range(RECHECKS + 1))
+        return value, compare(name, value, base, args.tolerance, same_machine=same_machine)
+    value = measure(func, args.repeat)
+    status = compare(name, value, base, args.tolerance, same_machine=same_machine)
+    for _ in range(RECHECKS):
+        if not status.startswith("!"):
+            break
+        value = min(value, measure(func, args.repeat))
+        status = compare(name, value, base, args.tolerance, same_machine=same_machine)
+    return value, status
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the benchmarks, print a table against the baseline and exit non-zero on a regression."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pattern", nargs="?", default="", help="only run benchmarks whose names contain this")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timings to take of each benchmark")
+    args = parser.parse_args(argv)
+
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.is_file() else {"machine": None, "results": {}}
+    same_machine = baseline["machine"] == machine()
+    if baseline["results"] and not same_machine:
+        print(f"[-] Baseline is from {baseline['machine']}, only comparing tracked numbers", file=sys.stderr)
+
+    results = {}
+    regressions = []
+    for module, benchmarks in discover(args.pattern):
+        if hasattr(module, "setup"):
+            module.setup()
+        try:
+            for name, func in benchmarks:
+                base = baseline["results"].get(name)
+                value, status = run(name, func, base, args, same_machine=same_machine)
+                print(f"{name:<50} {format_value(name, value):>10} {format_value(name, base):>10}  {status}")
+                results[name] = value
+                if status.startswith("!"):
+                    regressions.append(name)
+        finally:
+            if hasattr(module, "teardown"):
+                module.teardown()
+
+    if args.save:
+        saved = baseline["results"] if same_machine else {}
+        BASELINE.write_text(
+            json.dumps({"machine": machine(), "results": dict(sorted((saved | results).items()))}, indent=2) + "\n"
+        )
+        print(f"[*] Saved {len(results)} results to {BASELINE}")
+    elif regressions:
+        print(f"[-] {len(regressions)} regression(s): {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+def test_compare() -> None:
+    """Tests that tracked numbers must match, and times only regress past both limits on the same machine."""
+    assert [compare("bench_e2e.track_http_calls", value, 3, 0.25, same_machine=False) for value in (3, 4)] == [
+        "ok",
+        "! changed",
+    ]
+    assert compare("bench_parser.time_parse", 2e-3, None, 0.25, same_machine=True) == "new"
+    assert [
+        compare("bench_parser.time_parse", value, 1e-3, 0.25, same_machine=True) for value in (1.2e-3, 1.3e-3)
+    ] == ["ok x1.20", "! slower x1.30"]
+    # too small a slowdown to tell from noise, however large a fraction it is
+    assert compare("bench_parser.time_tokenize", 2e-5, 1e-5, 0.25, same_machine=True) == "ok x2.00"
+    assert compare("bench_parser.time_parse", 2e-3, 1e-3, 0.25, same_machine=False) == "x2.00"
+
+
+def test_format_value() -> None:
+    """Tests that times get a readable unit and tracked numbers are shown as they are."""
+    assert [format_value("b.time_x", value) for value in (2.5, 2.5e-3, 2.5e-6, 2.5e-8, None)] == [
+        "2.50s",
+        "2.50ms",
+        "2.50us",
+        "25ns",
+        "-",
+    ]
+    assert format_value("b.track_x", 12.0) == "12"
+
+
+def test_recheck(monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that a slow timing is taken again before it counts, and a save keeps the median of its timings."""
+    timings = iter([2e-3, 1e-3, 5e-3, 1e-3, 2e-3])
+    monkeypatch.setitem(globals(), "measure", lambda _func, _repeat: next(timings))
+    args = argparse.Namespace(tolerance=0.25, repeat=1, save=False)
+    assert run("b.time_x", print, 1e-3, args, same_machine=True) == (1e-3, "ok x1.00")
+    args.save = True
+    assert run("b.time_x", print, 1e-3, args, same_machine=True) == (2e-3, "! slower x2.00")
+
+
+if __name__ == "__main__":
+    main()
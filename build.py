@@ -0,0 +1,117 @@
+"""Bundle the Python modules into one content-hashed zip that the browser can cache for good.
+
+Run `python build.py` before deploying. It writes `src/dist/modules-<hash>.zip` and `src/dist/manifest.json`,
+which `setup.py` reads at boot; without a manifest it falls back to fetching each module on its own.
+"""
+
+import hashlib
+import io
+import json
+import sys
+import zipfile
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent / "src"
+DIST_DIR = SRC_DIR / "dist"
+PACKAGES = ["core", "api", "ui"]
+# setup.py is what reads the manifest, so it's still fetched on its own, and the FS has no packages
+EXCLUDE = {"setup.py", "__init__.py"}
+HASH_LENGTH = 12
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)  # Fixed, so the hash only changes with the contents
+
+
+def collect_modules() -> dict[str, Path]:
+    """Find every module to bundle, by the flat name it's imported as in the pyodide FS."""
+    modules = {}
+    for package in PACKAGES:
+        for path in sorted((SRC_DIR / package).glob("*.py")):
+            if path.name in EXCLUDE:
+                continue
+            if path.name in modules:
+                msg = f"{path} and {modules[path.name]} would both be imported as {path.stem}"
+                raise ValueError(msg)
+            modules[path.name] = path
+    return modules
+
+
+def build_bundle(modules: dict[str, Path]) -> bytes:
+    """Zip the modules with fixed metadata, so the same sources always give the same bytes."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as bundle:
+        for name in sorted(modules):
+            info = zipfile.ZipInfo(name, date_time=ZIP_DATE)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            bundle.writestr(info, modules[name].read_bytes())
+    return buffer.getvalue()
+
+
+def main() -> None:
+    """Write the bundle and its manifest, removing bundles from earlier builds."""
+    modules = collect_modules()
+    data = build_bundle(modules)
+    digest = hashlib.sha256(data).hexdigest()
+    name = f"modules-{digest[:HASH_LENGTH]}.zip"
+
+    DIST_DIR.mkdir(exist_ok=True)
+    for old in DIST_DIR.glob("modules-*.zip"):
+        if old.name != name:
+            old.unlink()
+    (DIST_DIR / name).write_bytes(data)
+    manifest = {"bundle": f"./dist/{name}", "sha256": digest, "modules": sorted(modules)}
+    (DIST_DIR / "manifest.json").write_text(json.dumps(manifest, indent=2) + "\n")
+
+    print(f"[*] Bundled {len(modules)} modules into {DIST_DIR / name} ({len(data)} bytes)")
+
+
+def test_build_bundle(tmp_path: Path) -> None:
+    """Tests that the same sources always zip to the same bytes, whenever and in whatever order they're read."""
+    (tmp_path / "b.py").write_text("B = 2\n")
+    (tmp_path / "a.py").write_text("A = 1\n")
+    modules = {"b.py": tmp_path / "b.py", "a.py": tmp_path / "a.py"}
+    data = build_bundle(modules)
+    assert build_bundle(dict(reversed(modules.items()))) == data
+    with zipfile.ZipFile(io.BytesIO(data)) as bundle:
+        assert [(info.filename, info.date_time) for info in bundle.infolist()] == [
+            ("a.py", ZIP_DATE),
+            ("b.py", ZIP_DATE),
+        ]
+        assert bundle.read("b.py") == b"B = 2\n"
+
+
+def test_main(tmp_path: Path, monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that a build writes the bundle its manifest names, with its hash, and removes older bundles."""
+    import pytest  # noqa: PLC0415 Only the tests need pytest
+
+    for package in PACKAGES:
+        (tmp_path / package).mkdir()
+    (tmp_path / "core" / "executor.py").write_text("")
+    (tmp_path / "core" / "setup.py").write_text("")
+    (tmp_path / "api" / "transport.py").write_text("")
+    (tmp_path / "dist").mkdir()
+    (tmp_path / "dist" / "modules-old.zip").write_bytes(b"")
+    monkeypatch.setitem(globals(), "SRC_DIR", tmp_path)
+    monkeypatch.setitem(globals(), "DIST_DIR", tmp_path / "dist")
+
+    main()
+    manifest = json.loads((tmp_path / "dist" / "manifest.json").read_text())
+    data = (tmp_path / "dist" / manifest["bundle"].removeprefix("./dist/")).read_bytes()
+    assert (manifest["sha256"], manifest["modules"]) == (
+        hashlib.sha256(data).hexdigest(),
+        ["executor.py", "transport.py"],
+    )
+    assert [path.name for path in (tmp_path / "dist").glob("modules-*.zip")] == [
+        f"modules-{manifest['sha256'][:HASH_LENGTH]}.zip"
+    ]
+
+    (tmp_path / "ui" / "executor.py").write_text("")
+    with pytest.raises(ValueError, match="would both be imported as executor"):
+        collect_modules()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, ValueError) as e:
+        print(f"[-] Build failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,373 @@
+"""Run social queries from the command line, with no browser involved.
+
+Reads queries from the arguments or a file, one per line, runs them concurrently over one session so they
+share its kept-alive connections and profile cache, and streams the rows to stdout as NDJSON or CSV. A CREATE
+TEMP TABLE or DROP TABLE waits for the queries before it, and the queries after it wait for it:
+
+    python cli.py "SELECT handle, followerscount FROM profile WHERE actor='bsky.app'"
+    python cli.py --file nightly.sql --actors accounts.txt --format csv > scan.csv
+
+A query containing `{actor}` runs once for every line of the --actors file. Log in with --username and the
+BSKY_PASSWORD environment variable, or leave them out for stealth mode. A WATCH query keeps writing the new
+rows of each refresh until interrupted:
+
+    python cli.py "SELECT post_author_handle, post_record_text FROM timeline WATCH 30" --username me.bsky.social
+
+A query of the stream table writes the firehose's events as they arrive, until its LIMIT or an interrupt:
+
+    python cli.py "SELECT did, record_text FROM stream WHERE collection = 'app.bsky.feed.post'"
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import TextIO
+
+SRC_DIR = Path(__file__).parent / "src"
+# The modules import each other by flat name, as they're laid out in the pyodide FS
+sys.path[:0] = [str(SRC_DIR / "core"), str(SRC_DIR / "api")]
+
+from auth_session import BskySession  # noqa: E402
+from executor import (  # noqa: E402
+    Plan,
+    QueryError,
+    columns,
+    compile_query,
+    explain_rows,
+    get_created,
+    get_dropped,
+    scan_stats,
+    stream,
+)
+from export import FileSink, export, exporter_for  # noqa: E402
+from parser import parse, tokenize  # noqa: E402
+from scheduler import follow  # noqa: E402
+from tracing import TRACER  # noqa: E402
+from transport import MAX_CONNECTIONS, HttpSession  # noqa: E402
+
+DEFAULT_CONCURRENCY = 8  # Queries in flight at once
+ACTOR_PLACEHOLDER = "{actor}"
+QUERY_COLUMN = "_query"  # Which query a row came from, added when there's more than one
+
+
+def read_lines(path: str) -> list[str]:
+    """Read the non-blank lines of a file, or of stdin for `-`, skipping `--` comments."""
+    text = sys.stdin.read() if path == "-" else Path(path).read_text()
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith("--")]
+
+
+def expand_queries(queries: list[str], actors: list[str]) -> list[str]:
+    """Run every query containing `{actor}` once for each actor, keeping the others as they are."""
+    for actor in actors:
+        if "'" in actor:
+            msg = f"Actor {actor!r} can't contain a quote"
+            raise ValueError(msg)
+    result = []
+    for query in queries:
+        if ACTOR_PLACEHOLDER in query:
+            result.extend(query.replace(ACTOR_PLACEHOLDER, actor) for actor in actors)
+        else:
+            result.append(query)
+    return result
+
+
+def waits_for(queries: list[str]) -> list[list[int]]:
+    """Find the earlier queries each query has to wait for before it's compiled.
+
+    A CREATE TEMP TABLE or DROP TABLE waits for every query before it, and the queries after it wait for it,
+    so each sees the temp tables as the queries before it left them.
+    """
+    result = []
+    last = None  # The latest CREATE or DROP so far
+    for index, query in enumerate(queries):
+        tree = parse(tokenize(query))
+        if get_created(tree) is not None or get_dropped(tree) is not None:
+            result.append(list(range(index)))
+            last = index
+        else:
+            result.append([] if last is None else [last])
+    return result
+
+
+class NdjsonWriter:
+    """Write each row as a JSON object on its own line."""
+
+    def __init__(self, out: TextIO, *, tag: bool) -> None:
+        self.out = out
+        self.tag = tag
+
+    def write(self, index: int, head: list[str], rows: list[dict]) -> None:
+        """Write a batch of rows from one query."""
+        for row in rows:
+            record = {k: row.get(k) for k in head}
+            if self.tag:
+                record = {QUERY_COLUMN: index, **record}
+            self.out.write(json.dumps(record, default=str) + "\n")
+        self.out.flush()
+
+
+class CsvWriter:
+    """Write rows as CSV, with the header taken from the first batch written.
+
+    Queries that select other columns get blanks for the missing ones and lose the extra ones, so mixing
+    differently shaped queries in one run is better done with NDJSON.
+    """
+
+    def __init__(self, out: TextIO, *, tag: bool) -> None:
+        self.out = out
+        self.tag = tag
+        self.writer = None
+        self.warned = False
+
+    def write(self, index: int, head: list[str], rows: list[dict]) -> None:
+        """Write a batch of rows from one query."""
+        if self.writer is None:
+            fieldnames = [QUERY_COLUMN, *head] if self.tag else head
+            self.writer = csv.DictWriter(self.out, fieldnames, extrasaction="ignore", restval="")
+            self.writer.writeheader()
+        elif not self.warned and set(head) - set(self.writer.fieldnames):
+            print(f"[-] Query {index} has columns missing from the CSV header, use --format ndjson", file=sys.stderr)
+            self.warned = True
+        for row in rows:
+            self.writer.writerow({QUERY_COLUMN: index, **row} if self.tag else row)
+        self.out.flush()
+
+
+WRITERS = {"ndjson": NdjsonWriter, "csv": CsvWriter}
+
+
+async def run_query(  # noqa: PLR0913
+    index: int,
+    query: str,
+    session: BskySession,
+    writer: NdjsonWriter | CsvWriter,
+    limit: asyncio.Semaphore,
+    *,
+    after: list[asyncio.Event],
+    ran: asyncio.Event,
+) -> int | None:
+    """Run one query, writing its rows as they arrive and returning how many there were, or None if it failed.
+
+    It starts once every event in `after` is set, and sets `ran` when its first run is over, whether or not it
+    failed. A failure is reported on stderr with its query, and the other queries carry on.
+    """
+    try:
+        try:
+            # outside the limit, so waiting doesn't hold a slot the queries it waits for need
+            await asyncio.gather(*(event.wait() for event in after))
+            async with limit:
+                record = TRACER.begin_query(query)
+                plan = compile_query(query)
+                count = await _run_plan(index, plan, session, writer)
+                TRACER.end_query(record, count, scan_stats(plan))
+        finally:
+            ran.set()
+        if plan.watch is not None and plan.explain is None:
+            # outside the limit, since a watch waits most of the time and never finishes
+            count += await _follow(index, query, plan, session, writer)
+    except BrokenPipeError:
+        # stdout is gone, which stops every query, and main() handles it
+        raise
+    except QueryError as e:
+        message = str(e)
+    except OSError as e:
+        message = f"network error, {e or type(e).__name__}"
+    except Exception as e:  # noqa: BLE001 One broken query mustn't stop the others
+        message = f"{type(e).__name__}: {e}"
+    else:
+        return count
+    print(f"[-] Query {index} ({query}): {message}", file=sys.stderr)
+    return None
+
+
+async def _follow(index: int, query: str, plan: Plan, session: BskySession, writer: NdjsonWriter | CsvWriter) -> int:
+    """Write the rows each refresh of a WATCH query adds, until interrupted, reporting failed refreshes on stderr."""
+    count = 0
+    async for update in follow(query, plan, session):
+        if isinstance(update, str):
+            print(f"[-] Query {index} ({query}): {update}, trying again in {plan.watch}s", file=sys.stderr)
+            continue
+        refresh, batch = update
+        if batch:
+            writer.write(index, columns(refresh, batch), batch)
+        count += len(batch)
+    return count
+
+
+async def _run_plan(index: int, plan: Plan, session: BskySession, writer: NdjsonWriter | CsvWriter) -> int:
+    if plan.explain == "EXPLAIN":
+        rows = explain_rows(plan)
+        writer.write(index, list(rows[0]), rows)
+        return len(rows)
+    if plan.outfile and plan.explain is None:
+        count = await export(plan, session, exporter_for(plan.outfile)(), FileSink(plan.outfile))
+        print(f"[*] Query {index} wrote {count} row(s) to {plan.outfile}", file=sys.stderr)
+        return count
+
+    count = 0
+    async for batch in stream(plan, session):
+        if plan.explain is None:
+            writer.write(index, columns(plan, batch), batch)
+        count += len(batch)
+    if plan.explain is not None:
+        # EXPLAIN ANALYZE, the rows are only run for their counters
+        rows = explain_rows(plan, analyze=True)
+        writer.write(index, list(rows[0]), rows)
+    return count
+
+
+async def run(queries: list[str], args: argparse.Namespace) -> int:
+    """Run every query, returning how many failed."""
+    client = HttpSession(max_connections=max(args.concurrency, MAX_CONNECTIONS))
+    session = BskySession(args.username or "", os.environ.get("BSKY_PASSWORD", ""), args.pds, client)
+    writer = WRITERS[args.format](sys.stdout, tag=len(queries) > 1)
+    limit = asyncio.Semaphore(args.concurrency)
+    start = time.perf_counter()
+    try:
+        if args.username and not await session.login():
+            print(f"[-] Couldn't log in as {args.username}", file=sys.stderr)
+            return len(queries)
+        ran = [asyncio.Event() for _ in queries]
+        results = await asyncio.gather(
+            *(
+                run_query(i, query, session, writer, limit, after=[ran[j] for j in waits], ran=ran[i])
+                for i, (query, waits) in enumerate(zip(queries, waits_for(queries), strict=True))
+            )
+        )
+    finally:
+        client.close()
+        if args.trace:
+            Path(args.trace).write_text(TRACER.chrome_trace())
+
+    failed = results.count(None)
+    if not args.quiet:
+        stats = client.stats
+        print(
+            f"[*] {len(queries) - failed}/{len(queries)} queries, {sum(filter(None, results))} rows"
+            f" in {time.perf_counter() - start:.2f}s, {stats['http_calls']} HTTP calls, {stats['bytes']} bytes,"
+            f" {stats['cache_hits']} cache hits",
+            file=sys.stderr,
+        )
+    return failed
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Parse the command line, run the queries and exit non-zero if any failed."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("queries", nargs="*", help="queries to run, after any read from --file")
+    parser.add_argument("-f", "--file", help="file of queries, one per line, or - for stdin")
+    parser.add_argument("--actors", help="file of actors to run each {actor} query for, one per line")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="ndjson")
+    parser.add_argument("-j", "--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="queries run at once")
+    parser.add_argument("--pds", help="send every call to this host, e.g. a local mock_appview.py")
+    parser.add_argument("--username", help="log in as this handle, with the password from $BSKY_PASSWORD")
+    parser.add_argument("--trace", help="write timing spans of the last queries to this file as a Chrome trace")
+    parser.add_argument("-q", "--quiet", action="store_true", help="don't print the summary to stderr")
+    args = parser.parse_args(argv)
+
+    try:
+        queries = [*(read_lines(args.file) if args.file else []), *args.queries]
+        if args.actors:
+            queries = expand_queries(queries, read_lines(args.actors))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not queries:
+        parser.error("no queries given")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    try:
+        failed = asyncio.run(run(queries, args))
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        # stdout was closed early, e.g. piped into head, so stop quietly without flushing it again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    sys.exit(1 if failed else 0)
+
+
+def test_expand_queries() -> None:
+    """Tests that only the queries with `{actor}` run once per actor, and that quoted actors are refused."""
+    import pytest  # noqa: PLC0415 Only the tests need pytest
+
+    queries = ["SELECT * FROM profile WHERE actor = '{actor}'", "SELECT * FROM tables"]
+    assert expand_queries(queries, ["a.test", "b.test"]) == [
+        "SELECT * FROM profile WHERE actor = 'a.test'",
+        "SELECT * FROM profile WHERE actor = 'b.test'",
+        "SELECT * FROM tables",
+    ]
+    with pytest.raises(ValueError, match="can't contain a quote"):
+        expand_queries(queries, ["a' OR 1=1 --"])
+
+
+def test_failed_query(capsys) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that a failed query is reported on stderr and fails the run, without stopping the others."""
+    import pytest  # noqa: PLC0415 Only the tests need pytest
+    from mock_appview import Dataset, start_server  # noqa: PLC0415 Only the tests need the mock server
+
+    server = start_server(Dataset(actors=20, posts=5, follows=10), port=0)
+    try:
+        with pytest.raises(SystemExit) as exit_info:
+            main(
+                [
+                    "SELECT * FROM nowhere",
+                    "SELECT handle FROM profile WHERE actor = 'user1.test'",
+                    "--pds",
+                    f"http://localhost:{server.server_address[1]}",
+                    "--quiet",
+                ]
+            )
+    finally:
+        server.shutdown()
+    out, err = capsys.readouterr()
+    assert exit_info.value.code == 1
+    assert err.startswith("[-] Query 0 (SELECT * FROM nowhere): ")
+    assert [json.loads(line) for line in out.splitlines()] == [{"_query": 1, "handle": "user1.test"}]
+
+
+def test_waits_for() -> None:
+    """Tests that a CREATE or DROP waits for the queries before it, and the queries after it wait for it."""
+    queries = [
+        "SELECT * FROM tables",
+        "CREATE TEMP TABLE fans AS SELECT handle FROM followers WHERE actor = 'a'",
+        "SELECT * FROM fans",
+        "SELECT COUNT(*) FROM fans",
+        "DROP TABLE fans",
+    ]
+    assert waits_for(queries) == [[], [0], [1], [1], [0, 1, 2, 3]]
+
+
+def test_create_then_select(capsys) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that a query selecting from a temp table made by an earlier one in the same run sees it."""
+    import pytest  # noqa: PLC0415 Only the tests need pytest
+    from mock_appview import Dataset, start_server  # noqa: PLC0415 Only the tests need the mock server
+
+    server = start_server(Dataset(actors=20, posts=5, follows=10), port=0)
+    try:
+        with pytest.raises(SystemExit) as exit_info:
+            main(
+                [
+                    "CREATE TEMP TABLE fans AS SELECT handle FROM followers WHERE actor = 'user1.test'",
+                    "SELECT COUNT(*) FROM fans",
+                    "DROP TABLE fans",
+                    "--pds",
+                    f"http://localhost:{server.server_address[1]}",
+                    "--quiet",
+                ]
+            )
+    finally:
+        server.shutdown()
+    out, err = capsys.readouterr()
+    assert (exit_info.value.code, err) == (0, "")
+    rows = [json.loads(line) for line in out.splitlines()]
+    assert {"_query": 1, "COUNT(*)": 10} in rows
+
+
+if __name__ == "__main__":
+    main()
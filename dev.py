@@ -1,29 +1,11 @@
-import http.server
-import os
-import socketserver
-import sys
-from pathlib import Path
+"""Serve src/ for development, every file is sent with Cache-Control: no-store so edits show on reload.
+
+Takes the same options as serve.py, like --port.
+"""
 
-# use src as start point
-src_dir = Path(__file__).parent / "src"
-if src_dir.exists():
-    os.chdir(src_dir)
-    print(f"[*] Serving from: {src_dir.absolute()}")
-else:
-    print("[-] src/ dir not found")
-    sys.exit(1)
+import sys
 
-PORT = 8000
-Handler = http.server.SimpleHTTPRequestHandler
+from serve import main
 
-try:
-    with socketserver.TCPServer(("", PORT), Handler) as httpd:
-        print(f"[*] Server running at: http://localhost:{PORT}")
-        print(f"[*] Open: http://localhost:{PORT}/")
-        print("[-] Press Ctrl+C to stop")
-        httpd.serve_forever()
-except KeyboardInterrupt:
-    print("\nServer stopped")
-except OSError as e:
-    print(f"[-] Error: {e}")
-    print("[-] Try a different port: python dev.py --port 8001")
+if __name__ == "__main__":
+    main(["--dev", *sys.argv[1:]])
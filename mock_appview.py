@@ -0,0 +1,724 @@
+"""Local stand-in for the Bluesky XRPC API, for load and regression testing without the network.
+
+Serves the endpoints BskySession uses from synthetic, cursor-paginated data whose size is set on the command
+line, with optional latency and a per-client rate limit:
+
+    python mock_appview.py --port 2583 --actors 5000 --latency 80 --rate 3000
+
+Point the app at it with `?pds=http://localhost:2583` in the page URL, or `BskySession(..., pds_host=...)`.
+Any actor `user<n>.test` can log in with the password given by --password.
+
+It also stands in for Jetstream at `ws://localhost:2583/subscribe`, sending synthetic commit and identity
+events at --events-per-second, or replaying a recording of the real firehose given with --events:
+
+    python mock_appview.py --events recorded.ndjson --events-per-second 0
+"""
+
+import argparse
+import base64
+import contextlib
+import hashlib
+import itertools
+import json
+import random
+import select
+import socket
+import threading
+import time
+from collections.abc import Callable, Iterator
+from datetime import UTC, datetime, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_PORT = 2583
+MAX_LIMIT = 100  # The largest `limit` the list endpoints accept
+MAX_PROFILES = 25  # The most actors getProfiles accepts
+SEARCH_SCAN = 20_000  # Posts searchPosts looks at per call before handing back a cursor
+TOPICS = ["python", "sql", "bluesky", "pyodide", "retro", "ascii", "databases", "weather"]
+BASE_TIME = datetime(2025, 1, 1, tzinfo=UTC)
+BASE_TIME_US = int(BASE_TIME.timestamp() * 1_000_000)  # When the first synthetic event happened
+EVENT_COLLECTIONS = ["app.bsky.feed.post", "app.bsky.feed.like", "app.bsky.feed.repost", "app.bsky.graph.follow"]
+IDENTITY_EVERY = 50  # Every this many synthetic events, one is an identity event rather than a commit
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"  # Hashed with the client's key to accept a handshake
+LENGTH_16, LENGTH_64 = 126, 127  # Frame length markers, for payloads that don't fit in 7 or 16 bits
+
+
+class XrpcError(Exception):
+    """An error response in the XRPC shape, `{"error": ..., "message": ...}`."""
+
+    def __init__(self, status: HTTPStatus, error: str, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+        self.error = error
+
+
+def _timestamp(moment: datetime) -> str:
+    return moment.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class Dataset:
+    """Synthetic actors, posts and follows, computed from their index so any size costs no memory.
+
+    Actor `i` follows `i + offset` for a fixed set of offsets, so its followers are `i - offset`. Posts made
+    since the start, set by `newer` or one per actor every `post_every` seconds, get negative numbers.
+    """
+
+    def __init__(
+        self, actors: int = 1000, posts: int = 100, follows: int = 150, seed: int = 0, post_every: float = 0
+    ) -> None:
+        if actors < 2:  # noqa: PLR2004 Nobody to follow otherwise
+            msg = "Need at least 2 actors"
+            raise ValueError(msg)
+        self.actors = actors
+        self.posts = posts
+        self.newer = 0
+        self.post_every = post_every
+        self.started = time.monotonic()
+        self.offsets = random.Random(seed).sample(  # noqa: S311 Not crypto
+            range(1, actors), min(follows, actors - 1)
+        )
+
+    def new_posts(self) -> int:
+        """Get how many posts each actor has made since the start, numbered -1 down to minus this."""
+        if not self.post_every:
+            return self.newer
+        return self.newer + int((time.monotonic() - self.started) / self.post_every)
+
+    def handle(self, i: int) -> str:
+        """Get the handle of actor i."""
+        return f"user{i}.test"
+
+    def did(self, i: int) -> str:
+        """Get the DID of actor i."""
+        return f"did:plc:mock{i:08d}"
+
+    def index(self, actor: str) -> int:
+        """Find an actor by handle or DID."""
+        name = actor.lower().removeprefix("did:plc:mock").removeprefix("user").removesuffix(".test")
+        if (
+            name.isdigit()
+            and int(name) < self.actors
+            and actor.lower() in (self.handle(int(name)), self.did(int(name)))
+        ):
+            return int(name)
+        raise XrpcError(HTTPStatus.BAD_REQUEST, "InvalidRequest", "Profile not found")
+
+    def follows(self, i: int) -> list[int]:
+        """Get the actors i follows."""
+        return [(i + offset) % self.actors for offset in self.offsets]
+
+    def followers(self, i: int) -> list[int]:
+        """Get the actors following i."""
+        return [(i - offset) % self.actors for offset in self.offsets]
+
+    def profile_basic(self, i: int) -> dict:
+        """Get actor i as a profileViewBasic."""
+        return {"did": self.did(i), "handle": self.handle(i), "displayName": f"User {i}"}
+
+    def profile(self, i: int) -> dict:
+        """Get actor i as a profileViewDetailed."""
+        return {
+            **self.profile_basic(i),
+            "description": f"Synthetic account {i}, interested in {TOPICS[i % len(TOPICS)]}",
+            "followersCount": len(self.offsets),
+            "followsCount": len(self.offsets),
+            "postsCount": self.posts,
+            "createdAt": _timestamp(BASE_TIME - timedelta(days=365 + i % 365)),
+            "indexedAt": _timestamp(BASE_TIME),
+        }
+
+    def post(self, i: int, j: int) -> dict:
+        """Get post j of actor i, newest first, as a feedViewPost."""
+        created = _timestamp(BASE_TIME - timedelta(seconds=j * 3600 + i * 13))
+        topic = TOPICS[(i + j) % len(TOPICS)]
+        mention = self.handle((i + j + 1) % self.actors)
+        uri = f"at://{self.did(i)}/app.bsky.feed.post/{j:06d}"
+        post = {
+            "uri": uri,
+            "cid": hashlib.sha256(uri.encode()).hexdigest()[:32],
+            "author": self.profile_basic(i),
+            "record": {
+                "$type": "app.bsky.feed.post",
+                "text": f"Post {j} from user {i} about #{topic}, hi @{mention}",
+                "createdAt": created,
+                "tags": [topic],
+            },
+            "replyCount": (i + j) % 7,
+            "repostCount": (i * 31 + j * 17) % 50,
+            "likeCount": (i * 7919 + j * 104729) % 1000,
+            "quoteCount": (i + 2 * j) % 3,
+            "indexedAt": created,
+        }
+        if j % 5 == 0:
+            post["embed"] = {
+                "$type": "app.bsky.embed.images#view",
+                "images": [
+                    {
+                        "thumb": f"https://cdn.example/img/{i}/{j}/thumb@jpeg",
+                        "fullsize": f"https://cdn.example/img/{i}/{j}/full@jpeg",
+                        "alt": f"Picture {j} from user {i}",
+                    }
+                ],
+            }
+        return {"post": post}
+
+    def event(self, n: int) -> dict:
+        """Get event n of the firehose as Jetstream sends it, cycling through collections by actor n."""
+        i = n % self.actors
+        time_us = BASE_TIME_US + n * 1000
+        created = _timestamp(BASE_TIME + timedelta(milliseconds=n))
+        if n % IDENTITY_EVERY == IDENTITY_EVERY - 1:
+            identity = {"did": self.did(i), "handle": self.handle(i), "seq": n, "time": created}
+            return {"did": self.did(i), "time_us": time_us, "kind": "identity", "identity": identity}
+
+        collection = EVENT_COLLECTIONS[n % len(EVENT_COLLECTIONS)]
+        other = (i + n // self.actors + 1) % self.actors or 1
+        record = {"$type": collection, "createdAt": created}
+        if collection == "app.bsky.feed.post":
+            record |= {"text": f"Live post {n} from user {i} about #{TOPICS[n % len(TOPICS)]}", "langs": ["en"]}
+        elif collection == "app.bsky.graph.follow":
+            record["subject"] = self.did(other)
+        else:
+            uri = f"at://{self.did(other)}/app.bsky.feed.post/{n % self.posts:06d}"
+            record["subject"] = {"uri": uri, "cid": hashlib.sha256(uri.encode()).hexdigest()[:32]}
+        rkey = f"live{n:09d}"
+        commit = {
+            "rev": rkey,
+            "operation": "create",
+            "collection": collection,
+            "rkey": rkey,
+            "record": record,
+            "cid": hashlib.sha256(f"{self.did(i)}/{rkey}".encode()).hexdigest()[:32],
+        }
+        return {"did": self.did(i), "time_us": time_us, "kind": "commit", "commit": commit}
+
+
+class RateLimiter:
+    """A token bucket per client, refilled evenly over the window like the real API's limits."""
+
+    def __init__(self, limit: int, window: float) -> None:
+        self.limit = limit
+        self.window = window
+        self.buckets: dict[str, tuple[float, float]] = {}
+        self.lock = threading.Lock()
+
+    def take(self, client: str) -> tuple[bool, int, int]:
+        """Spend a token for the client, returning (allowed, tokens remaining, epoch when full again)."""
+        now = time.time()
+        with self.lock:
+            tokens, updated = self.buckets.get(client, (self.limit, now))
+            tokens = min(self.limit, tokens + (now - updated) * self.limit / self.window)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[client] = (tokens, now)
+        reset = int(now + (self.limit - tokens) * self.window / self.limit)
+        return allowed, int(tokens), reset
+
+
+def _page(items: list, params: dict[str, list[str]]) -> tuple[list, str | None]:
+    """Slice a list by the `limit` and offset `cursor` parameters."""
+    limit = _limit(params)
+    start = _cursor(params)
+    end = start + limit
+    return items[start:end], str(end) if end < len(items) else None
+
+
+def _limit(params: dict[str, list[str]]) -> int:
+    limit = _param(params, "limit") or "50"
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_LIMIT:
+        raise XrpcError(HTTPStatus.BAD_REQUEST, "InvalidRequest", f"limit must be 1-{MAX_LIMIT}")
+    return int(limit)
+
+
+def _cursor(params: dict[str, list[str]]) -> int:
+    cursor = _param(params, "cursor") or "0"
+    if not cursor.isdigit():
+        raise XrpcError(HTTPStatus.BAD_REQUEST, "InvalidRequest", "Malformed cursor")
+    return int(cursor)
+
+
+def _event_filter(params: dict[str, list[str]]) -> Callable[[dict], bool]:
+    """Build the check of whether a subscription wants an event, like Jetstream's own filters.
+
+    Identity and account events belong to no collection, so they're sent whatever the collections asked for.
+    """
+    collections = params.get("wantedCollections", [])
+    dids = set(params.get("wantedDids", []))
+
+    def wanted(event: dict) -> bool:
+        if dids and event.get("did") not in dids:
+            return False
+        if not collections or event.get("kind") != "commit":
+            return True
+        collection = event["commit"]["collection"]
+        return any(
+            collection == want or (want.endswith(".*") and collection.startswith(want[:-1])) for want in collections
+        )
+
+    return wanted
+
+
+def _text_frame(text: str) -> bytes:
+    """Build a server's text frame, which is unmasked."""
+    payload = text.encode()
+    if len(payload) < LENGTH_16:
+        header = bytes([0x81, len(payload)])
+    elif len(payload) < 1 << 16:
+        header = bytes([0x81, LENGTH_16]) + len(payload).to_bytes(2)
+    else:
+        header = bytes([0x81, LENGTH_64]) + len(payload).to_bytes(8)
+    return header + payload
+
+
+def _param(params: dict[str, list[str]], name: str, *, required: bool = False) -> str:
+    value = params.get(name, [""])[0]
+    if required and not value:
+        raise XrpcError(HTTPStatus.BAD_REQUEST, "InvalidRequest", f"Error: Params must have the property {name}")
+    return value
+
+
+class XrpcHandler(BaseHTTPRequestHandler):
+    """Answer XRPC calls from the server's dataset, sessions and rate limiter."""
+
+    server_version = "MockAppView"
+    protocol_version = "HTTP/1.1"
+
+    def do_OPTIONS(self) -> None:
+        """Answer CORS preflights, the app runs on another origin."""
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Headers", "Authorization, Content-Type")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: object) -> None:
+        """Log a request unless the server is quiet."""
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def do_GET(self) -> None:
+        """Answer a query, or a Jetstream subscription."""
+        if urlsplit(self.path).path == "/subscribe":
+            self._subscribe()
+        else:
+            self._handle()
+
+    def do_POST(self) -> None:
+        """Answer a procedure."""
+        self._handle()
+
+    def _handle(self) -> None:
+        headers = {}
+        try:
+            body = self._dispatch(headers)
+            status = HTTPStatus.OK
+        except XrpcError as e:
+            status, body = e.status, {"error": e.error, "message": str(e)}
+        self._send_json(status, body, headers)
+
+    def _dispatch(self, headers: dict[str, str]) -> dict:
+        """Apply the rate limit and latency, then call the endpoint, adding any response headers."""
+        server = self.server
+        if server.limiter is not None:
+            allowed, remaining, reset = server.limiter.take(self.client_address[0])
+            headers["RateLimit-Limit"] = str(server.limiter.limit)
+            headers["RateLimit-Remaining"] = str(remaining)
+            headers["RateLimit-Reset"] = str(reset)
+            headers["RateLimit-Policy"] = f"{server.limiter.limit};w={int(server.limiter.window)}"
+            if not allowed:
+                raise XrpcError(HTTPStatus.TOO_MANY_REQUESTS, "RateLimitExceeded", "Rate Limit Exceeded")
+        if server.latency or server.jitter:
+            time.sleep((server.latency + random.uniform(0, server.jitter)) / 1000)  # noqa: S311 Not crypto
+
+        url = urlsplit(self.path)
+        nsid = url.path.removeprefix("/xrpc/")
+        method = ROUTES.get(nsid)
+        if method is None:
+            raise XrpcError(HTTPStatus.NOT_IMPLEMENTED, "MethodNotImplemented", f"{nsid} isn't mocked")
+        return method(self, parse_qs(url.query))
+
+    def _subscribe(self) -> None:
+        """Upgrade to a WebSocket and send the events the subscription wants until the client goes away."""
+        key = self.headers.get("Sec-WebSocket-Key")
+        if self.headers.get("Upgrade", "").lower() != "websocket" or not key:
+            body = {"error": "InvalidRequest", "message": "Expected a WebSocket upgrade"}
+            self._send_json(HTTPStatus.BAD_REQUEST, body, {})
+            return
+        digest = hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()  # noqa: S324 The handshake is defined with SHA-1
+        self.send_response(HTTPStatus.SWITCHING_PROTOCOLS)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", base64.b64encode(digest).decode())
+        self.end_headers()
+        self.close_connection = True
+
+        params = parse_qs(urlsplit(self.path).query)
+        wanted = _event_filter(params)
+        interval = 1 / self.server.events_per_second if self.server.events_per_second else 0
+        try:
+            for event in self._events(params):
+                if not wanted(event):
+                    continue
+                if self._client_closed():
+                    return
+                self.wfile.write(_text_frame(json.dumps(event, separators=(",", ":"))))
+                if interval:
+                    time.sleep(interval)
+            # a recording has played to the end, stay connected like a quiet firehose
+            while not self._client_closed(timeout=1):
+                pass
+        except OSError:
+            return
+
+    def _events(self, params: dict[str, list[str]]) -> Iterator[dict]:
+        """Yield the recorded events, or endless synthetic ones, after the `cursor` time_us if there is one."""
+        cursor = _param(params, "cursor")
+        after = int(cursor) if cursor.isdigit() else None
+        if self.server.events is not None:
+            return (event for event in self.server.events if after is None or event.get("time_us", 0) > after)
+        start = 0 if after is None else max(0, (after - BASE_TIME_US) // 1000 + 1)
+        return map(self.server.data.event, itertools.count(start))
+
+    def _client_closed(self, timeout: float = 0) -> bool:
+        """Check whether the client sent its close frame or hung up, the only things a subscriber sends."""
+        readable, _, _ = select.select([self.connection], [], [], timeout)
+        if not readable:
+            return False
+        with contextlib.suppress(OSError):
+            self.connection.recv(4096)
+            self.connection.shutdown(socket.SHUT_RDWR)
+        return True
+
+    def _send_json(self, status: HTTPStatus, body: dict, headers: dict[str, str]) -> None:
+        data = json.dumps(body, separators=(",", ":")).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _viewer(self, *, required: bool = True) -> int | None:
+        """Find the logged in actor from the access token."""
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        viewer = self.server.sessions.get(("access", token))
+        if viewer is None and required:
+            raise XrpcError(HTTPStatus.UNAUTHORIZED, "AuthMissing", "Authentication Required")
+        return viewer
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            raise XrpcError(HTTPStatus.BAD_REQUEST, "InvalidRequest", "Body isn't JSON") from e
+
+    def _new_session(self, viewer: int) -> dict:
+        data = self.server.data
+        with self.server.lock:
+            self.server.issued += 1
+            issued = self.server.issued
+        tokens = {"accessJwt": f"mock-access-{viewer}-{issued}", "refreshJwt": f"mock-refresh-{viewer}-{issued}"}
+        self.server.sessions["access", tokens["accessJwt"]] = viewer
+        self.server.sessions["refresh", tokens["refreshJwt"]] = viewer
+        return {**tokens, "did": data.did(viewer), "handle": data.handle(viewer), "active": True}
+
+    # endpoints
+    def create_session(self, _: dict) -> dict:
+        """com.atproto.server.createSession."""
+        body = self._body()
+        try:
+            viewer = self.server.data.index(str(body.get("identifier", "")))
+        except XrpcError:
+            viewer = None
+        if viewer is None or body.get("password") != self.server.password:
+            raise XrpcError(HTTPStatus.UNAUTHORIZED, "AuthenticationRequired", "Invalid identifier or password")
+        return self._new_session(viewer)
+
+    def refresh_session(self, _: dict) -> dict:
+        """com.atproto.server.refreshSession."""
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        viewer = self.server.sessions.pop(("refresh", token), None)
+        if viewer is None:
+            raise XrpcError(HTTPStatus.BAD_REQUEST, "ExpiredToken", "Token has expired")
+        return self._new_session(viewer)
+
+    def get_profile(self, params: dict) -> dict:
+        """app.bsky.actor.getProfile."""
+        return self.server.data.profile(self.server.data.index(_param(params, "actor", required=True)))
+
+    def get_profiles(self, params: dict) -> dict:
+        """app.bsky.actor.getProfiles, leaving out actors that don't exist."""
+        actors = params.get("actors", [])
+        if not actors or len(actors) > MAX_PROFILES:
+            raise XrpcError(HTTPStatus.BAD_REQUEST, "InvalidRequest", f"actors must have 1-{MAX_PROFILES} items")
+        profiles = []
+        for actor in actors:
+            try:
+                profiles.append(self.server.data.profile(self.server.data.index(actor)))
+            except XrpcError:
+                continue
+        return {"profiles": profiles}
+
+    def get_author_feed(self, params: dict) -> dict:
+        """app.bsky.feed.getAuthorFeed."""
+        data = self.server.data
+        i = data.index(_param(params, "actor", required=True))
+        limit, start = _limit(params), _cursor(params)
+        new = data.new_posts()
+        total = data.posts + new
+        end = min(start + limit, total)
+        feed = [data.post(i, j - new) for j in range(start, end)]
+        return {"feed": feed, "cursor": str(end) if end < total else None}
+
+    def get_timeline(self, params: dict) -> dict:
+        """app.bsky.feed.getTimeline, taking a post from each followed actor in turn."""
+        data = self.server.data
+        follows = data.follows(self._viewer())
+        limit, start = _limit(params), _cursor(params)
+        new = data.new_posts()
+        total = len(follows) * (data.posts + new)
+        end = min(start + limit, total)
+        feed = [data.post(follows[k % len(follows)], k // len(follows) - new) for k in range(start, end)]
+        return {"feed": feed, "cursor": str(end) if end < total else None}
+
+    def _actor_list(self, key: str, actors: list[int], params: dict) -> dict:
+        page, cursor = _page(actors, params)
+        return {key: [self.server.data.profile_basic(i) for i in page], "cursor": cursor}
+
+    def get_followers(self, params: dict) -> dict:
+        """app.bsky.graph.getFollowers."""
+        i = self.server.data.index(_param(params, "actor", required=True))
+        return {
+            "subject": self.server.data.profile_basic(i),
+            **self._actor_list("followers", self.server.data.followers(i), params),
+        }
+
+    def get_follows(self, params: dict) -> dict:
+        """app.bsky.graph.getFollows."""
+        i = self.server.data.index(_param(params, "actor", required=True))
+        return {
+            "subject": self.server.data.profile_basic(i),
+            **self._actor_list("follows", self.server.data.follows(i), params),
+        }
+
+    def get_known_followers(self, params: dict) -> dict:
+        """app.bsky.graph.getKnownFollowers, the actor's followers that the viewer follows."""
+        data = self.server.data
+        i = data.index(_param(params, "actor", required=True))
+        known = set(data.follows(self._viewer()))
+        followers = [f for f in data.followers(i) if f in known]
+        return {"subject": data.profile_basic(i), **self._actor_list("followers", followers, params)}
+
+    def search_posts(self, params: dict) -> dict:
+        """app.bsky.feed.searchPosts, matching every word of `q` (`*` for anything) and the filters."""
+        data = self.server.data
+        terms = [t for t in _param(params, "q", required=True).lower().split() if t != "*"]
+        author = _param(params, "author")
+        author = data.index(author) if author else None
+        tag, mentions = _param(params, "tag").lower(), _param(params, "mentions").lower()
+        since, until = _param(params, "since"), _param(params, "until")
+        limit, start = _limit(params), _cursor(params)
+
+        new = data.new_posts()
+        total = data.posts + new if author is not None else data.actors * (data.posts + new)
+        posts, k = [], start
+        while k < min(total, start + SEARCH_SCAN) and len(posts) < limit:
+            i, j = (author, k) if author is not None else (k % data.actors, k // data.actors)
+            k += 1
+            view = data.post(i, j - new)
+            record = view["post"]["record"]
+            text = record["text"].lower()
+            if (
+                all(term in text for term in terms)
+                and (not tag or tag in record["tags"])
+                and (not mentions or f"@{mentions}" in text)
+                and (not since or record["createdAt"] >= since)
+                and (not until or record["createdAt"] < until)
+            ):
+                posts.append(view["post"])
+        return {"posts": posts, "cursor": str(k) if k < total else None}
+
+    def search_actors(self, params: dict) -> dict:
+        """app.bsky.actor.searchActors, matching every word of `q` against handles, names and descriptions."""
+        data = self.server.data
+        terms = _param(params, "q", required=True).lower().split()
+        limit, start = _limit(params), _cursor(params)
+
+        end = min(data.actors, start + SEARCH_SCAN)
+        actors, k = [], start
+        while k < end and len(actors) < limit:
+            profile = data.profile(k)
+            k += 1
+            text = f"{profile['handle']} {profile['displayName']} {profile['description']}".lower()
+            if all(term in text for term in terms):
+                actors.append(profile)
+        return {"actors": actors, "cursor": str(k) if k < data.actors else None}
+
+
+ROUTES = {
+    "com.atproto.server.createSession": XrpcHandler.create_session,
+    "com.atproto.server.refreshSession": XrpcHandler.refresh_session,
+    "app.bsky.actor.getProfile": XrpcHandler.get_profile,
+    "app.bsky.actor.getProfiles": XrpcHandler.get_profiles,
+    "app.bsky.feed.getAuthorFeed": XrpcHandler.get_author_feed,
+    "app.bsky.feed.getTimeline": XrpcHandler.get_timeline,
+    "app.bsky.feed.searchPosts": XrpcHandler.search_posts,
+    "app.bsky.actor.searchActors": XrpcHandler.search_actors,
+    "app.bsky.graph.getFollowers": XrpcHandler.get_followers,
+    "app.bsky.graph.getFollows": XrpcHandler.get_follows,
+    "app.bsky.graph.getKnownFollowers": XrpcHandler.get_known_followers,
+}
+
+
+def make_server(  # noqa: PLR0913
+    data: Dataset,
+    host: str = "localhost",
+    port: int = DEFAULT_PORT,
+    latency: float = 0,
+    jitter: float = 0,
+    limiter: RateLimiter | None = None,
+    password: str = "password",  # noqa: S107 Not a real credential
+    *,
+    quiet: bool = False,
+    events: list[dict] | None = None,
+    events_per_second: float = 20,
+) -> ThreadingHTTPServer:
+    """Build the mock server, use port 0 to let the OS pick a free one.
+
+    `events` is a recording of Jetstream events to replay to subscribers instead of synthetic ones.
+    """
+    server = ThreadingHTTPServer((host, port), XrpcHandler)
+    server.daemon_threads = True
+    server.data = data
+    server.latency = latency
+    server.jitter = jitter
+    server.limiter = limiter
+    server.password = password
+    server.quiet = quiet
+    server.events = events
+    server.events_per_second = events_per_second
+    server.sessions = {}
+    server.issued = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def start_server(data: Dataset, **kwargs: object) -> ThreadingHTTPServer:
+    """Run the mock server on a background thread, for tests and benchmarks; call `shutdown()` to stop it."""
+    server = make_server(data, **{"quiet": True, **kwargs})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Parse the command line and serve until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--actors", type=int, default=1000, help="number of synthetic actors")
+    parser.add_argument("--posts", type=int, default=100, help="posts per actor")
+    parser.add_argument("--follows", type=int, default=150, help="follows (and followers) per actor")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the follow graph")
+    parser.add_argument("--new-post-every", type=float, default=0, help="seconds between each actor's new posts")
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0, help="up to this many more random milliseconds")
+    parser.add_argument("--rate", type=int, default=0, help="requests allowed per client per window, 0 for no limit")
+    parser.add_argument("--window", type=float, default=300, help="rate limit window in seconds")
+    parser.add_argument("--password", default="password", help="password every actor logs in with")
+    parser.add_argument("--quiet", action="store_true", help="don't log every request")
+    parser.add_argument("--events", help="file of recorded Jetstream events, one JSON object a line, to replay")
+    parser.add_argument("--events-per-second", type=float, default=20, help="events sent a second, 0 for no limit")
+    args = parser.parse_args(argv)
+
+    data = Dataset(args.actors, args.posts, args.follows, args.seed, args.new_post_every)
+    limiter = RateLimiter(args.rate, args.window) if args.rate else None
+    events = None
+    if args.events:
+        lines = Path(args.events).read_text(encoding="utf-8").splitlines()
+        events = [json.loads(line) for line in lines if line.strip()]
+    server = make_server(
+        data,
+        args.host,
+        args.port,
+        args.latency,
+        args.jitter,
+        limiter,
+        args.password,
+        quiet=args.quiet,
+        events=events,
+        events_per_second=args.events_per_second,
+    )
+    print(f"[*] Mock XRPC server at: http://{args.host}:{server.server_address[1]}")
+    print(f"[*] {args.actors} actors with {args.posts} posts and {len(data.offsets)} follows each")
+    print("[-] Press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServer stopped")
+    finally:
+        server.server_close()
+
+
+def test_paging_and_login() -> None:
+    """Tests that BskySession pointed at the mock with pds_host pages through followers and logs in."""
+    import asyncio  # noqa: PLC0415 Only the tests run the app's client
+
+    from auth_session import BskySession  # noqa: PLC0415 Only the tests run the app's client
+    from transport import HttpSession  # noqa: PLC0415 Only the tests run the app's client
+
+    server = start_server(Dataset(actors=50, posts=5, follows=10), port=0)
+    client = HttpSession()
+
+    async def run() -> tuple[list[str], bool, bool, int]:
+        session = BskySession("user3.test", "password", f"http://localhost:{server.server_address[1]}", client)
+        handles, cursor = [], ""
+        while cursor is not None:
+            page = await session.get_followers("user3.test", limit=4, cursor=cursor)
+            handles += [follower["handle"] for follower in page["followers"]]
+            cursor = page.get("cursor")
+        wrong = await BskySession("user3.test", "nope", session.pds_host, client).login()
+        logged_in = await session.login()
+        timeline = await session.get_timeline(limit=3)
+        return handles, wrong, logged_in, len(timeline["feed"])
+
+    try:
+        handles, wrong, logged_in, posts = asyncio.run(run())
+    finally:
+        client.close()
+        server.shutdown()
+    data = Dataset(actors=50, posts=5, follows=10)
+    assert handles == [data.handle(i) for i in data.followers(3)]
+    assert (wrong, logged_in, posts) == (False, True, 3)
+
+
+def test_rate_limit() -> None:
+    """Tests that a client past its limit gets a 429, with headers saying when it can go again."""
+    import asyncio  # noqa: PLC0415 Only the tests run the app's client
+
+    from transport import HttpSession  # noqa: PLC0415 Only the tests run the app's client
+
+    server = start_server(Dataset(actors=5, posts=1, follows=1), port=0, limiter=RateLimiter(2, 300))
+    client = HttpSession()
+    url = f"http://localhost:{server.server_address[1]}/xrpc/app.bsky.actor.getProfile?actor=user1.test"
+
+    async def run() -> list[tuple[int, str]]:
+        responses = [await client.get(url) for _ in range(3)]
+        return [(response.status, response.headers["RateLimit-Remaining"]) for response in responses]
+
+    try:
+        statuses = asyncio.run(run())
+    finally:
+        client.close()
+        server.shutdown()
+    assert statuses == [(HTTPStatus.OK, "1"), (HTTPStatus.OK, "0"), (HTTPStatus.TOO_MANY_REQUESTS, "0")]
+
+
+if __name__ == "__main__":
+    main()
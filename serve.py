@@ -0,0 +1,353 @@
+"""Static file server for the app, good enough to front a deployment.
+
+Serves `src/` from a thread per connection, picks precompressed `.br`/`.gz` files when the browser takes
+them (gzipping other text on the fly), sets ETag and Cache-Control per asset type, answers single byte
+ranges and logs how long every request took.
+"""
+
+import argparse
+import email.utils
+import gzip
+import http.server
+import os
+import shutil
+import sys
+import time
+from functools import lru_cache, partial
+from http import HTTPStatus
+from pathlib import Path
+from typing import BinaryIO
+
+try:
+    import brotli  # Optional, only needed to write .br files with --precompress
+except ImportError:
+    brotli = None
+
+SRC_DIR = Path(__file__).parent / "src"
+DEFAULT_PORT = 8000
+
+COMPRESSIBLE = {".html", ".js", ".mjs", ".css", ".py", ".json", ".svg", ".txt", ".wasm", ".map"}
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]  # Precompressed variants, in order of preference
+MAX_DYNAMIC_GZIP = 16 * 1024 * 1024  # Bigger files are only sent compressed if precompressed
+
+IMMUTABLE = "public, max-age=31536000, immutable"  # Content-hashed files, like the module bundle
+REVALIDATE = "no-cache"  # Files whose name stays the same when they change
+SHORT = "public, max-age=3600"
+NO_STORE = "no-store"  # Everything in --dev mode, so edits show up on reload
+
+
+class RangeNotSatisfiableError(Exception):
+    """A Range header that asks for bytes the file doesn't have."""
+
+
+def cache_control(path: Path) -> str:
+    """Pick the Cache-Control for a file from its name."""
+    if path.parent.name == "dist" and path.name.startswith("modules-"):
+        return IMMUTABLE
+    if path.suffix in {".html", ".py", ".json"}:
+        return REVALIDATE
+    return SHORT
+
+
+def accepted_encodings(header: str) -> set[str]:
+    """Read the codings an Accept-Encoding header allows, leaving out any with q=0."""
+    result = set()
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        quality = params.replace(" ", "").removeprefix("q=")
+        if params and quality.strip("0.") == "":
+            continue
+        result.add(name.strip().lower())
+    return result
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Read a single `bytes=` range as inclusive (start, end), or None to send the whole file."""
+    unit, _, spec = header.partition("=")
+    first, _, last = spec.strip().partition("-")
+    if unit.strip() != "bytes" or "," in spec or not (first.isdigit() or last.isdigit()):
+        return None
+    if not first:
+        # a suffix, like bytes=-500 for the last 500 bytes
+        if int(last) == 0 or size == 0:
+            raise RangeNotSatisfiableError
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    end = int(last) if last.isdigit() else size - 1
+    if start >= size or end < start:
+        raise RangeNotSatisfiableError
+    return start, min(end, size - 1)
+
+
+@lru_cache(maxsize=128)
+def gzip_file(path: str, mtime_ns: int) -> bytes:  # noqa: ARG001 mtime_ns keys the cache
+    """Gzip a file, remembering the result until the file changes."""
+    return gzip.compress(Path(path).read_bytes(), mtime=0)
+
+
+class StaticHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve files with compression, validators, cache headers and byte ranges."""
+
+    server_version = "SQLBSky"
+    protocol_version = "HTTP/1.1"  # Keep-alive, so the module fetches at boot share connections
+    extensions_map = {  # noqa: RUF012 Extends the parent's class attribute
+        **http.server.SimpleHTTPRequestHandler.extensions_map,
+        ".py": "text/x-python",
+        ".wasm": "application/wasm",
+        ".mjs": "text/javascript",
+    }
+
+    def do_GET(self) -> None:
+        """Send a file."""
+        self._timed(head=False)
+
+    def do_HEAD(self) -> None:
+        """Send a file's headers."""
+        self._timed(head=True)
+
+    def log_request(self, code: int | str = "-", size: int | str = "-") -> None:
+        """Skip the default log line, `_timed` logs the request once the body is sent."""
+
+    def _timed(self, *, head: bool) -> None:
+        start = time.perf_counter()
+        status, sent = self._respond(head=head)
+        elapsed = (time.perf_counter() - start) * 1000
+        self.log_message('"%s" %s %s %.1fms', self.requestline, status, sent, elapsed)
+
+    def _respond(self, *, head: bool) -> tuple[int, int]:
+        path = Path(self.translate_path(self.path))
+        if path.is_dir():
+            path /= "index.html"
+        if not path.is_file():
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return HTTPStatus.NOT_FOUND, 0
+
+        stat = path.stat()
+        wanted_range = self.headers.get("Range")
+        if wanted_range and self.headers.get("If-Range", self._etag(stat)) != self._etag(stat):
+            wanted_range = None
+
+        # byte ranges are served from the uncompressed file
+        encoding, data = (None, None) if wanted_range else self._compressed(path, stat)
+        etag = self._etag(stat, encoding)
+        headers = {
+            "Content-Type": self.guess_type(path),
+            "ETag": etag,
+            "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+            "Cache-Control": NO_STORE if getattr(self.server, "dev", False) else cache_control(path),
+            "Accept-Ranges": "bytes",
+        }
+        if path.suffix in COMPRESSIBLE:
+            headers["Vary"] = "Accept-Encoding"
+
+        if etag in self._if_none_match():
+            return self._send(HTTPStatus.NOT_MODIFIED, headers), 0
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(data))
+            status = self._send(HTTPStatus.OK, headers)
+            if not head:
+                self.wfile.write(data)
+            return status, 0 if head else len(data)
+
+        return self._send_file(path, stat.st_size, headers, wanted_range, head=head)
+
+    def _send_file(
+        self, path: Path, size: int, headers: dict[str, str], wanted_range: str | None, *, head: bool
+    ) -> tuple[int, int]:
+        """Send the uncompressed file, or the part of it a Range header asks for."""
+        start, end = 0, size - 1
+        status = HTTPStatus.OK
+        if wanted_range:
+            try:
+                start, end = parse_range(wanted_range, size) or (start, end)
+            except RangeNotSatisfiableError:
+                headers["Content-Range"] = f"bytes */{size}"
+                headers["Content-Length"] = "0"
+                return self._send(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, headers), 0
+            if (start, end) != (0, size - 1):
+                status = HTTPStatus.PARTIAL_CONTENT
+                headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+        length = max(0, end - start + 1)
+        headers["Content-Length"] = str(length)
+        self._send(status, headers)
+        if not head:
+            with path.open("rb") as f:
+                f.seek(start)
+                self._copy(f, length)
+        return status, 0 if head else length
+
+    def _compressed(self, path: Path, stat: os.stat_result) -> tuple[str | None, bytes | None]:
+        """Pick a precompressed variant, or gzip text on the fly, if the browser accepts it."""
+        if path.suffix not in COMPRESSIBLE:
+            return None, None
+        accepted = accepted_encodings(self.headers.get("Accept-Encoding", ""))
+        for encoding, suffix in ENCODINGS:
+            variant = path.with_name(path.name + suffix)
+            if encoding in accepted and variant.is_file() and variant.stat().st_mtime_ns >= stat.st_mtime_ns:
+                return encoding, variant.read_bytes()
+        if "gzip" in accepted and stat.st_size <= MAX_DYNAMIC_GZIP:
+            return "gzip", gzip_file(str(path), stat.st_mtime_ns)
+        return None, None
+
+    def _etag(self, stat: os.stat_result, encoding: str | None = None) -> str:
+        suffix = f"-{encoding}" if encoding else ""
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{suffix}"'
+
+    def _if_none_match(self) -> set[str]:
+        header = self.headers.get("If-None-Match", "")
+        return {tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip()}
+
+    def _send(self, status: HTTPStatus, headers: dict[str, str]) -> int:
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        return status
+
+    def _copy(self, f: BinaryIO, length: int) -> None:
+        while length > 0:
+            chunk = f.read(min(length, shutil.COPY_BUFSIZE))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            length -= len(chunk)
+
+
+def precompress(directory: Path) -> None:
+    """Write .gz, and .br if the brotli package is installed, next to every compressible file."""
+    written = 0
+    for path in sorted(directory.rglob("*")):
+        if path.suffix not in COMPRESSIBLE or not path.is_file():
+            continue
+        data = None
+        for encoding, suffix in ENCODINGS:
+            variant = path.with_name(path.name + suffix)
+            if encoding == "br" and brotli is None:
+                continue
+            if variant.is_file() and variant.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+                continue
+            data = data or path.read_bytes()
+            variant.write_bytes(brotli.compress(data) if encoding == "br" else gzip.compress(data, 9, mtime=0))
+            written += 1
+    if brotli is None:
+        print("[-] brotli isn't installed, only wrote .gz files")
+    print(f"[*] Wrote {written} precompressed files under {directory}")
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Parse the command line and serve until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="", help="address to bind, all interfaces by default")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--directory", type=Path, default=SRC_DIR)
+    parser.add_argument("--dev", action="store_true", help="send every file with Cache-Control: no-store")
+    parser.add_argument("--precompress", action="store_true", help="write .gz/.br files and exit")
+    args = parser.parse_args(argv)
+
+    if not args.directory.is_dir():
+        print(f"[-] {args.directory} dir not found")
+        sys.exit(1)
+    if args.precompress:
+        precompress(args.directory)
+        return
+
+    handler = partial(StaticHandler, directory=str(args.directory))
+    print(f"[*] Serving from: {args.directory.absolute()}")
+    try:
+        with http.server.ThreadingHTTPServer((args.host, args.port), handler) as httpd:
+            httpd.daemon_threads = True
+            httpd.dev = args.dev
+            print(f"[*] Server running at: http://localhost:{args.port}")
+            print(f"[*] Open: http://localhost:{args.port}/")
+            print("[-] Press Ctrl+C to stop")
+            httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServer stopped")
+    except OSError as e:
+        print(f"[-] Error: {e}")
+        print(f"[-] Try a different port: python {Path(sys.argv[0]).name} --port {args.port + 1}")
+
+
+if __name__ == "__main__":
+    main()
+
+
+def test_parse_range() -> None:
+    """Tests single ranges, suffixes and open ends, and the ranges that can't be served or are ignored."""
+    import pytest  # noqa: PLC0415 Only the tests need pytest
+
+    assert [
+        parse_range(header, 10) for header in ("bytes=2-5", "bytes=2-", "bytes=-3", "bytes=-50", "bytes=8-20")
+    ] == [
+        (2, 5),
+        (2, 9),
+        (7, 9),
+        (0, 9),
+        (8, 9),
+    ]
+    # other units, several ranges and nonsense are ignored, and the whole file sent
+    assert [parse_range(header, 10) for header in ("items=0-1", "bytes=0-1,4-5", "bytes=-", "bytes=a-b")] == [None] * 4
+    for header, size in (("bytes=-0", 10), ("bytes=5-2", 10), ("bytes=10-", 10), ("bytes=-5", 0)):
+        with pytest.raises(RangeNotSatisfiableError):
+            parse_range(header, size)
+
+
+def test_accepted_encodings() -> None:
+    """Tests that codings are read case-insensitively with their parameters, and q=0 ones left out."""
+    assert accepted_encodings("gzip;q=0") == set()
+    assert accepted_encodings("gzip; q=0.0, br") == {"br"}
+    assert accepted_encodings("GZIP;q=0.5, deflate, br;q=1.0") == {"gzip", "deflate", "br"}
+
+
+def test_cache_control() -> None:
+    """Tests that only the hashed bundle is immutable, and files that keep their name are revalidated."""
+    assert [
+        cache_control(Path(name))
+        for name in ("src/dist/modules-abc.zip", "src/dist/manifest.json", "src/index.html", "src/core/executor.py")
+    ] == [IMMUTABLE, REVALIDATE, REVALIDATE, REVALIDATE]
+    assert cache_control(Path("src/web/boot.js")) == SHORT
+
+
+def test_serve(tmp_path: Path) -> None:
+    """Tests gzipped text, a byte range and a revalidation that's answered without a body."""
+    import http.client  # noqa: PLC0415 Only the test runs a server
+    import threading  # noqa: PLC0415 Only the test runs a server
+
+    (tmp_path / "index.html").write_text("<p>" + "hello " * 100 + "</p>")
+    (tmp_path / "data.bin").write_bytes(bytes(range(100)))
+    server = http.server.ThreadingHTTPServer(("localhost", 0), partial(StaticHandler, directory=str(tmp_path)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection = http.client.HTTPConnection("localhost", server.server_address[1], timeout=5)
+
+    def get(path: str, **headers: str) -> tuple[int, dict[str, str], bytes]:
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+
+    try:
+        status, headers, body = get("/", **{"Accept-Encoding": "gzip"})
+        assert (status, headers["Content-Encoding"], gzip.decompress(body)) == (
+            HTTPStatus.OK,
+            "gzip",
+            (tmp_path / "index.html").read_bytes(),
+        )
+        status, headers, _ = get("/", **{"Accept-Encoding": "gzip", "If-None-Match": headers["ETag"]})
+        assert status == HTTPStatus.NOT_MODIFIED
+        status, headers, body = get("/data.bin", Range="bytes=-4")
+        assert (status, headers["Content-Range"], body) == (
+            HTTPStatus.PARTIAL_CONTENT,
+            "bytes 96-99/100",
+            bytes(range(96, 100)),
+        )
+        status, headers, body = get("/data.bin", Range="bytes=100-")
+        assert (status, headers["Content-Range"], body) == (
+            HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE,
+            "bytes */100",
+            b"",
+        )
+    finally:
+        connection.close()
+        server.shutdown()
@@ -1,77 +1,49 @@
 # Imports
+import asyncio
 import json
+from http import HTTPStatus
 from typing import Literal
+from urllib.parse import urlencode
 
-from pyodide.http import FetchResponse, pyfetch  # The system we will actually use
+from executor import QueryError
+from hydrator import ProfileHydrator
+from tracing import TRACER
+from transport import Response, Transport, default_transport
 
 LIMIT = 50  # The default limit amount
+PDS_HOST = "https://bsky.social"  # Where accounts log in
+PUBLIC_HOST = "https://public.api.bsky.app"  # Serves the public endpoints without logging in
+STREAM_HOST = "wss://jetstream2.us-east.bsky.network"  # Jetstream, the firehose's events as JSON
+RATE_LIMIT_RETRIES = 3  # Times a rate limited call waits for the limit to reset and tries again
+MAX_BACKOFF_SECONDS = 60  # Longest wait for a rate limit to reset, a call that would wait longer fails instead
 
 
-class PyfetchSession:
-    """Pyfetch Session, emulating the request Session."""
+class XrpcError(QueryError):
+    """An error response from the API, with the XRPC error name and message it gave."""
 
-    def __init__(self, headers: dict | None = None) -> None:
-        """Pyfetch Session, emulating the request Session."""
-        self.default_headers = headers or {}
-
-    async def get(self, url: str, headers: dict | None = None) -> FetchResponse:
-        """Get request for the pyfetch.
-
-        Args:
-            url (str): The Endpoint to hit
-            headers (dict | None, optional): Any headers that will get added to the request. Defaults to "".
-
-        Returns:
-            FetchResponse: The return data from the request
-
-        """
-        merged_headers = self.default_headers.copy()
-        if headers:
-            merged_headers.update(headers)
-        return await pyfetch(
-            url,
-            method="GET",
-            headers=merged_headers,
-        )
-
-    async def post(
-        self,
-        url: str,
-        data: str | dict | None = "",
-        headers: dict | None = None,
-    ) -> FetchResponse:
-        """Post request.
-
-        Args:
-            url (str): The Endpoint to hit
-            data (str | dict | None, optional): A dictionary or string to use for the body. Defaults to "".
-            headers (dict | None, optional): Any headers that will get added to the request. Defaults to "".
-
-        Returns:
-            FetchResponse: The return data from the request
-
-        """
-        merged_headers = self.default_headers.copy()
-        if headers:
-            merged_headers.update(headers)
-        return await pyfetch(
-            url,
-            method="POST",
-            headers=merged_headers,
-            body=json.dumps(data) if isinstance(data, dict) else data,
-        )
+    def __init__(self, nsid: str, status: int, error: str, message: str) -> None:
+        super().__init__(f"{nsid} failed with {error}{f': {message}' if message else ''}")
+        self.status = status
+        self.error = error
 
 
 class BskySession:
     """Class to establish an auth session."""
 
-    def __init__(self, username: str, password: str) -> None:
+    def __init__(
+        self, username: str, password: str, pds_host: str | None = None, client: Transport | None = None
+    ) -> None:
         # Bluesky credentials
         self.username = username
         self.password = password
-        self.pds_host = "https://public.api.bsky.app"
-        # Instance client
-        self.client = PyfetchSession()
+        # Passing pds_host sends every call there, logged in or not, e.g. to mock_appview.py
+        self.login_host = pds_host or PDS_HOST
+        self.pds_host = pds_host or PUBLIC_HOST
+        self.stream_host = pds_host.replace("http", "ws", 1) if pds_host else STREAM_HOST
+        # Instance client, pyfetch in the browser and the standard library under CPython
+        self.client = client or default_transport()
+        # Batches and caches profile lookups
+        self.hydrator = ProfileHydrator(self)
         # Access token
         self.access_jwt = None
         # Refresh token
@@ -79,8 +51,8 @@ class BskySession:
 
     async def login(self) -> None:
         """Create an authenticated session and save tokens."""
-        endpoint: str = "https://bsky.social/xrpc/com.atproto.server.createSession"
-        session_info: FetchResponse = await self.client.post(
+        endpoint: str = f"{self.login_host}/xrpc/com.atproto.server.createSession"
+        session_info: Response = await self.client.post(
             endpoint,
             headers={"Content-Type": "application/json"},
             data={
@@ -94,7 +66,7 @@ class BskySession:
             self.refresh_jwt: str = session_info["refreshJwt"]
             self.did: str = session_info["did"]
             self.handle: str = session_info["handle"]
-            self.pds_host = "https://bsky.social"
+            self.pds_host = self.login_host
             self.client.default_headers.update(
                 {
                     "Content-Type": "application/json",
@@ -126,16 +98,49 @@ class BskySession:
             },
         )
 
+    async def _get_json(self, endpoint: str) -> dict:
+        """Get an endpoint and decode the JSON body, counting the bytes received.
+
+        A rate limited call waits for the limit to reset, going by the RateLimit-* headers, and tries again.
+        Any other error response, or one still rate limited, raises an XrpcError.
+        """
+        nsid = endpoint.partition("/xrpc/")[2].partition("?")[0]
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            with TRACER.span("http", "http", endpoint=nsid) as args:
+                response = await self.client.get(endpoint)
+                body = await response.bytes()
+                self.client.rate_limit.update(response.headers)
+                args.update(status=response.status, bytes=len(body))
+            self.client.count("bytes", len(body))
+            if response.status != HTTPStatus.TOO_MANY_REQUESTS or attempt == RATE_LIMIT_RETRIES:
+                break
+            # without the headers, a second is as good a guess as any
+            wait = max(1.0, self.client.rate_limit.delay(0))
+            if wait > MAX_BACKOFF_SECONDS:
+                break
+            with TRACER.span("rate limit wait", "http", endpoint=nsid, seconds=wait):
+                await asyncio.sleep(wait)
+
+        with TRACER.span("json decode", "decode", bytes=len(body)):
+            try:
+                data = json.loads(body)
+            except ValueError:
+                if response.ok:
+                    raise
+                # an error page from something in front of the API, rather than an XRPC error
+                data = {}
+        if not response.ok or "error" in data:
+            error = data.get("error") or f"HTTP {response.status}"
+            raise XrpcError(nsid, response.status, error, data.get("message", ""))
+        return data
+
     ### Start of the actual endpoints -> https://docs.bsky.app/docs/api/at-protocol-xrpc-api
     async def get_preferences(self) -> dict:
         """Get the logged in users preferences."""
         endpoint = f"{self.pds_host}/xrpc/app.bsky.actor.getPreferences"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        return await self._get_json(endpoint)
 
-    async def get_profile(self, actor: str) -> dict:
+    async def get_profile(self, actor: str | None = None) -> dict:
         """Get a user profile."""
         # If no actor specified and we're authenticated, use our handle
         if actor is None:
@@ -145,67 +150,65 @@ class BskySession:
                 # Return special error object for stealth mode
                 return {"stealth_error": True}
 
-        endpoint = f"{self.pds_host}/xrpc/app.bsky.actor.getProfile?actor={actor}"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        # Goes through the hydrator so profiles asked for together share a getProfiles call
+        profile = await self.hydrator.get(actor)
+        if profile is None:
+            return {"error": "NotFound", "message": f"Profile not found: {actor}"}
+        return profile
+
+    async def hydrate_profiles(self, actors: list[str]) -> dict:
+        """Get the profiles for any number of actors through the hydrator, leaving out unknown ones."""
+        profiles = await self.hydrator.get_many(actors)
+        unique = {profile["did"]: profile for profile in profiles.values() if profile}
+        return {"profiles": list(unique.values())}
+
+    async def get_profiles(self, actors: list[str]) -> dict:
+        """Get up to 25 user profiles in one call."""
+        query = urlencode({"actors": actors}, doseq=True)
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.actor.getProfiles?{query}"
+        return await self._get_json(endpoint)
 
     async def get_suggestions(self, limit: int = LIMIT, cursor: str = "") -> dict:
         """Get the logged in users suggestion."""
-        endpoint = f"{self.pds_host}/xrpc/app.bsky.actor.getSuggestions?limit={limit}&cursor={cursor}"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        query = urlencode({"limit": limit, "cursor": cursor})
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.actor.getSuggestions?{query}"
+        return await self._get_json(endpoint)
 
     async def search_actors(self, q: str, limit: int = LIMIT, cursor: str = "") -> dict:
         """Search for actors."""
-        endpoint = f"{self.pds_host}/xrpc/app.bsky.actor.searchActors?q={q}&limit={limit}&cursor={cursor}"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        query = urlencode({"q": q, "limit": limit, "cursor": cursor})
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.actor.searchActors?{query}"
+        return await self._get_json(endpoint)
 
     async def get_actor_likes(self, actor: str, limit: int = LIMIT, cursor: str = "") -> dict:  # Requires Auth
         """Get a given actors likes."""
-        endpoint = f"{self.pds_host}/xrpc/app.bsky.feed.getActorLikes?actor={actor}&limit={limit}&cursor={cursor}"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        query = urlencode({"actor": actor, "limit": limit, "cursor": cursor})
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.feed.getActorLikes?{query}"
+        return await self._get_json(endpoint)
 
-    async def get_author_feed(self, actor: str, limit: int = LIMIT) -> dict:
+    async def get_author_feed(self, actor: str, limit: int = LIMIT, cursor: str = "") -> dict:
         """Get a specific user feed."""
-        endpoint = f"{self.pds_host}/xrpc/app.bsky.feed.getAuthorFeed?actor={actor}&limit={limit}"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        query = urlencode({"actor": actor, "limit": limit, "cursor": cursor})
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.feed.getAuthorFeed?{query}"
+        return await self._get_json(endpoint)
 
     async def get_feed(self, feed: str, limit: int = LIMIT, cursor: str = "") -> dict:
         """Get a specified feed."""
-        endpoint = f"{self.pds_host}/xrpc/app.bsky.feed.getFeed?feed={feed}&limit={limit}&cursor={cursor}"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        query = urlencode({"feed": feed, "limit": limit, "cursor": cursor})
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.feed.getFeed?{query}"
+        return await self._get_json(endpoint)
 
     async def get_suggested_feeds(self, limit: int = LIMIT, cursor: str = "") -> dict:
         """Get suggested feeds."""
-        endpoint = f"{self.pds_host}/xrpc/app.bsky.feed.getSuggestedFeeds?limit={limit}&cursor={cursor}"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        query = urlencode({"limit": limit, "cursor": cursor})
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.feed.getSuggestedFeeds?{query}"
+        return await self._get_json(endpoint)
 
-    async def get_timeline(self) -> dict:
+    async def get_timeline(self, limit: int = LIMIT, cursor: str = "") -> dict:
         """Get a users timeline."""
-        endpoint = f"{self.pds_host}/xrpc/app.bsky.feed.getTimeline"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        query = urlencode({"limit": limit, "cursor": cursor})
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.feed.getTimeline?{query}"
+        return await self._get_json(endpoint)
 
     # Only function that needs this many params, I am not making a data class for it
     async def search_posts(  # noqa: PLR0913
@@ -234,43 +237,83 @@ class BskySession:
             cursor (str, optional): Bsky Cursor. Defaults to "".
 
         """
-        endpoint = (
-            f"{self.pds_host}/xrpc/app.bsky.feed.searchPosts"
-            f"?q={q}&sort={sort}&since={since}&until={until}"
-            f"&mentions={mentions}&author={author}&tag={tag}"
-            f"&limit={limit}&cursor={cursor}"
-        )
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        params = {
+            "q": q,
+            "sort": sort,
+            "since": since,
+            "until": until,
+            "mentions": mentions,
+            "author": author,
+            "tag": tag,
+            "limit": limit,
+            "cursor": cursor,
+        }
+        # the query is free text, so it's encoded, and the filters that aren't set are left out
+        query = urlencode({name: value for name, value in params.items() if value})
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.feed.searchPosts?{query}"
+        return await self._get_json(endpoint)
 
     async def get_followers(self, actor: str, limit: int = LIMIT, cursor: str = "") -> dict:
         """Get a users followers."""
-        endpoint = f"{self.pds_host}/xrpc/app.bsky.graph.getFollowers?actor={actor}&limit={limit}&cursor={cursor}"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        query = urlencode({"actor": actor, "limit": limit, "cursor": cursor})
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.graph.getFollowers?{query}"
+        return await self._get_json(endpoint)
 
     async def get_follows(self, actor: str, limit: int = LIMIT, cursor: str = "") -> dict:
         """Get a users follows."""
-        endpoint = f"{self.pds_host}/xrpc/app.bsky.graph.getFollows?actor={actor}&limit={limit}&cursor={cursor}"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        query = urlencode({"actor": actor, "limit": limit, "cursor": cursor})
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.graph.getFollows?{query}"
+        return await self._get_json(endpoint)
 
     async def get_mutual_follows(self, actor: str, limit: int = LIMIT, cursor: str = "") -> dict:
         """Get a users mutual follows."""
-        endpoint = f"{self.pds_host}/xrpc/app.bsky.graph.getKnownFollowers?actor={actor}&limit={limit}&cursor={cursor}"
-        response = await self.client.get(
-            endpoint,
-        )
-        return await response.json()
+        query = urlencode({"actor": actor, "limit": limit, "cursor": cursor})
+        endpoint = f"{self.pds_host}/xrpc/app.bsky.graph.getKnownFollowers?{query}"
+        return await self._get_json(endpoint)
 
     async def get_blob(self, url: str) -> str:
         """Get a specific blob."""
         did, cid = url.split("/")[-2:]
         cid = cid.split("@")[0]
-        return f"https://bsky.social/xrpc/com.atproto.sync.getBlob?did={did}&cid={cid}"
+        query = urlencode({"did": did, "cid": cid})
+        return f"{self.login_host}/xrpc/com.atproto.sync.getBlob?{query}"
+
+
+class _Recorder(Transport):
+    """A transport that keeps the URLs asked for and answers each with an empty object."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.urls = []
+
+    async def get(self, url: str, headers: dict | None = None) -> Response:  # noqa: ARG002 Never sent
+        from transport import HttpResponse  # noqa: PLC0415 Only the tests make up responses
+
+        self.urls.append(url)
+        return HttpResponse(200, {}, b"{}")
+
+    async def post(self, url: str, data: str | dict | None = "", headers: dict | None = None) -> Response:
+        raise NotImplementedError
+
+
+def test_query_encoding() -> None:
+    """Tests that cursors, actors and feeds reach the API as they were given, whatever characters they have."""
+    from urllib.parse import parse_qs, urlsplit  # noqa: PLC0415 Only the tests read the URLs back
+
+    recorder = _Recorder()
+    session = BskySession("user", "password", client=recorder)
+    cursor = "2024-01-01T00:00:00+00:00::bafy&limit=1"
+    feed = "at://did:plc:abc/app.bsky.feed.generator/what's hot"
+
+    async def run() -> None:
+        await session.get_followers("did:plc:abc", cursor=cursor)
+        await session.get_feed(feed, limit=10, cursor=cursor)
+        await session.get_profiles(["a+b.test", "c&d.test"])
+
+    asyncio.run(run())
+    queries = [parse_qs(urlsplit(url).query) for url in recorder.urls]
+    assert queries == [
+        {"actor": ["did:plc:abc"], "limit": [str(LIMIT)], "cursor": [cursor]},
+        {"feed": [feed], "limit": ["10"], "cursor": [cursor]},
+        {"actors": ["a+b.test", "c&d.test"]},
+    ]
@@ -0,0 +1,240 @@
+"""The main thread's side of the engine worker, which runs queries in its own pyodide to keep the page responsive.
+
+Messages are plain objects with a `type` and the `id` of the request they belong to:
+
+    main -> worker  session {username, password, pds}  make the BskySession, not logged in yet
+                    login                              log it in, done has `ok`
+                    blob {url}                         done has the blob's `url`
+                    query {query}                      run a query
+                    image_support                      load Pillow, ready for the first image, image workers only
+                    ascii {url, columns, colour}       done has the image at `url` as ASCII art `text`, HTML in
+                                                       colour, image workers only
+                    cancel                             stop the request with this id
+                    visibility {hidden}                hold WATCH refreshes while the page is hidden, no reply
+    worker -> main  page {head, rows}                  the next batch of a query's rows, sent as soon as it's ready
+                    watching {watch, ...}              a WATCH query's first run is done, with what done would have,
+                                                       or a query of the stream has started, with `watch` null
+                    tick {head, rows}                  the rows a refresh of a WATCH query added, maybe none, or
+                                                       the next batch of the stream's events
+                    chunk {data}                       the next bytes of an INTO OUTFILE export
+                    done {...}                         the request finished, with what it gives back
+                    error {error, message}             the request failed
+
+Every request ends with exactly one done or error. A query's done has its `table`, `rows` (how many),
+`explain` rows for EXPLAIN, and the `stats` and `spans` it recorded in the worker. A WATCH query sends
+watching instead and then a tick every refresh, until it's cancelled. A query of the stream sends watching
+first, then a tick a batch, ending with done once it reaches its LIMIT.
+
+Images are converted by a pool of IMAGE_WORKERS copies of the engine worker, which have no session and only
+answer image_support and ascii. They're started for the first image, so the engine worker never loads Pillow
+and a page without images never loads it at all.
+"""
+
+import asyncio
+import itertools
+from collections.abc import AsyncIterator
+
+from executor import QueryError, StealthModeError
+from js import Event, Object, Worker, window
+from pyodide.ffi import JsProxy, create_proxy, to_js
+
+WORKER_URL = "web/engine-worker.js"
+IMAGE_WORKERS = 3  # Workers converting images, started for the first image
+
+
+class QueryCancelledError(QueryError):
+    """A query stopped with the cancel button."""
+
+
+# The worker's error names that become something more specific than a QueryError
+ERRORS: dict[str, type[QueryError]] = {
+    "StealthModeError": StealthModeError,
+    "cancelled": QueryCancelledError,
+}
+
+_ids = itertools.count(1)
+# Replies not yet read, by request id, along with the kind of request
+_inbox: dict[int, tuple[str, asyncio.Queue]] = {}
+
+
+def _receive(event: Event) -> None:
+    message = event.data.to_py()
+    if message["id"] in _inbox:
+        _inbox[message["id"]][1].put_nowait(message)
+
+
+# index.html starts the worker before the main pyodide, so both load at once
+WORKER = window.engineWorker
+WORKER.onmessage = create_proxy(_receive)
+# Every worker that converts images, with how many conversions each has running
+_pool: list[JsProxy] = []
+_busy: list[int] = []
+
+
+def _post(kind: str, request: int, worker: JsProxy = WORKER, **fields: object) -> None:
+    worker.postMessage(to_js({"type": kind, "id": request, **fields}, dict_converter=Object.fromEntries))
+
+
+async def request(kind: str, worker: JsProxy = WORKER, **fields: object) -> AsyncIterator[dict]:
+    """Send a worker a request and yield its replies, raising a QueryError for an error.
+
+    Leaving early, like when the task running the query is cancelled, cancels the request in the worker.
+    """
+    request_id = next(_ids)
+    queue = asyncio.Queue()
+    _inbox[request_id] = (kind, queue)
+    _post(kind, request_id, worker, **fields)
+    finished = False
+    try:
+        while not finished:
+            message = await queue.get()
+            finished = message["type"] in ("done", "error")
+            if message["type"] == "error":
+                raise ERRORS.get(message["error"], QueryError)(message["message"])
+            yield message
+    finally:
+        del _inbox[request_id]
+        if not finished:
+            _post("cancel", request_id, worker)
+
+
+async def call(kind: str, worker: JsProxy = WORKER, **fields: object) -> dict:
+    """Send a worker a request and return the done message that ends it."""
+    async for message in request(kind, worker, **fields):
+        reply = message
+    return reply
+
+
+def start_image_workers() -> None:
+    """Start the image workers, once, and have each load Pillow, ready for the images to come."""
+    while len(_pool) < IMAGE_WORKERS:
+        worker = Worker.new(WORKER_URL)
+        worker.onmessage = create_proxy(_receive)
+        _pool.append(worker)
+        _busy.append(0)
+        _post("image_support", next(_ids), worker)
+
+
+async def to_ascii(url: str, columns: int, *, colour: bool = False) -> str:
+    """Convert the image at `url` to ASCII art in whichever image worker has the least to do.
+
+    The image workers must have been started. In colour the art is HTML, each run of characters in a span
+    of its colour.
+    """
+    index = min(range(len(_pool)), key=_busy.__getitem__)
+    _busy[index] += 1
+    try:
+        return (await call("ascii", _pool[index], url=url, columns=columns, colour=colour))["text"]
+    finally:
+        _busy[index] -= 1
+
+
+def set_hidden(*, hidden: bool) -> None:
+    """Tell the engine worker whether the page is hidden, so it holds WATCH refreshes nobody would see."""
+    _post("visibility", next(_ids), hidden=hidden)
+
+
+def cancel_queries() -> None:
+    """Stop every running query, each ending with a QueryCancelledError."""
+    for request_id, (kind, queue) in _inbox.items():
+        if kind == "query":
+            queue.put_nowait({"type": "error", "id": request_id, "error": "cancelled", "message": "Query cancelled"})
+            _post("cancel", request_id)
+
+
+class EngineClient:
+    """Stands in on the main thread for the BskySession that lives in the engine worker."""
+
+    def __init__(self, username: str, password: str, pds_host: str | None = None) -> None:
+        self.username = username
+        _post("session", next(_ids), username=username, password=password, pds=pds_host)
+
+    async def login(self) -> bool:
+        """Log the worker's session in, returning whether it worked."""
+        return (await call("login"))["ok"]
+
+    async def get_blob(self, url: str) -> str:
+        """Get the URL a blob can be downloaded from."""
+        return (await call("blob", url=url))["url"]
+
+    def query(self, query: str) -> AsyncIterator[dict]:
+        """Run a query in the worker, yielding its page and chunk messages and finally its done message."""
+        return request("query", query=query)
+
+
+class _Reply:
+    """A message event from a worker, as _receive gets it."""
+
+    def __init__(self, **message: object) -> None:
+        self.data = self
+        self.message = message
+
+    def to_py(self) -> dict:
+        return self.message
+
+
+def test_request(monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that replies reach their request, an error is raised as its type, and leaving early cancels."""
+    import contextlib  # noqa: PLC0415 Only the test leaves a request early
+
+    import pytest  # noqa: PLC0415 Only the tests need pytest
+
+    posted = []
+    monkeypatch.setitem(
+        globals(), "_post", lambda kind, request_id, _worker=WORKER, **_: posted.append((kind, request_id))
+    )
+
+    async def reply(**message: object) -> None:
+        # the reply to the request posted last
+        await asyncio.sleep(0)
+        _receive(_Reply(id=posted[-1][1], **message))
+
+    async def run() -> tuple[dict, dict]:
+        login = asyncio.ensure_future(call("login"))
+        await reply(type="done", ok=True)
+        blob = asyncio.ensure_future(call("blob", url="x"))
+        await reply(type="error", error="StealthModeError", message="Log in to see likes")
+        with pytest.raises(StealthModeError, match="Log in to see likes"):
+            await blob
+        async with contextlib.aclosing(request("query", query="SELECT 1")) as replies:
+            page = asyncio.ensure_future(anext(replies))
+            await reply(type="page", rows=[{"a": 1}])
+            first = await page
+        return await login, first
+
+    done, page = asyncio.run(run())
+    assert (done["ok"], page["rows"]) == (True, [{"a": 1}])
+    assert [kind for kind, _ in posted] == ["login", "blob", "query", "cancel"]
+    assert posted[2][1] == posted[3][1]
+    assert not _inbox
+
+
+def test_image_workers(monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that no worker loads Pillow until images are wanted, then only the image workers, once each.
+
+    Each image goes to the least busy image worker, never the engine worker.
+    """
+    assert not _pool
+    posted = []
+    monkeypatch.setitem(
+        globals(), "_post", lambda kind, request_id, worker=WORKER, **_: posted.append((kind, request_id, worker))
+    )
+    monkeypatch.setitem(globals(), "_pool", [])
+    monkeypatch.setitem(globals(), "_busy", [])
+    start_image_workers()
+    start_image_workers()
+    assert [(kind, worker) for kind, _, worker in posted] == [("image_support", worker) for worker in _pool]
+    assert len(_pool) == IMAGE_WORKERS
+    assert WORKER not in _pool
+
+    async def run() -> list[str]:
+        converting = [asyncio.ensure_future(to_ascii(f"blob:{n}", 100)) for n in range(IMAGE_WORKERS + 1)]
+        await asyncio.sleep(0)
+        for _, request_id, _worker in posted[IMAGE_WORKERS:]:
+            _receive(_Reply(id=request_id, type="done", text=f"art {request_id}"))
+        return await asyncio.gather(*converting)
+
+    asyncio.run(run())
+    ascii_workers = [worker for kind, _, worker in posted if kind == "ascii"]
+    assert ascii_workers == [*_pool, _pool[0]]
+    assert _busy == [0] * IMAGE_WORKERS
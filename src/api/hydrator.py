@@ -0,0 +1,200 @@
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from typing import Any
+
+PROFILES_BATCH = 25  # The most actors app.bsky.actor.getProfiles takes per call
+HYDRATE_WINDOW = 0.01  # Seconds to wait for more actors before sending a partial batch
+PROFILE_TTL = 300  # Seconds a fetched profile stays cached
+PROFILE_CACHE_SIZE = 5000  # Most cache entries kept, each profile is cached under its DID and handle
+
+_MISSING = object()
+
+
+def _key(actor: str) -> str:
+    """Normalise an actor for the cache, handles are case insensitive but DIDs are not."""
+    return actor if actor.startswith("did:") else actor.lower()
+
+
+class ProfileHydrator:
+    """Resolve actors to profiles through getProfiles, batching and caching the lookups.
+
+    Actors asked for within `window` seconds of each other share calls of up to 25 actors, repeats are
+    only fetched once and resolved profiles (or the lack of one) are cached by both DID and handle.
+    """
+
+    def __init__(
+        self,
+        session: Any,  # noqa: ANN401
+        window: float = HYDRATE_WINDOW,
+        ttl: float = PROFILE_TTL,
+        max_size: int = PROFILE_CACHE_SIZE,
+    ) -> None:
+        self.session = session
+        self.window = window
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cache: OrderedDict[str, tuple[float, dict | None]] = OrderedDict()
+        self.pending: dict[str, asyncio.Future] = {}
+        self.flush_task: asyncio.Task | None = None
+        self.tasks: set[asyncio.Task] = set()
+
+    async def get(self, actor: str) -> dict | None:
+        """Get one profile, or None if the actor doesn't exist."""
+        return (await self.get_many([actor]))[actor]
+
+    async def get_many(self, actors: list[str]) -> dict[str, dict | None]:
+        """Get the profiles for a list of actors, keyed by the actor as given."""
+        result = {}
+        waiting = {}
+        for actor in dict.fromkeys(actors):
+            key = _key(actor)
+            cached = self._cached(key)
+            if cached is not _MISSING:
+                self.session.client.count("cache_hits")
+                result[actor] = cached
+                continue
+
+            if key not in self.pending:
+                self.pending[key] = asyncio.get_running_loop().create_future()
+            waiting[actor] = self.pending[key]
+
+        if waiting:
+            self._schedule()
+        for actor, future in waiting.items():
+            result[actor] = await future
+        return result
+
+    def invalidate(self) -> None:
+        """Forget every cached profile."""
+        self.cache.clear()
+
+    def _cached(self, key: str) -> dict | None | object:
+        entry = self.cache.get(key)
+        if entry is None:
+            return _MISSING
+        expires, profile = entry
+        if expires < time.monotonic():
+            del self.cache[key]
+            return _MISSING
+        self.cache.move_to_end(key)
+        return profile
+
+    def _store(self, key: str, profile: dict | None) -> None:
+        self.cache[key] = (time.monotonic() + self.ttl, profile)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def _schedule(self) -> None:
+        if len(self.pending) >= PROFILES_BATCH:
+            # a full batch is ready, so there's no point waiting
+            self._spawn(self._flush())
+        elif self.flush_task is None:
+            self.flush_task = self._spawn(self._flush_later())
+
+    def _spawn(self, coroutine: Any) -> asyncio.Task:  # noqa: ANN401
+        # the task runs in a copy of the caller's context, so a shared batch's calls count once, for the query
+        # whose lookup sent it
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        # actors asked for from here on need a window of their own
+        self.flush_task = None
+        await self._flush()
+
+    async def _flush(self) -> None:
+        pending, self.pending = self.pending, {}
+        keys = list(pending)
+        batches = [keys[i : i + PROFILES_BATCH] for i in range(0, len(keys), PROFILES_BATCH)]
+        await asyncio.gather(*(self._fetch(batch, pending) for batch in batches))
+
+    async def _fetch(self, keys: list[str], pending: dict[str, asyncio.Future]) -> None:
+        try:
+            response = await self.session.get_profiles(keys)
+        except Exception as e:  # noqa: BLE001 handed to whoever is waiting
+            for key in keys:
+                pending[key].set_exception(e)
+            return
+
+        if "profiles" not in response:
+            # an error response, so don't remember these actors as missing
+            for key in keys:
+                pending[key].set_result(None)
+            return
+
+        found = {}
+        for profile in response.get("profiles", []):
+            found[profile["did"]] = profile
+            found[_key(profile.get("handle", ""))] = profile
+            self._store(profile["did"], profile)
+            self._store(_key(profile.get("handle", "")), profile)
+
+        for key in keys:
+            profile = found.get(key)
+            if profile is None:
+                self._store(key, None)
+            pending[key].set_result(profile)
+
+
+class _FakeClient:
+    def __init__(self) -> None:
+        self.stats = Counter()
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.stats[name] += amount
+
+
+class _FakeSession:
+    """A session whose getProfiles knows every actor but those starting with `gone`."""
+
+    def __init__(self) -> None:
+        self.client = _FakeClient()
+        self.batches = []
+
+    async def get_profiles(self, actors: list[str]) -> dict:
+        self.batches.append(actors)
+        return {
+            "profiles": [
+                {"did": f"did:plc:{actor.split('.')[0]}", "handle": actor} for actor in actors if "gone" not in actor
+            ]
+        }
+
+
+def test_batches_of_25() -> None:
+    """Tests that actors asked for together are fetched 25 at a time, and then answered from the cache."""
+    session = _FakeSession()
+
+    async def run() -> None:
+        hydrator = ProfileHydrator(session)
+        profiles = await hydrator.get_many([f"user{i}.test" for i in range(60)])
+        assert profiles["user7.test"]["did"] == "did:plc:user7"
+        assert [len(batch) for batch in session.batches] == [25, 25, 10]
+
+        # handles are cached case insensitively, and under the DID too
+        assert (await hydrator.get("USER7.test"))["handle"] == "user7.test"
+        assert (await hydrator.get("did:plc:user8"))["handle"] == "user8.test"
+        assert [len(batch) for batch in session.batches] == [25, 25, 10]
+        assert session.client.stats == Counter(cache_hits=2)
+
+    asyncio.run(run())
+
+
+def test_shared_window() -> None:
+    """Tests that lookups made at the same time share a call, and that a missing actor is remembered."""
+    session = _FakeSession()
+
+    async def run() -> None:
+        hydrator = ProfileHydrator(session)
+        found = await asyncio.gather(hydrator.get("a.test"), hydrator.get("gone.test"), hydrator.get("a.test"))
+        assert [profile and profile["handle"] for profile in found] == ["a.test", None, "a.test"]
+        assert session.batches == [["a.test", "gone.test"]]
+
+        assert await hydrator.get("gone.test") is None
+        assert len(session.batches) == 1
+
+    asyncio.run(run())
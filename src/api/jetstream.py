@@ -0,0 +1,217 @@
+"""A subscription to Jetstream, the firehose of every repo's commits as JSON, read by the `stream` table.
+
+Jetstream filters the events by collection and DID before sending them, so only the ones a query asks for
+cross the network. Events go into a ring buffer as they arrive and the query takes them off in batches, so
+a query that falls behind drops the oldest events rather than holding on to all of them. A dropped
+connection is picked up again from the last event received.
+"""
+
+import asyncio
+import contextlib
+import json
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from urllib.parse import urlencode
+
+from transport import WebSocket, open_websocket
+
+BUFFER_EVENTS = 10_000  # Events held for a query that's behind, the oldest are dropped past this
+BATCH_SECONDS = 0.25  # Longest wait for a batch to fill, so a quiet stream still arrives promptly
+BATCH_EVENTS = 500  # Most events in a batch, one this full is handed over without waiting
+RETRIES = 3  # Reconnects tried in a row, without an event in between, before the query fails
+RETRY_SECONDS = 2.0  # Wait before the first reconnect, doubled for each one after it
+
+
+def subscribe_url(host: str, collections: list[str], dids: list[str], cursor: int | None = None) -> str:
+    """Build the URL subscribing to the events of some collections and DIDs, every event if neither is given.
+
+    A collection can end in `.*` to take every collection under it, and `cursor` replays from that time_us.
+    """
+    params = [("wantedCollections", c) for c in collections] + [("wantedDids", d) for d in dids]
+    if cursor is not None:
+        params.append(("cursor", cursor))
+    return f"{host}/subscribe{'?' if params else ''}{urlencode(params)}"
+
+
+def event_row(event: dict) -> dict:
+    """Shape an event as a row, with the commit's fields at the top and its record kept for flattening."""
+    row = {"did": event.get("did"), "time_us": event.get("time_us"), "kind": event.get("kind")}
+    commit = event.get("commit")
+    if commit is not None:
+        row |= {
+            "collection": commit.get("collection"),
+            "operation": commit.get("operation"),
+            "rkey": commit.get("rkey"),
+            "uri": f"at://{row['did']}/{commit.get('collection')}/{commit.get('rkey')}",
+            "cid": commit.get("cid"),
+            "record": commit.get("record") or {},
+        }
+    for kind in ("identity", "account"):
+        if kind in event:
+            row[kind] = event[kind]
+    return row
+
+
+class Subscription:
+    """The events of one Jetstream subscription, buffered until the query takes them."""
+
+    def __init__(self, host: str, collections: list[str], dids: list[str], buffer: int = BUFFER_EVENTS) -> None:
+        self.host = host
+        self.collections = collections
+        self.dids = dids
+        self.events: deque[dict] = deque(maxlen=buffer)
+        self.received = 0
+        self.dropped = 0  # Events pushed out of the full buffer before the query took them
+        self.bytes = 0
+        self.connections = 0
+        self.cursor: int | None = None  # time_us of the last event, where a reconnect carries on from
+        self.socket: WebSocket | None = None
+        self.closed: str | None = None  # Why the connection ended, None while it's open
+        self.arrived = asyncio.Event()
+
+    def _message(self, text: str) -> None:
+        self.bytes += len(text)
+        self.received += 1
+        event = json.loads(text)
+        self.cursor = event.get("time_us", self.cursor)
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+        # the query wakes for the first event, and again once a batch is full
+        if len(self.events) in (1, BATCH_EVENTS):
+            self.arrived.set()
+
+    def _close(self, reason: str) -> None:
+        self.closed = reason
+        self.arrived.set()
+
+    async def _connect(self) -> None:
+        if self.socket is not None:
+            await self.socket.close()
+        self.closed = None
+        self.connections += 1
+        url = subscribe_url(self.host, self.collections, self.dids, self.cursor)
+        self.socket = open_websocket(url, self._message, self._close)
+
+    async def batches(self) -> AsyncIterator[list[dict]]:
+        """Yield the events received since the last batch as rows, up to BATCH_EVENTS at a time, until closed.
+
+        Raises ConnectionError once the connection has dropped RETRIES times in a row.
+        """
+        failures, last = 0, 0.0
+        await self._connect()
+        try:
+            while True:
+                await self.arrived.wait()
+                self.arrived.clear()
+                wait = last + BATCH_SECONDS - time.monotonic()
+                if wait > 0 and len(self.events) < BATCH_EVENTS and self.closed is None:
+                    with contextlib.suppress(TimeoutError):
+                        await asyncio.wait_for(self.arrived.wait(), wait)
+                    self.arrived.clear()
+                if self.events:
+                    failures, last = 0, time.monotonic()
+                while self.events:
+                    # taken a batch at a time, so a query that's done stops before shaping the rest
+                    events = [self.events.popleft() for _ in range(min(BATCH_EVENTS, len(self.events)))]
+                    yield [event_row(event) for event in events]
+                if self.closed is not None:
+                    failures += 1
+                    if failures > RETRIES:
+                        msg = f"{self.closed}, after {RETRIES} reconnects"
+                        raise ConnectionError(msg)
+                    await asyncio.sleep(RETRY_SECONDS * 2 ** (failures - 1))
+                    await self._connect()
+        finally:
+            if self.socket is not None:
+                await self.socket.close()
+
+
+def _post(time_us: int, text: str = "hi") -> dict:
+    """Build a Jetstream commit event creating a post."""
+    record = {"$type": "app.bsky.feed.post", "text": text}
+    commit = {"operation": "create", "collection": "app.bsky.feed.post", "rkey": f"r{time_us}", "record": record}
+    return {"did": "did:plc:a", "time_us": time_us, "kind": "commit", "commit": commit}
+
+
+def test_subscribe_url() -> None:
+    """Tests that the filters and cursor are encoded into the query string, and left out when not given."""
+    assert subscribe_url("ws://h", [], []) == "ws://h/subscribe"
+    assert subscribe_url("ws://h", ["app.bsky.feed.*"], ["did:plc:a", "did:plc:b"], 17) == (
+        "ws://h/subscribe?wantedCollections=app.bsky.feed.%2A&wantedDids=did%3Aplc%3Aa&wantedDids=did%3Aplc%3Ab"
+        "&cursor=17"
+    )
+
+
+def test_event_row() -> None:
+    """Tests that a commit's fields are lifted to the top of the row and an identity event keeps its own."""
+    assert event_row(_post(5)) == {
+        "did": "did:plc:a",
+        "time_us": 5,
+        "kind": "commit",
+        "collection": "app.bsky.feed.post",
+        "operation": "create",
+        "rkey": "r5",
+        "uri": "at://did:plc:a/app.bsky.feed.post/r5",
+        "cid": None,
+        "record": {"$type": "app.bsky.feed.post", "text": "hi"},
+    }
+    identity = {"did": "did:plc:a", "handle": "a.test"}
+    assert event_row({"did": "did:plc:a", "time_us": 6, "kind": "identity", "identity": identity}) == {
+        "did": "did:plc:a",
+        "time_us": 6,
+        "kind": "identity",
+        "identity": identity,
+    }
+
+
+def test_dropped() -> None:
+    """Tests that a full buffer drops the oldest events and counts them, while the cursor follows the newest."""
+
+    async def run() -> Subscription:
+        subscription = Subscription("ws://h", [], [], buffer=3)
+        for time_us in range(1, 6):
+            subscription._message(json.dumps(_post(time_us)))  # noqa: SLF001 Feeding it without a server
+        return subscription
+
+    subscription = asyncio.run(run())
+    assert [event["time_us"] for event in subscription.events] == [3, 4, 5]
+    assert (subscription.received, subscription.dropped, subscription.cursor) == (5, 2, 5)
+
+
+def test_replay_and_reconnect(monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests a subscription to the mock's replay, and that a reconnect carries on after the last event received.
+
+    The recording's like is filtered out, and its long posts are sent with 16 and 64 bit frame lengths.
+    """
+    from mock_appview import Dataset, start_server  # noqa: PLC0415 Only the tests need the mock server
+
+    monkeypatch.setitem(globals(), "RETRY_SECONDS", 0)
+    like = _post(2) | {"commit": _post(2)["commit"] | {"collection": "app.bsky.feed.like"}}
+    recorded = [_post(1, "x" * 200), like, _post(3, "y" * 70_000)]
+    later = [_post(4), _post(5)]
+    server = start_server(Dataset(actors=2), port=0, events=recorded, events_per_second=0)
+
+    async def run() -> tuple[list[dict], Subscription]:
+        subscription = Subscription(f"ws://localhost:{server.server_address[1]}", ["app.bsky.feed.post"], [])
+        rows = []
+        async with contextlib.aclosing(subscription.batches()) as batches:
+            async for batch in batches:
+                rows += batch
+                if rows[-1]["time_us"] == 3:  # noqa: PLR2004 The last recorded post
+                    # the server replays from the cursor, so only the events recorded since come back
+                    server.events.extend(later)
+                    await subscription.socket.close()
+                    subscription._close("the server hung up")  # noqa: SLF001 Dropping it as the server would
+                elif rows[-1]["time_us"] == 5:  # noqa: PLR2004 The last later post
+                    break
+        return rows, subscription
+
+    try:
+        rows, subscription = asyncio.run(asyncio.wait_for(run(), 10))
+    finally:
+        server.shutdown()
+    assert [row["time_us"] for row in rows] == [1, 3, 4, 5]
+    assert [len(row["record"]["text"]) for row in rows[:2]] == [200, 70_000]
+    assert (subscription.connections, subscription.dropped) == (2, 0)
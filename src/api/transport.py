@@ -0,0 +1,476 @@
+# Imports
+import abc
+import asyncio
+import base64
+import contextlib
+import hashlib
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Protocol
+from urllib.parse import urlsplit
+
+if sys.platform == "emscripten":
+    from js import WebSocket as JsWebSocket
+    from pyodide.ffi import create_proxy
+    from pyodide.http import pyfetch  # The system we will actually use in the browser
+
+TIMEOUT = 30  # Seconds before a CPython request gives up
+MAX_CONNECTIONS = 16  # Requests HttpSession runs at once, and kept-alive connections it holds per host
+
+# WebSocket frame opcodes, and the length markers of a frame header
+OP_CONTINUATION, OP_TEXT, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x8, 0x9, 0xA
+LENGTH_16, LENGTH_64 = 126, 127
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"  # Hashed with the key to accept a handshake
+
+# The totals of the call being made, so concurrent queries over one session each count only their own requests
+CALL_STATS: ContextVar[Counter | None] = ContextVar("call_stats", default=None)
+
+
+class Response(Protocol):
+    """What BskySession needs from a response, which pyodide's FetchResponse already provides."""
+
+    status: int
+    ok: bool
+    headers: dict[str, str]
+
+    async def bytes(self) -> bytes:
+        """Get the body."""
+
+    async def json(self) -> dict:
+        """Get the body decoded as JSON."""
+
+
+@dataclass
+class RateLimit:
+    """The API's rate limit as the last response that reported it left it, from the RateLimit-* headers."""
+
+    remaining: int | None = None  # Requests left in the window, None until a response says
+    reset: float = 0.0  # Epoch seconds when the window is full again
+
+    def update(self, headers: dict[str, str]) -> None:
+        """Read the limit from a response's headers, if it has them."""
+        headers = {name.lower(): value for name, value in headers.items()}
+        if "ratelimit-remaining" in headers:
+            self.remaining = int(headers["ratelimit-remaining"])
+            self.reset = float(headers.get("ratelimit-reset", 0))
+
+    def delay(self, reserve: int) -> float:
+        """Get how many seconds to hold off for, so `reserve` requests are left for anything more urgent."""
+        if self.remaining is None or self.remaining > reserve:
+            return 0.0
+        return max(0.0, self.reset - time.time())
+
+
+class Transport(abc.ABC):
+    """Sends a BskySession's requests, keeping the running totals EXPLAIN ANALYZE reads."""
+
+    def __init__(self, headers: dict | None = None) -> None:
+        self.default_headers = headers or {}
+        # Running totals read by EXPLAIN ANALYZE, e.g. "http_calls", "bytes" and "cache_hits"
+        self.stats = Counter()
+        # What's left of the API's rate limit, which watched queries wait for
+        self.rate_limit = RateLimit()
+
+    @abc.abstractmethod
+    async def get(self, url: str, headers: dict | None = None) -> Response:
+        """Send a GET request."""
+
+    @abc.abstractmethod
+    async def post(self, url: str, data: str | dict | None = "", headers: dict | None = None) -> Response:
+        """Send a POST request, encoding a dict body as JSON."""
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Add to a running total, and to the totals of the call being made, if it's counting them."""
+        self.stats[name] += amount
+        call = CALL_STATS.get()
+        if call is not None:
+            call[name] += amount
+
+    def _headers(self, headers: dict | None) -> dict:
+        merged_headers = self.default_headers.copy()
+        if headers:
+            merged_headers.update(headers)
+        return merged_headers
+
+
+class PyfetchSession(Transport):
+    """Pyfetch Session, emulating the request Session."""
+
+    async def get(self, url: str, headers: dict | None = None) -> Response:
+        """Get request for the pyfetch.
+
+        Args:
+            url (str): The Endpoint to hit
+            headers (dict | None, optional): Any headers that will get added to the request. Defaults to "".
+
+        Returns:
+            FetchResponse: The return data from the request
+
+        """
+        self.count("http_calls")
+        return await pyfetch(
+            url,
+            method="GET",
+            headers=self._headers(headers),
+        )
+
+    async def post(
+        self,
+        url: str,
+        data: str | dict | None = "",
+        headers: dict | None = None,
+    ) -> Response:
+        """Post request.
+
+        Args:
+            url (str): The Endpoint to hit
+            data (str | dict | None, optional): A dictionary or string to use for the body. Defaults to "".
+            headers (dict | None, optional): Any headers that will get added to the request. Defaults to "".
+
+        Returns:
+            FetchResponse: The return data from the request
+
+        """
+        self.count("http_calls")
+        return await pyfetch(
+            url,
+            method="POST",
+            headers=self._headers(headers),
+            body=json.dumps(data) if isinstance(data, dict) else data,
+        )
+
+
+@dataclass
+class HttpResponse:
+    """A finished response read by HttpSession, with the same async readers as FetchResponse."""
+
+    status: int
+    headers: dict[str, str] = field(default_factory=dict)
+    body: bytes = b""
+
+    @property
+    def ok(self) -> bool:
+        """Whether the status is 2xx."""
+        return 200 <= self.status < 300  # noqa: PLR2004
+
+    async def bytes(self) -> bytes:
+        """Get the body."""
+        return self.body
+
+    async def text(self) -> str:
+        """Get the body as text."""
+        return self.body.decode()
+
+    async def json(self) -> dict:
+        """Get the body decoded as JSON."""
+        return json.loads(self.body)
+
+
+class HttpSession(Transport):
+    """CPython transport on the standard library, for running queries outside a browser.
+
+    Requests run on a pool of `max_connections` threads over http.client connections that are kept alive and
+    reused per host, so many concurrent queries don't pay for a new TLS handshake each call.
+    """
+
+    def __init__(
+        self, headers: dict | None = None, timeout: float = TIMEOUT, max_connections: int = MAX_CONNECTIONS
+    ) -> None:
+        super().__init__(headers)
+        self.timeout = timeout
+        self.max_idle = max_connections
+        self.executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="http")
+        self.idle: dict[tuple[str, str], list[http.client.HTTPConnection]] = {}
+        self.lock = threading.Lock()
+
+    async def get(self, url: str, headers: dict | None = None) -> HttpResponse:
+        """Send a GET request."""
+        self.count("http_calls")
+        return await self._run("GET", url, None, headers)
+
+    async def post(self, url: str, data: str | dict | None = "", headers: dict | None = None) -> HttpResponse:
+        """Send a POST request, encoding a dict body as JSON."""
+        self.count("http_calls")
+        body = (json.dumps(data) if isinstance(data, dict) else data or "").encode()
+        return await self._run("POST", url, body, headers)
+
+    def close(self) -> None:
+        """Stop the threads and close every idle connection."""
+        self.executor.shutdown()
+        with self.lock:
+            connections = [c for pool in self.idle.values() for c in pool]
+            self.idle.clear()
+        for connection in connections:
+            connection.close()
+
+    async def _run(self, method: str, url: str, body: bytes | None, headers: dict | None) -> HttpResponse:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._request, method, url, body, self._headers(headers))
+
+    def _request(self, method: str, url: str, body: bytes | None, headers: dict) -> HttpResponse:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        while True:
+            connection, reused = self._connection(key)
+            try:
+                connection.request(method, path or "/", body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused:
+                    # the server closed a kept-alive connection while it sat idle, try a fresh one
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            break
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+        return HttpResponse(response.status, dict(response.getheaders()), data)
+
+    def _connection(self, key: tuple[str, str]) -> tuple[http.client.HTTPConnection, bool]:
+        with self.lock:
+            pool = self.idle.get(key)
+            if pool:
+                return pool.pop(), True
+        scheme, netloc = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(netloc, timeout=self.timeout), False
+
+    def _release(self, key: tuple[str, str], connection: http.client.HTTPConnection) -> None:
+        with self.lock:
+            pool = self.idle.setdefault(key, [])
+            if len(pool) < self.max_idle:
+                pool.append(connection)
+                return
+        connection.close()
+
+
+class WebSocket(Protocol):
+    """A connection handing each of a server's text messages to a callback, as `open_websocket` makes them."""
+
+    async def close(self) -> None:
+        """Close the connection, without calling back that it closed."""
+
+
+class BrowserWebSocket:
+    """The browser's WebSocket, handing each text message to `on_message` and why it closed to `on_close`."""
+
+    def __init__(self, url: str, on_message: Callable[[str], None], on_close: Callable[[str], None]) -> None:
+        self.socket = JsWebSocket.new(url)
+
+        def _message(event: object) -> None:
+            on_message(event.data)
+
+        def _close(event: object) -> None:
+            on_close(f"code {event.code}{f', {event.reason}' if event.reason else ''}")
+
+        self.proxies = [create_proxy(_message), create_proxy(_close)]
+        self.socket.onmessage, self.socket.onclose = self.proxies
+
+    async def close(self) -> None:
+        """Close the socket and free the callbacks."""
+        self.socket.onmessage = self.socket.onclose = None
+        self.socket.close()
+        for proxy in self.proxies:
+            proxy.destroy()
+
+
+class StdlibWebSocket:
+    """CPython WebSocket client on asyncio streams, for reading streams outside a browser.
+
+    It only receives: text messages go to `on_message`, pings are answered, and `on_close` hears why the
+    connection ended, unless `close()` ended it.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        on_message: Callable[[str], None],
+        on_close: Callable[[str], None],
+        timeout: float = TIMEOUT,
+    ) -> None:
+        self.writer: asyncio.StreamWriter | None = None
+        self.timeout = timeout  # Seconds to wait for the connection and handshake
+        self.task = asyncio.ensure_future(self._run(url, on_message, on_close))
+
+    async def close(self) -> None:
+        """Stop reading and close the connection, telling the server first."""
+        self.task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.task
+        if self.writer is not None:
+            with contextlib.suppress(OSError):
+                self.writer.write(_frame(OP_CLOSE, b""))
+            self.writer.close()
+
+    async def _run(self, url: str, on_message: Callable[[str], None], on_close: Callable[[str], None]) -> None:
+        try:
+            reader = await asyncio.wait_for(self._connect(url), self.timeout)
+            fragments = []
+            while True:
+                final, opcode, payload = await _read_frame(reader)
+                if opcode == OP_CLOSE:
+                    break
+                if opcode == OP_PING:
+                    self.writer.write(_frame(OP_PONG, payload))
+                elif opcode in (OP_TEXT, OP_CONTINUATION):
+                    fragments.append(payload)
+                    if final:
+                        on_message(b"".join(fragments).decode())
+                        fragments = []
+                        # frames already buffered don't wait, so let the query take what's arrived
+                        await asyncio.sleep(0)
+        except EOFError:
+            on_close("the server hung up")
+            return
+        except (OSError, ValueError) as e:
+            on_close(str(e) or type(e).__name__)
+            return
+        on_close("closed by the server")
+
+    async def _connect(self, url: str) -> asyncio.StreamReader:
+        parts = urlsplit(url)
+        secure = parts.scheme == "wss"
+        reader, self.writer = await asyncio.open_connection(
+            parts.hostname, parts.port or (443 if secure else 80), ssl=secure or None
+        )
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        self.writer.write(
+            f"GET {path or '/'} HTTP/1.1\r\nHost: {parts.netloc}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode()
+        )
+        status = (await reader.readline()).decode("latin-1").strip()
+        headers = {}
+        while (line := await reader.readline()).strip():
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        digest = hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()  # noqa: S324 The handshake is defined with SHA-1
+        if status.split()[1:2] != ["101"] or headers.get("sec-websocket-accept") != base64.b64encode(digest).decode():
+            msg = f"WebSocket handshake refused: {status or 'no response'}"
+            raise ValueError(msg)
+        return reader
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple[bool, int, bytes]:
+    """Read a frame, returning whether it ends its message, its opcode and its unmasked payload."""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == LENGTH_16:
+        length = int.from_bytes(await reader.readexactly(2))
+    elif length == LENGTH_64:
+        length = int.from_bytes(await reader.readexactly(8))
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask is not None:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return bool(first & 0x80), first & 0x0F, payload
+
+
+def _frame(opcode: int, payload: bytes) -> bytes:
+    """Build a client's control frame, which is masked and has at most 125 bytes of payload."""
+    mask = os.urandom(4)
+    masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return bytes([0x80 | opcode, 0x80 | len(payload)]) + mask + masked
+
+
+def open_websocket(url: str, on_message: Callable[[str], None], on_close: Callable[[str], None]) -> WebSocket:
+    """Connect to a WebSocket server, with the browser's WebSocket or the standard library anywhere else."""
+    if sys.platform == "emscripten":
+        return BrowserWebSocket(url, on_message, on_close)
+    return StdlibWebSocket(url, on_message, on_close)
+
+
+def default_transport() -> Transport:
+    """Pick pyfetch in the browser, and the standard library anywhere else."""
+    if sys.platform == "emscripten":
+        return PyfetchSession()
+    return HttpSession()
+
+
+def test_pooled_get() -> None:
+    """Tests that concurrent GETs each count a call, and that their connections are kept for the next ones."""
+    from mock_appview import Dataset, start_server  # noqa: PLC0415 Only the tests need the mock server
+
+    server = start_server(Dataset(actors=10, posts=1, follows=1), port=0)
+    host = f"localhost:{server.server_address[1]}"
+    session = HttpSession(max_connections=4)
+
+    async def run() -> tuple[list[HttpResponse], int]:
+        responses = await asyncio.gather(
+            *(session.get(f"http://{host}/xrpc/app.bsky.actor.getProfile?actor=user{i}.test") for i in range(1, 9))
+        )
+        return responses, len(session.idle[("http", host)])
+
+    try:
+        responses, kept = asyncio.run(run())
+    finally:
+        session.close()
+        server.shutdown()
+    assert [(r.status, json.loads(r.body)["handle"]) for r in responses] == [
+        (200, f"user{i}.test") for i in range(1, 9)
+    ]
+    assert session.stats == Counter(http_calls=8)
+    # no more connections than threads, and none left open once the session's closed
+    assert kept in range(1, 5)
+    assert not session.idle
+
+
+def test_connection_reuse() -> None:
+    """Tests that calls one after another, even one answered with an error status, go over one connection."""
+    from mock_appview import Dataset, start_server  # noqa: PLC0415 Only the tests need the mock server
+
+    server = start_server(Dataset(actors=10, posts=1, follows=1), port=0)
+    key = ("http", f"localhost:{server.server_address[1]}")
+    session = HttpSession()
+
+    async def run() -> list[tuple[int, int]]:
+        statuses = []
+        for actor in ("user1.test", "nobody.test", "user2.test"):
+            response = await session.get(f"{key[0]}://{key[1]}/xrpc/app.bsky.actor.getProfile?actor={actor}")
+            (connection,) = session.idle[key]
+            statuses.append((response.status, id(connection.sock)))
+        return statuses
+
+    try:
+        statuses = asyncio.run(run())
+    finally:
+        session.close()
+        server.shutdown()
+    assert [status for status, _ in statuses] == [200, 400, 200]
+    assert len({sock for _, sock in statuses}) == 1
+
+
+def test_refused() -> None:
+    """Tests that a refused connection raises an OSError, and isn't kept for later calls."""
+    import socket  # noqa: PLC0415 Only the test needs a raw socket
+
+    import pytest  # noqa: PLC0415 Only the tests need pytest
+
+    with socket.socket() as unused:
+        # bound but never listening, so nothing answers on its port
+        unused.bind(("localhost", 0))
+        session = HttpSession()
+        try:
+            with pytest.raises(OSError):  # noqa: PT011 Refused is reported differently per platform
+                asyncio.run(session.get(f"http://localhost:{unused.getsockname()[1]}/"))
+        finally:
+            session.close()
+    assert session.stats == Counter(http_calls=1)
+    assert not session.idle
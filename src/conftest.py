@@ -0,0 +1,5 @@
+"""Let pytest import the modules written for the browser, against the fake DOM the benchmarks count calls with."""
+
+from benchmarks import fakedom
+
+fakedom.install()
@@ -0,0 +1,115 @@
+"""Turn image bytes into monochrome ASCII art, decoding no more of the image than the characters need.
+
+This runs in the image workers, once Pillow is loaded there. It draws with the same
+characters and width ratio as ascii_magic's `to_ascii(monochrome=True)`, which it replaces. Every pixel is
+mapped at once rather than one at a time in Python: by bytes.translate for monochrome text, and by NumPy,
+loaded only for it, for colour.
+"""
+
+import html
+from io import BytesIO
+
+from PIL import Image
+
+# Characters from least to most dense, as ascii_magic draws them
+CHARS = " .`-_':,;^=+/\"|)\\<>)iv%xclrs{*}I?!][1taeo7zjLunT#JCwfy325Fp6mqSghVd4EgXPGZbYkOA&8U$@KHDBWNMR0QQ"
+WIDTH_RATIO = 2.2  # How much taller a character is than it is wide
+RESAMPLE_GAP = 2.0  # Shrink by whole factors with Image.reduce until within this of the size, then resample
+
+# Maps each grayscale byte to its character, for bytes.translate
+_TABLE = bytes(ord(CHARS[value * (len(CHARS) - 1) // 255]) for value in range(256))
+
+
+def grid_size(width: int, height: int, columns: int) -> tuple[int, int]:
+    """Get the characters across and down an image of this size takes up."""
+    return columns, max(1, int(height * columns / (width * WIDTH_RATIO)))
+
+
+def decode(data: bytes, columns: int, mode: str = "L") -> Image.Image:
+    """Decode an image straight into a grid with one pixel per character, grayscale unless `mode` says.
+
+    With a JPEG, `draft` has the decoder itself scale down by up to 8x, and skip the colour for grayscale,
+    so a thumbnail is never decoded at full size.
+    """
+    image = Image.open(BytesIO(data))
+    size = grid_size(*image.size, columns)
+    image.draft(mode, size)
+    return image.convert(mode).resize(size, reducing_gap=RESAMPLE_GAP)
+
+
+def render(image: Image.Image) -> str:
+    """Draw a grayscale image as lines of characters, one per pixel."""
+    text = image.tobytes().translate(_TABLE).decode("ascii")
+    width = image.width
+    return "\n".join(text[start : start + width] for start in range(0, len(text), width))
+
+
+def render_colour(image: Image.Image) -> str:
+    """Draw an RGB image as lines of HTML, each character in its pixel's colour.
+
+    Neighbouring characters whose colours are the same to 4 bits a channel share a span, which keeps the
+    markup to a few spans a line for most pictures.
+    """
+    import numpy as np  # noqa: PLC0415 Only loaded in the workers when colour is wanted
+
+    pixels = np.asarray(image, dtype=np.int32)
+    # Pillow's grayscale in its own fixed point and rounding, so the characters match the monochrome art
+    luma = (pixels @ np.array([19595, 38470, 7471], dtype=np.int32) + 0x8000) >> 16
+    chars = np.frombuffer(_TABLE, dtype=np.uint8)[luma]
+    colours = (pixels[..., 0] >> 4 << 8) | (pixels[..., 1] >> 4 << 4) | (pixels[..., 2] >> 4)
+
+    lines = []
+    for row_chars, row_colours in zip(chars, colours, strict=True):
+        text = row_chars.tobytes().decode("ascii")
+        starts = np.flatnonzero(np.diff(row_colours, prepend=-1))
+        ends = [*starts[1:], len(text)]
+        lines.append(
+            "".join(
+                f'<span style="color:#{colour:03x}">{html.escape(text[start:end])}</span>'
+                for start, end, colour in zip(starts, ends, row_colours[starts], strict=True)
+            )
+        )
+    return "\n".join(lines)
+
+
+def convert(data: bytes, columns: int, *, colour: bool = False) -> str:
+    """Turn an image's bytes into ASCII art `columns` characters wide, as HTML if it's in colour."""
+    if colour:
+        return render_colour(decode(data, columns, "RGB"))
+    return render(decode(data, columns))
+
+
+def _png(image: Image.Image) -> bytes:
+    data = BytesIO()
+    image.save(data, "PNG")
+    return data.getvalue()
+
+
+def test_grid_size() -> None:
+    """Tests that the rows allow for a character being taller than it's wide, and there's always one."""
+    assert [grid_size(*size, 100) for size in ((220, 100), (100, 300), (1000, 1))] == [(100, 20), (100, 136), (100, 1)]
+
+
+def test_convert() -> None:
+    """Tests that the darkest and lightest pixels get the first and last characters, a line per row."""
+    image = Image.new("L", (8, 5))
+    image.paste(255, (4, 0, 8, 5))
+    assert convert(_png(image), 8) == f"    {CHARS[-1] * 4}\n    {CHARS[-1] * 4}"
+
+
+def test_colour_matches_monochrome() -> None:
+    """Tests that colour art, stripped of its markup, has the very characters of the monochrome art.
+
+    A one row image as wide as the art isn't resized, so any difference is down to the grayscale.
+    """
+    import re  # noqa: PLC0415 Only the test takes the markup apart
+
+    image = Image.new("RGB", (256, 1))
+    image.putdata([(x, 255 - x, x * 7 % 256) for x in range(256)])
+    data = _png(image)
+    art = convert(data, 256, colour=True)
+    assert html.unescape(re.sub(r"<[^>]+>", "", art)) == convert(data, 256)
+    # a run of one colour shares a span
+    assert convert(_png(Image.new("RGB", (4, 1), (255, 0, 0))), 4, colour=True) == (
+        f'<span style="color:#f00">{html.escape(CHARS[76 * (len(CHARS) - 1) // 255] * 4)}</span>'
+    )
@@ -0,0 +1,276 @@
+"""The engine worker's side of the query engine, answering the messages engine_client.py sends.
+
+This runs in web/engine-worker.js's own pyodide. Everything a query costs, like fetching, decoding JSON,
+flattening and encoding exports, happens here, and only the finished pages of rows go to the main thread.
+Copies of the worker with no session convert images to ASCII art, so Pillow is never loaded here.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable
+from functools import cache
+from types import ModuleType
+
+import feed_cache
+import js
+import pyodide_js
+import text_index
+from auth_session import BskySession
+from executor import Plan, QueryError, columns, compile_query, explain_rows, scan_stats, stream
+from export import ParquetExporter, export, exporter_for
+from pyodide.ffi import JsProxy, to_js
+from pyodide.http import pyfetch
+from scheduler import SCHEDULER, follow
+from tracing import TRACER
+
+session: BskySession | None = None
+running: dict[int, asyncio.Task] = {}
+
+
+def _as_text(value: object, _convert: Callable, _cache: Callable) -> str:
+    """Send anything postMessage can't clone, like a datetime, as its text."""
+    return str(value)
+
+
+def post(message: dict, transfer: list | None = None) -> None:
+    """Send a message to the main thread, moving rather than copying the buffers in `transfer`."""
+    js.postMessage(
+        to_js(message, dict_converter=js.Object.fromEntries, default_converter=_as_text), to_js(transfer or [])
+    )
+
+
+class MessageSink:
+    """Send each chunk of an export to the main thread, which writes it to the file the user picked."""
+
+    def __init__(self, request: int) -> None:
+        self.request = request
+
+    async def write(self, data: bytes) -> None:
+        """Move a chunk over to the main thread."""
+        if data:
+            chunk = to_js(data)
+            post({"type": "chunk", "id": self.request, "data": chunk}, [chunk.buffer])
+
+    async def close(self) -> None:
+        """Nothing to do, the main thread closes the file when the query is done."""
+
+
+async def _session(message: dict) -> dict:
+    global session  # noqa: PLW0603 The one session every later message uses
+    session = BskySession(message["username"], message["password"], message["pds"])
+    # what the last session fetched may not be visible to this one
+    text_index.clear()
+    feed_cache.clear()
+    return {}
+
+
+async def _login(_: dict) -> dict:
+    return {"ok": await _current_session().login()}
+
+
+async def _blob(message: dict) -> dict:
+    return {"url": await _current_session().get_blob(message["url"])}
+
+
+async def _query(message: dict) -> dict:
+    current = _current_session()
+    record = TRACER.begin_query(message["query"])
+    plan = compile_query(message["query"])
+    explain = None
+    if plan.explain == "EXPLAIN":
+        count = 0
+        explain = explain_rows(plan)
+    elif plan.outfile and plan.explain is None:
+        count = await _export(message["id"], plan)
+    else:
+        count = 0
+        # the stream's rows keep arriving, so the main thread follows them like a WATCH query's refreshes
+        live = plan.live and plan.explain is None
+        if live:
+            post({"type": "watching", "id": message["id"], "table": plan.table, "watch": None})
+        kind = "tick" if live else "page"
+        async for batch in stream(plan, current):
+            post({"type": kind, "id": message["id"], "head": columns(plan, batch), "rows": batch})
+            count += len(batch)
+        if plan.explain is not None:
+            explain = explain_rows(plan, analyze=True)
+    TRACER.end_query(record, count, scan_stats(plan))
+    summary = {
+        "table": plan.table,
+        "rows": count,
+        "explain": explain,
+        "stats": dict(record.stats),
+        "spans": TRACER.relative_spans(record),
+    }
+    if plan.watch is not None and plan.explain is None:
+        post({"type": "watching", "id": message["id"], "watch": plan.watch, **summary})
+        await _watch(message["id"], message["query"], plan)
+    return summary
+
+
+async def _watch(request: int, query: str, plan: Plan) -> None:
+    """Send the rows each refresh of a WATCH query adds, or why it failed, until the query is cancelled."""
+    async for update in follow(query, plan, session):
+        if isinstance(update, str):
+            post({"type": "status", "id": request, "message": update})
+            continue
+        refresh, batch = update
+        post({"type": "tick", "id": request, "head": columns(refresh, batch), "rows": batch})
+
+
+async def _export(request: int, plan: Plan) -> int:
+    exporter_type = exporter_for(plan.outfile)
+    if exporter_type is ParquetExporter:
+        await pyodide_js.loadPackage("pyarrow")
+    return await export(plan, session, exporter_type(), MessageSink(request))
+
+
+@cache
+def load_image_support() -> asyncio.Task:
+    """Start loading Pillow, once, returning the task that gives the ascii_image module."""
+    return asyncio.ensure_future(_load_image_support())
+
+
+async def _load_image_support() -> ModuleType:
+    await pyodide_js.loadPackage("Pillow")
+    import ascii_image  # noqa: PLC0415 Needs Pillow, which is only loaded once images are wanted
+
+    return ascii_image
+
+
+async def _ascii_image() -> ModuleType:
+    try:
+        return await load_image_support()
+    except Exception:
+        # let the next image try the load again
+        load_image_support.cache_clear()
+        raise
+
+
+async def _image_support(_: dict) -> dict:
+    await _ascii_image()
+    return {}
+
+
+async def _ascii(message: dict) -> dict:
+    ascii_image = await _ascii_image()
+    if message["colour"]:
+        await pyodide_js.loadPackage("numpy")
+    response = await pyfetch(message["url"])
+    response.raise_for_status()
+    return {"text": ascii_image.convert(await response.bytes(), message["columns"], colour=message["colour"])}
+
+
+def _current_session() -> BskySession:
+    if session is None:
+        msg = "Log in or pick stealth mode first"
+        raise QueryError(msg)
+    return session
+
+
+HANDLERS: dict[str, Callable[[dict], Awaitable[dict]]] = {
+    "session": _session,
+    "login": _login,
+    "blob": _blob,
+    "query": _query,
+    "image_support": _image_support,
+    "ascii": _ascii,
+}
+
+
+async def _answer(message: dict) -> None:
+    """Run a request's handler, ending it with a done or error message whatever happens."""
+    try:
+        reply = {"type": "done", **await HANDLERS[message["type"]](message)}
+    except asyncio.CancelledError:
+        reply = {"type": "error", "error": "cancelled", "message": "Query cancelled"}
+    except QueryError as e:
+        reply = {"type": "error", "error": type(e).__name__, "message": str(e)}
+    except Exception as e:  # noqa: BLE001 Anything else would leave the main thread waiting forever
+        reply = {"type": "error", "error": type(e).__name__, "message": f"Query engine error: {e}"}
+    finally:
+        running.pop(message["id"], None)
+    post({**reply, "id": message["id"]})
+
+
+def handle(data: JsProxy) -> None:
+    """Take a message from the main thread, starting its request, cancelling a running one or pausing watches."""
+    message = data.to_py()
+    if message["type"] == "cancel":
+        task = running.get(message["id"])
+        if task is not None:
+            task.cancel()
+        return
+    if message["type"] == "visibility":
+        SCHEDULER.set_hidden(hidden=message["hidden"])
+        return
+    running[message["id"]] = asyncio.ensure_future(_answer(message))
+
+
+class _Message:
+    """A message from the main thread, as handle() gets it."""
+
+    def __init__(self, **fields: object) -> None:
+        self.fields = fields
+
+    def to_py(self) -> dict:
+        return self.fields
+
+
+class _StuckSession:
+    """A session whose followers never arrive, so a query of them runs until it's cancelled."""
+
+    async def get_followers(self, *_args: object, **_kwargs: object) -> dict:
+        await asyncio.Event().wait()
+
+
+def _run(monkeypatch, current: object, *messages: _Message) -> list[dict]:  # noqa: ANN001 pytest's fixture
+    """Handle the messages with `current` as the session, returning what's sent back once every request ends."""
+    sent = []
+    monkeypatch.setitem(globals(), "post", lambda message, _transfer=None: sent.append(message))
+    monkeypatch.setitem(globals(), "session", current)
+
+    async def run() -> None:
+        for message in messages:
+            handle(message)
+            await asyncio.sleep(0)
+        while running:
+            await asyncio.gather(*running.values())
+
+    asyncio.run(run())
+    return sent
+
+
+def test_query(monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that a query's rows are sent a page at a time, followed by a done that counts them."""
+    import temp_tables  # noqa: PLC0415 Only the test needs a table to query without the network
+    from temp_tables import TempTable  # noqa: PLC0415
+
+    table = TempTable("people")
+    table.append([{"handle": f"user{i}.test"} for i in range(3)])
+    temp_tables.add(table)
+    try:
+        sent = _run(monkeypatch, _StuckSession(), _Message(type="query", id=1, query="SELECT handle FROM people"))
+    finally:
+        temp_tables.drop("people")
+    page, done = sent
+    assert (page["type"], page["id"], page["head"]) == ("page", 1, ["handle"])
+    assert page["rows"] == [{"handle": "user0.test"}, {"handle": "user1.test"}, {"handle": "user2.test"}]
+    assert (done["type"], done["id"], done["table"], done["rows"]) == ("done", 1, "people", 3)
+
+
+def test_errors(monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that a request without a session, a bad query and a cancelled one each end with one error."""
+    sent = _run(monkeypatch, None, _Message(type="login", id=1))
+    assert sent == [{"type": "error", "error": "QueryError", "message": "Log in or pick stealth mode first", "id": 1}]
+
+    sent = _run(
+        monkeypatch,
+        _StuckSession(),
+        _Message(type="query", id=2, query="SELECT * FROM nowhere"),
+        _Message(type="query", id=3, query="SELECT handle FROM followers WHERE actor = 'a'"),
+        _Message(type="cancel", id=3),
+    )
+    assert [(message["id"], message["type"], message["error"]) for message in sent] == [
+        (2, "error", "QueryError"),
+        (3, "error", "cancelled"),
+    ]
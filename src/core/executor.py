@@ -0,0 +1,1798 @@
+"""Turn parsed queries into plans and run them against a BskySession."""
+
+import asyncio
+import heapq
+import math
+import operator
+import re
+import time
+from collections import Counter
+from collections.abc import AsyncIterator, Callable
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from functools import cache
+from typing import Any
+
+import feed_cache
+import temp_tables
+import text_index
+from feed_cache import FeedCache
+from jetstream import BUFFER_EVENTS, Subscription
+from parser import Parent, ParentKind, Token, TokenKind, Tree, parse, tokenize
+from temp_tables import TEMP_TABLE_BYTES, TempTable
+from text_index import TextIndex, words
+from tracing import TRACER
+from transport import CALL_STATS
+
+DEFAULT_LIMIT = 50  # Rows returned when the query has no LIMIT clause
+PAGE_SIZE = 100  # The largest `limit` the list endpoints accept
+MAX_SCAN_PAGES = 50  # Upper bound on pages fetched for a single query
+WATCH_MIN_SECONDS = 5  # Shortest wait WATCH allows between the refreshes of a source
+
+# WHERE names that pick the endpoint's argument instead of filtering rows
+PARAMETERS = ("actor", "author", "feed")
+
+COMPARISONS: dict[str, Callable[[Any, Any], bool]] = {
+    "=": operator.eq,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+
+class QueryError(Exception):
+    """A query that can't be planned or executed."""
+
+
+class StealthModeError(QueryError):
+    """A query that needs a logged in session."""
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    """The BskySession method that backs a table."""
+
+    nsid: str
+    method: str
+    key: str | None = None  # Key holding the list of rows, None if the response is a single row
+    param: str | None = None  # Keyword the WHERE value is passed to the method as
+    paginated: bool = True
+    wrap: str | None = None  # Key each row is nested under, so search results look like feed rows
+
+
+AUTHOR_FEED = Endpoint("app.bsky.feed.getAuthorFeed", "get_author_feed", "feed", "actor")
+PROFILE = Endpoint("app.bsky.actor.getProfiles", "get_profile", param="actor", paginated=False)
+ACTOR_LIKES = Endpoint("app.bsky.feed.getActorLikes", "get_actor_likes", "feed", "actor")
+FOLLOWERS = Endpoint("app.bsky.graph.getFollowers", "get_followers", "followers", "actor")
+FOLLOWS = Endpoint("app.bsky.graph.getFollows", "get_follows", "follows", "actor")
+KNOWN_FOLLOWERS = Endpoint("app.bsky.graph.getKnownFollowers", "get_mutual_follows", "followers", "actor")
+SEARCH_POSTS = Endpoint("app.bsky.feed.searchPosts", "search_posts", "posts", wrap="post")
+SEARCH_ACTORS = Endpoint("app.bsky.actor.searchActors", "search_actors", "actors")
+
+# table -> WHERE name -> endpoint, the `None` entry is used when no WHERE name matches
+TABLES: dict[str, dict[str | None, Endpoint]] = {
+    "feed": {
+        "actor": AUTHOR_FEED,
+        "author": AUTHOR_FEED,
+        "feed": Endpoint("app.bsky.feed.getFeed", "get_feed", "feed", "feed"),
+    },
+    "timeline": {None: Endpoint("app.bsky.feed.getTimeline", "get_timeline", "feed")},
+    "profile": {
+        "actor": PROFILE,
+        "author": PROFILE,
+        None: Endpoint("app.bsky.actor.getProfiles", "get_profile", paginated=False),
+    },
+    "suggestions": {None: Endpoint("app.bsky.actor.getSuggestions", "get_suggestions", "actors")},
+    "suggested_feed": {None: Endpoint("app.bsky.feed.getSuggestedFeeds", "get_suggested_feeds", "feeds")},
+    "likes": {"actor": ACTOR_LIKES, "author": ACTOR_LIKES},
+    "followers": {"actor": FOLLOWERS, "author": FOLLOWERS},
+    "following": {"actor": FOLLOWS, "author": FOLLOWS},
+    "mutuals": {"actor": KNOWN_FOLLOWERS, "author": KNOWN_FOLLOWERS},
+    "posts": {None: SEARCH_POSTS},
+    "actors": {None: SEARCH_ACTORS},
+    "tables": {},
+    "stream": {},
+}
+
+# search table -> (WHERE name, operator) -> the search parameter it's sent as, so the server does the filtering
+PUSHDOWN: dict[str, dict[tuple[str, str], str]] = {
+    "posts": {
+        ("text", "LIKE"): "q",
+        ("text", "MATCH"): "q",
+        ("author", "="): "author",
+        ("tag", "="): "tag",
+        ("mentions", "="): "mentions",
+        ("created_at", ">"): "since",
+        ("created_at", "<"): "until",
+    },
+    "actors": {("text", "LIKE"): "q", ("text", "MATCH"): "q"},
+}
+# pushed down names the search only narrows, with the column each is checked against again after fetching
+RECHECKS: dict[str, dict[str, str]] = {
+    "posts": {"text": "post_record_text", "created_at": "post_record_createdat"},
+}
+# search tables the server won't answer without a `q`
+NEEDS_QUERY = ("actors",)
+
+# tables that can be joined or queried with IN by fetching the rows for each key, rather than scanned
+LOOKUPS = {"profile": Endpoint("app.bsky.actor.getProfiles", "hydrate_profiles", "profiles", "actors")}
+LOOKUP_KEYS = ("did", "handle")
+
+# the table of live Jetstream events, and its WHERE names -> the subscription filters they're sent as
+STREAM_TABLE = "stream"
+STREAM_FILTERS = {"collection": "wantedCollections", "did": "wantedDids"}
+
+
+# syntax tree helpers
+def clean_value(text: str) -> str:
+    """Remove surrounding single/double quotes if present."""
+    if isinstance(text, str) and (text[0] == text[-1]) and text[0] in ("'", '"'):
+        return text[1:-1]
+    return text
+
+
+def get_text(node: Tree) -> str:
+    """Recursively get the string value from a node (Parent or Token)."""
+    if hasattr(node, "text"):
+        return node.text
+    if hasattr(node, "children"):
+        return " ".join(get_text(child) for child in node.children)
+    return str(node)
+
+
+def walk_where(node: Tree) -> list[tuple | str]:
+    """Flatten sql expressions into [tuple, 'AND', tuple, ...].
+
+    Raises QueryError for an IN without a list in parentheses, a list with anything but IN or on the left,
+    or a function call, which WHERE can't compare.
+    """
+    if getattr(node, "kind", None).name == "EXPR_BINARY":
+        left, op, right = node.children
+        op_text = getattr(op, "text", None)
+
+        if op_text in ("AND", "OR"):
+            return [*walk_where(left), op_text, *walk_where(right)]
+
+        if left.kind is ParentKind.EXPR_LIST:
+            msg = "A list in parentheses goes on the right of IN, like handle IN ('a', 'b')"
+            raise QueryError(msg)
+        for call in [*find_calls(left), *find_calls(right)]:
+            if call.children[0].text.upper() in AGGREGATES:
+                # WHERE picks the rows before they're grouped, so there's nothing to aggregate yet
+                msg = (
+                    f"{expr_name(call)} can't go in WHERE, filtering on an aggregate needs HAVING, "
+                    "which isn't supported yet"
+                )
+            else:
+                msg = f"{expr_name(call)} can't go in WHERE, compare a column to a value"
+            raise QueryError(msg)
+        listed = right.kind is ParentKind.EXPR_LIST
+        if listed != (op_text == "IN"):
+            start = "IN needs a list in parentheses" if op_text == "IN" else "A list in parentheses needs IN"
+            msg = f"{start}, like {clean_value(get_text(left))} IN ('a', 'b')"
+            raise QueryError(msg)
+        if listed:
+            values = [clean_value(get_text(c)) for c in right.children if isinstance(c, Parent)]
+            return [(clean_value(get_text(left)), op_text, values)]
+        return [(clean_value(get_text(left)), op_text, clean_value(get_text(right)))]
+
+    if hasattr(node, "children"):
+        result = []
+        for child in node.children:
+            result.extend(walk_where(child))
+        return result
+
+    return []
+
+
+def syntax_errors(tree: Tree) -> list[str]:
+    """Collect the parser's errors from every node of a query, as `- error` lines."""
+    errors = [f"- {error}" for error in tree.errors]
+    if isinstance(tree, Parent):
+        for child in tree.children:
+            errors.extend(syntax_errors(child))
+    if tree.kind is ParentKind.ERROR_TREE:
+        errors.append("- large error")
+    return errors
+
+
+def get_statement(tree: Tree) -> Parent:
+    """Get the SELECT statement of a query, looking through any EXPLAIN or CREATE TEMP TABLE."""
+    if tree.kind != ParentKind.FILE:
+        raise ValueError
+    if not tree.children:
+        msg = "Empty query"
+        raise QueryError(msg)
+
+    stmt = tree.children[0]
+    if stmt.kind in (ParentKind.EXPLAIN_STMT, ParentKind.CREATE_STMT):
+        return stmt.children[-1]
+    return stmt
+
+
+def get_created(tree: Tree) -> str | None:
+    """Get the name of the table a CREATE TEMP TABLE makes, if the query is one."""
+    stmt = tree.children[0] if tree.children else None
+    if stmt is None or stmt.kind is not ParentKind.CREATE_STMT:
+        return None
+    return stmt.children[3].text
+
+
+def get_dropped(tree: Tree) -> str | None:
+    """Get the name of the table a DROP TABLE drops, if the query is one."""
+    stmt = tree.children[0] if tree.children else None
+    if stmt is None or stmt.kind is not ParentKind.DROP_STMT:
+        return None
+    return stmt.children[2].text
+
+
+def get_explain(tree: Tree) -> str | None:
+    """Get whether the query is an EXPLAIN or EXPLAIN ANALYZE."""
+    stmt = tree.children[0] if tree.children else None
+    if stmt is None or stmt.kind is not ParentKind.EXPLAIN_STMT:
+        return None
+    return " ".join(c.text for c in stmt.children if isinstance(c, Token))
+
+
+def get_refresh(node: Tree) -> bool:
+    """Get whether the query asks to REFRESH the posts it read last time rather than read them again."""
+    return any(it.kind is TokenKind.REFRESH for it in get_statement(node).children)
+
+
+def get_watch(node: Tree) -> int | None:
+    """Get the seconds between refreshes in the WATCH clause, if the query has one."""
+    for it in get_statement(node).children:
+        if it.kind is ParentKind.WATCH_CLAUSE:
+            return int(it.children[1].text)
+
+    return None
+
+
+def get_limit(node: Tree) -> int | None:
+    """Get what the LIMIT clause of this SQL query contains."""
+    for it in get_statement(node).children:
+        if it.kind is ParentKind.LIMIT_CLAUSE:
+            return int(it.children[1].text)
+
+    return None
+
+
+def get_outfile(node: Tree) -> str | None:
+    """Get the file name of the INTO OUTFILE clause, if the query has one."""
+    for it in get_statement(node).children:
+        if it.kind is ParentKind.INTO_CLAUSE:
+            return clean_value(it.children[2].text)
+
+    return None
+
+
+def extract_where(tree: Tree) -> list[tuple | str]:
+    """Extract the where clause from the tree."""
+    for c in get_statement(tree).children:
+        if c.kind == ParentKind.WHERE_CLAUSE:
+            return walk_where(c.children[1])
+    return []
+
+
+def extract_fields(tree: Tree) -> list[Tree]:
+    """Extract the fields from the tree."""
+    for c in get_statement(tree).children:
+        if c.kind == ParentKind.FIELD_LIST:
+            return c.children[::2]
+    return []
+
+
+def get_fields(tree: Tree) -> list[str]:
+    """Get the names of the columns a query selects, none for SELECT *."""
+    return [expr_name(i) for i in extract_fields(tree) if i.kind != TokenKind.STAR]
+
+
+def expr_name(node: Tree) -> str:
+    """Get the column an expression reads or produces, like `handle` or `COUNT(*)`."""
+    if node.kind is ParentKind.EXPR_CALL:
+        return f"{node.children[0].text.upper()}({expr_name(node.children[2])})"
+    return get_text(node)
+
+
+def find_calls(node: Tree) -> list[Parent]:
+    """Find every function call in an expression."""
+    if node.kind is ParentKind.EXPR_CALL:
+        return [node]
+    if isinstance(node, Parent):
+        return [call for child in node.children for call in find_calls(child)]
+    return []
+
+
+def extract_group(tree: Tree) -> list[str]:
+    """Extract the GROUP BY columns from the tree."""
+    for c in get_statement(tree).children:
+        if c.kind == ParentKind.GROUP_CLAUSE:
+            return [expr_name(child) for child in c.children[2::2]]
+    return []
+
+
+def extract_order(tree: Tree) -> tuple[str, bool] | None:
+    """Extract the ORDER BY column and whether it is descending from the tree."""
+    for c in get_statement(tree).children:
+        if c.kind == ParentKind.ORDER_CLAUSE:
+            return expr_name(c.children[2]), c.children[-1].kind is TokenKind.DESC
+    return None
+
+
+def extract_join(tree: Tree) -> tuple[str, Tree] | None:
+    """Extract the joined table and the ON condition from the tree."""
+    for c in get_statement(tree).children:
+        if c.kind == ParentKind.JOIN_CLAUSE:
+            return c.children[1].text, c.children[3]
+    return None
+
+
+def extract_table(tree: Tree) -> str:
+    """Extract the Table from the tree."""
+    for c in get_statement(tree).children:
+        if c.kind == ParentKind.FROM_CLAUSE:
+            for child in c.children:
+                if child.kind == TokenKind.IDENTIFIER:
+                    return child.text
+            break
+    return ""
+
+
+# row helpers
+def flatten_response(data: dict) -> dict:
+    """Flatten a dictionary."""
+    flattened_result = {}
+
+    def _flatten(current: dict, name: str = "") -> dict:
+        if isinstance(current, dict):
+            for field_name, value in current.items():
+                _flatten(value, name + field_name + "_")
+        elif isinstance(current, list):
+            """old code
+            # for idx, i in enumerate(current):
+            #     _flatten(i, name + str(idx) + "_")
+            """
+        else:
+            flattened_result[name[:-1].lower()] = current  # Drops the extra _
+
+    _flatten(data)
+    return flattened_result
+
+
+def extract_images_from_post(data: dict) -> str:
+    """Extract any embedded images from a post and return them as a delimited string."""
+    if not isinstance(data, dict):
+        return ""
+
+    if "post" not in data:
+        return ""
+
+    post = data["post"]
+
+    # Check if the post has embedded content
+    if "embed" not in post:
+        return ""
+
+    embed_type = post["embed"].get("$type", "")
+
+    # Only process image embeds
+    if embed_type != "app.bsky.embed.images#view":
+        return ""
+
+    images = post["embed"].get("images", [])
+    if not images:
+        return ""
+
+    image_links = []
+    for image in images:
+        image_link = f"{image['thumb']},{image['fullsize']},{image['alt']}"
+        image_links.append(image_link)
+
+    return " | ".join(image_links)
+
+
+@cache
+def like_pattern(literal: str) -> re.Pattern:
+    """Compile a LIKE pattern, where `%` is any run of characters and `_` any one, ignoring case."""
+    pattern = "".join({"%": ".*", "_": "."}.get(char) or re.escape(char) for char in literal)
+    return re.compile(pattern, re.IGNORECASE | re.DOTALL)
+
+
+def compare(value: Any, op: str, literal: str | list[str]) -> bool:  # noqa: ANN401
+    """Compare a row value against a query literal, numerically when both sides are numbers.
+
+    LIKE and MATCH always compare text, MATCH checking that every word of the literal is in the value.
+    """
+    if op == "IN":
+        return any(compare(value, "=", item) for item in literal)
+    if op == "LIKE":
+        return like_pattern(literal).fullmatch(str(value)) is not None
+    if op == "MATCH":
+        return set(words(literal)) <= set(words(str(value)))
+    try:
+        return COMPARISONS[op](float(value), float(literal))
+    except (TypeError, ValueError):
+        return COMPARISONS[op](str(value), literal)
+
+
+def sort_key(value: Any) -> tuple:  # noqa: ANN401
+    """Order values of any type: missing values first, then numbers, then text."""
+    if value is None or value == "":
+        return (0, 0)
+    if isinstance(value, int | float):
+        return (1, value)
+    return (2, str(value))
+
+
+@dataclass(frozen=True)
+class Reverse:
+    """Invert the ordering of a sort key, so heapq keeps the largest key at the root."""
+
+    key: tuple
+
+    def __lt__(self, other: "Reverse") -> bool:
+        return other.key < self.key
+
+
+def to_number(value: Any) -> float | None:  # noqa: ANN401
+    """Read a row value as a number, or None if it isn't one."""
+    if isinstance(value, int | float):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# aggregate functions, each holds the running state for one group
+@dataclass
+class Count:
+    """COUNT(*) counts rows, COUNT(col) counts rows where the column has a value."""
+
+    count: int = 0
+
+    def add(self, value: Any) -> None:  # noqa: ANN401
+        """Count a value."""
+        if value is not None and value != "":
+            self.count += 1
+
+    def result(self) -> int:
+        """Get the count."""
+        return self.count
+
+
+@dataclass
+class Sum:
+    """SUM(col) adds up the numeric values of a column."""
+
+    total: float | None = None
+
+    def add(self, value: Any) -> None:  # noqa: ANN401
+        """Add a value to the total."""
+        number = to_number(value)
+        if number is not None:
+            self.total = number if self.total is None else self.total + number
+
+    def result(self) -> float | None:
+        """Get the total."""
+        return self.total
+
+
+@dataclass
+class Average:
+    """AVG(col) averages the numeric values of a column."""
+
+    total: float = 0
+    count: int = 0
+
+    def add(self, value: Any) -> None:  # noqa: ANN401
+        """Add a value to the average."""
+        number = to_number(value)
+        if number is not None:
+            self.total += number
+            self.count += 1
+
+    def result(self) -> float | None:
+        """Get the average."""
+        return self.total / self.count if self.count else None
+
+
+@dataclass
+class Minimum:
+    """MIN(col) keeps the smallest value of a column, using the same ordering as ORDER BY."""
+
+    best: Any = None
+
+    def add(self, value: Any) -> None:  # noqa: ANN401
+        """Keep a value if it's the best so far."""
+        if value is not None and value != "" and (self.best is None or self.better(value)):
+            self.best = value
+
+    def better(self, value: Any) -> bool:  # noqa: ANN401
+        """Check whether a value beats the current best."""
+        return sort_key(value) < sort_key(self.best)
+
+    def result(self) -> Any:  # noqa: ANN401
+        """Get the best value."""
+        return self.best
+
+
+@dataclass
+class Maximum(Minimum):
+    """MAX(col) keeps the largest value of a column, using the same ordering as ORDER BY."""
+
+    def better(self, value: Any) -> bool:  # noqa: ANN401
+        """Check whether a value beats the current best."""
+        return sort_key(value) > sort_key(self.best)
+
+
+AGGREGATES = {"COUNT": Count, "SUM": Sum, "AVG": Average, "MIN": Minimum, "MAX": Maximum}
+
+
+# operators
+@dataclass
+class Operator:
+    """A local step of a query plan, pushed batches of rows as pages arrive."""
+
+    name: str
+    detail: str = ""
+    elapsed: float = 0.0
+    rows_in: int = 0
+    rows_out: int = 0
+
+    def push(self, rows: list[dict]) -> list[dict]:
+        """Run a batch of rows through the operator, counting rows and time."""
+        start = time.perf_counter()
+        result = self.process(rows)
+        end = time.perf_counter()
+        self.elapsed += end - start
+        self.rows_in += len(rows)
+        self.rows_out += len(result)
+        TRACER.add(self.name.lower(), "operator", start, end, rows=len(rows))
+        return result
+
+    def finish(self) -> list[dict]:
+        """Flush the operator once the input is exhausted, counting rows and time."""
+        start = time.perf_counter()
+        result = self.flush()
+        end = time.perf_counter()
+        self.elapsed += end - start
+        self.rows_out += len(result)
+        if result:
+            TRACER.add(self.name.lower(), "operator", start, end, rows=len(result))
+        return result
+
+    def flush(self) -> list[dict]:
+        """Emit any rows held back until the input is exhausted."""
+        return []
+
+    def process(self, rows: list[dict]) -> list[dict]:
+        """Transform a batch of rows."""
+        return rows
+
+    @property
+    def done(self) -> bool:
+        """Whether the operator will not take any more rows."""
+        return False
+
+
+@dataclass
+class Flatten(Operator):
+    """Flatten the nested API objects into single level rows."""
+
+    name: str = "Flatten"
+
+    def process(self, rows: list[dict]) -> list[dict]:
+        """Flatten each row, pulling out embedded images first."""
+        return flatten_rows(rows)
+
+
+def flatten_rows(rows: list[dict]) -> list[dict]:
+    """Flatten a page of API objects, pulling out embedded images first."""
+    result = []
+    for data in rows:
+        # Only try to extract images if the data structure supports it
+        images = extract_images_from_post(data)
+        if images and "post" in data:
+            data["post"]["images"] = images
+        result.append(flatten_response(data))
+    return result
+
+
+@dataclass
+class Filter(Operator):
+    """Drop rows that don't match the WHERE predicates."""
+
+    name: str = "Filter"
+    predicates: list[tuple[str, str, str]] = field(default_factory=list)
+
+    def process(self, rows: list[dict]) -> list[dict]:
+        """Keep the rows matching every predicate."""
+        return [
+            row
+            for row in rows
+            if all(col.lower() in row and compare(row[col.lower()], op, lit) for col, op, lit in self.predicates)
+        ]
+
+
+@dataclass
+class IndexPages(Operator):
+    """Add the flattened rows to a text index as they stream past, for later MATCH filters to reuse."""
+
+    name: str = "Index"
+    index: TextIndex | None = None
+
+    def process(self, rows: list[dict]) -> list[dict]:
+        """Index the rows and pass them on."""
+        self.index.add(rows)
+        return rows
+
+
+@dataclass
+class Materialize(Operator):
+    """Store the result rows in a new temp table column by column, emitting a row describing it at the end."""
+
+    name: str = "Materialize"
+    table: TempTable | None = None
+
+    def process(self, rows: list[dict]) -> list[dict]:
+        """Add the rows to the table, keeping every temp table within the memory budget."""
+        self.table.append(rows)
+        if temp_tables.used() + self.table.bytes > TEMP_TABLE_BYTES:
+            msg = f"Temp tables would take more than {TEMP_TABLE_BYTES // 2**20} MB, DROP TABLE one first"
+            raise QueryError(msg)
+        return []
+
+    def flush(self) -> list[dict]:
+        """Make the table available to later queries."""
+        if temp_tables.get(self.table.name) is not None:
+            msg = f"Temp table '{self.table.name}' was made by another query meanwhile"
+            raise QueryError(msg)
+        temp_tables.add(self.table)
+        return [self.table.describe()]
+
+
+@dataclass
+class Limit(Operator):
+    """Stop once enough rows have been produced."""
+
+    name: str = "Limit"
+    remaining: int = DEFAULT_LIMIT
+
+    def process(self, rows: list[dict]) -> list[dict]:
+        """Pass rows through until the limit is used up."""
+        result = rows[: self.remaining]
+        self.remaining -= len(result)
+        return result
+
+    @property
+    def done(self) -> bool:
+        """Whether the limit is used up."""
+        return self.remaining <= 0
+
+
+@dataclass
+class HashAggregate(Operator):
+    """Fold rows into one set of aggregate states per group as pages stream past.
+
+    Memory grows with the number of groups rather than the number of rows scanned.
+    """
+
+    name: str = "HashAggregate"
+    group_by: list[str] = field(default_factory=list)
+    aggregates: list[tuple[str, str | None, str]] = field(default_factory=list)  # (function, column, output)
+    groups: dict[tuple, list] = field(default_factory=dict)
+
+    def process(self, rows: list[dict]) -> list[dict]:
+        """Add each row to the states of its group."""
+        for row in rows:
+            key = tuple(row.get(column) for column in self.group_by)
+            states = self.groups.get(key)
+            if states is None:
+                states = self.groups[key] = self._new_states()
+            for state, (_, column, _) in zip(states, self.aggregates, strict=True):
+                # COUNT(*) has no column and counts every row
+                state.add(row.get(column) if column else True)
+        return []
+
+    def flush(self) -> list[dict]:
+        """Emit one row per group."""
+        if not self.groups and not self.group_by:
+            # aggregates without GROUP BY always produce a row, even for no input
+            self.groups[()] = self._new_states()
+
+        result = []
+        for key, states in self.groups.items():
+            row = dict(zip(self.group_by, key, strict=True))
+            row |= {name: state.result() for state, (*_, name) in zip(states, self.aggregates, strict=True)}
+            result.append(row)
+        self.groups = {}
+        return result
+
+    def _new_states(self) -> list:
+        return [AGGREGATES[function]() for function, *_ in self.aggregates]
+
+
+@dataclass
+class TopK(Operator):
+    """Keep the first `k` rows by a column in a bounded heap, emitting them sorted at the end.
+
+    This takes O(n log k) time and O(k) memory rather than sorting every row that is scanned.
+    """
+
+    name: str = "TopK"
+    column: str = ""
+    descending: bool = False
+    k: int = DEFAULT_LIMIT
+    heap: list[tuple] = field(default_factory=list)
+    seen: int = 0
+
+    def process(self, rows: list[dict]) -> list[dict]:
+        """Offer each row to the heap, evicting the worst kept row once it is full."""
+        if self.k <= 0:
+            return []
+
+        for row in rows:
+            key = sort_key(row.get(self.column.lower()))
+            # the root is the worst kept row; on ties the later row is worse, so results stay stable
+            entry = (key if self.descending else Reverse(key), -self.seen, row)
+            self.seen += 1
+            if len(self.heap) < self.k:
+                heapq.heappush(self.heap, entry)
+            else:
+                heapq.heappushpop(self.heap, entry)
+        return []
+
+    def flush(self) -> list[dict]:
+        """Emit the kept rows, best first."""
+        result = [row for *_, row in sorted(self.heap, reverse=True)]
+        self.heap = []
+        return result
+
+    @property
+    def done(self) -> bool:
+        """Whether no row can be kept at all, for a LIMIT 0."""
+        return self.k <= 0
+
+
+@dataclass
+class Project(Operator):
+    """Pick the selected fields out of each row."""
+
+    name: str = "Project"
+    fields: list[str] = field(default_factory=list)
+
+    def process(self, rows: list[dict]) -> list[dict]:
+        """Select the fields, or pass rows through for `*`."""
+        if not self.fields:
+            return rows
+        return [{f: row.get(f.lower(), "") for f in self.fields} for row in rows]
+
+
+@dataclass
+class Scan(Operator):
+    """Fetch pages from the endpoint backing a table."""
+
+    name: str = "Fetch"
+    table: str = ""
+    endpoint: Endpoint | None = None
+    value: str | None = None
+    arguments: dict[str, str] = field(default_factory=dict)  # Search parameters pushed down from the WHERE
+    index: TextIndex | None = None  # Index whose cursor and page count follow this scan, Index adds the rows
+    cursor: str | None = ""  # Where to read from, moved past each page as it's fetched and None after the last
+    pages: int = 1
+    page_size: int = PAGE_SIZE
+    rows_wanted: int | None = None  # Rows needed to satisfy the query, None to scan every page
+    http_calls: int = 0
+    bytes: int = 0
+    cache_hits: int = 0
+
+    async def fetch(self, session: Any) -> AsyncIterator[list[dict]]:  # noqa: ANN401
+        """Yield the pages of raw rows, following the cursor."""
+        if self.endpoint is None:
+            rows = [{"Table_Name": table} for table in TABLES if table != "tables"]
+            rows.extend(table.describe() for table in temp_tables.tables())
+            self.rows_out += len(rows)
+            yield rows
+            return
+
+        args = (self.value,) if self.endpoint.param else ()
+        cursor = self.cursor
+        if self.index is not None:
+            self.index.busy = True
+        try:
+            for _ in range(self.pages):
+                kwargs = dict(self.arguments)
+                if self.endpoint.paginated:
+                    kwargs |= {"limit": self._next_page_size(), "cursor": cursor}
+
+                response = await self.call(session, *args, **kwargs)
+                rows = response.get(self.endpoint.key, []) if self.endpoint.key else [response]
+                if self.endpoint.wrap:
+                    rows = [{self.endpoint.wrap: row} for row in rows]
+                self.rows_out += len(rows)
+                cursor = response.get("cursor")
+                # a search can come back empty from the stretch it looked through and still have a cursor
+                end = not cursor or not self.endpoint.paginated or (not rows and not self.arguments)
+                # moved on before the page is handed over, the query may stop as soon as it has it
+                self.cursor = None if end else cursor
+                if self.index is not None:
+                    self.index.pages += 1
+                    self.index.cursor = self.cursor
+                yield rows
+
+                if end:
+                    break
+        finally:
+            if self.index is not None:
+                self.index.busy = False
+
+    async def call(self, session: Any, *args: Any, **kwargs: Any) -> dict:  # noqa: ANN401
+        """Call the endpoint, adding its time, HTTP calls, bytes and cache hits to the counters.
+
+        The client counts them for this call alone, rather than the session's totals being compared before and
+        after, which other queries running meanwhile would add to.
+        """
+        stats = Counter()
+        token = CALL_STATS.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await getattr(session, self.endpoint.method)(*args, **kwargs)
+        finally:
+            self.elapsed += time.perf_counter() - start
+            CALL_STATS.reset(token)
+            self.http_calls += stats["http_calls"]
+            self.bytes += stats["bytes"]
+            self.cache_hits += stats["cache_hits"]
+
+        if isinstance(response, dict) and response.get("stealth_error"):
+            msg = (
+                "Cannot get own profile in stealth mode. "
+                "Try: SELECT * FROM profile WHERE actor = 'username.bsky.social'"
+            )
+            raise StealthModeError(msg)
+        return response
+
+    def _next_page_size(self) -> int:
+        if self.rows_wanted is None:
+            return self.page_size
+        return max(1, min(self.page_size, self.rows_wanted - self.rows_out))
+
+    def describe(self) -> str:
+        """Describe the endpoint and pages this scan will use."""
+        if self.endpoint is None:
+            return f"built-in list of {len(TABLES) - 1} tables and {len(temp_tables.tables())} temp table(s)"
+        arg = f" {self.endpoint.param}={self.value}" if self.endpoint.param else ""
+        arg += "".join(f" {name}={value!r}" for name, value in self.arguments.items())
+        if not self.endpoint.paginated:
+            return f"{self.endpoint.nsid}{arg}, 1 request"
+        return f"{self.endpoint.nsid}{arg}, up to {self.pages} page(s) of {self.page_size}"
+
+
+@dataclass
+class Lookup(Scan):
+    """Fetch the rows for a list of keys, through the session's profile hydrator.
+
+    The hydrator packs the keys into as few calls as the endpoint allows, and answers repeats from its
+    cache, so a lookup can be handed every key at once.
+    """
+
+    name: str = "Lookup"
+    keys: list[str] = field(default_factory=list)  # Keys to fetch when scanning the table with IN
+
+    async def fetch(self, session: Any) -> AsyncIterator[list[dict]]:  # noqa: ANN401
+        """Yield the rows for the IN list as a single page."""
+        yield await self.fetch_keys(session, self.keys)
+
+    async def fetch_keys(self, session: Any, keys: list[str]) -> list[dict]:  # noqa: ANN401
+        """Fetch the rows for the keys, leaving out keys that don't exist."""
+        response = await self.call(session, keys)
+        rows = response.get(self.endpoint.key, [])
+        self.rows_in += len(keys)
+        self.rows_out += len(rows)
+        return rows
+
+    def describe(self) -> str:
+        """Describe the endpoint and batching this lookup will use."""
+        keys = f" {self.endpoint.param} IN {self.keys}" if self.keys else ""
+        return f"{self.endpoint.nsid}{keys}, batched and cached by the profile hydrator"
+
+
+@dataclass
+class TempScan(Scan):
+    """Read the rows of a temp table, already flattened, from memory."""
+
+    name: str = "TempScan"
+    temp: TempTable | None = None
+
+    async def fetch(self, _: Any) -> AsyncIterator[list[dict]]:  # noqa: ANN401
+        """Yield the table's rows a page at a time."""
+        for page in self.temp.pages():
+            self.rows_out += len(page)
+            yield page
+
+    def describe(self) -> str:
+        """Describe the table being read."""
+        return f"temp table {self.table}, {self.temp.rows} rows in memory"
+
+
+@dataclass
+class DropTable(Scan):
+    """Drop a temp table, giving back a row describing what it held."""
+
+    name: str = "Drop"
+
+    async def fetch(self, _: Any) -> AsyncIterator[list[dict]]:  # noqa: ANN401
+        """Drop the table and yield its description."""
+        dropped = temp_tables.drop(self.table)
+        if dropped is None:
+            msg = f"No temp table '{self.table}' to drop"
+            raise QueryError(msg)
+        self.rows_out += 1
+        yield [dropped.describe()]
+
+    def describe(self) -> str:
+        """Describe the table being dropped."""
+        return f"temp table {self.table}, freeing its memory"
+
+
+@dataclass
+class RefreshScan(Scan):
+    """Read a source of posts through its feed cache, fetching only the posts newer than the cached ones.
+
+    Pages from the top are fetched until one holds a cached post, and the cached posts follow them. If the
+    query wants more than that, the scan carries on from the cache's cursor, adding the pages to the cache.
+    """
+
+    name: str = "RefreshScan"
+    cache: FeedCache | None = None
+    key: feed_cache.Key | None = None  # The source the cache belongs to
+    new: int = 0  # Posts this refresh found that weren't cached
+    pending: list[dict] | None = None  # New posts the watch scheduler already fetched, the only rows to yield
+
+    async def fetch(self, session: Any) -> AsyncIterator[list[dict]]:  # noqa: ANN401
+        """Yield the new posts and the cached ones after them, then any older pages still wanted."""
+        if self.pending is not None:
+            self.new = self.rows_out = len(self.pending)
+            yield self.pending
+            return
+
+        first = not self.cache.rows
+        if not first:
+            await self.refresh(session)
+            rows, self.rows_out = list(self.cache.rows), 0
+            for start in range(0, len(rows), self.page_size):
+                self.rows_out += len(rows[start : start + self.page_size])
+                yield rows[start : start + self.page_size]
+
+        if self.cache.cursor is None or self.pages <= 0:
+            return
+        self.cursor = self.cache.cursor
+        async with aclosing(super().fetch(session)) as pages:
+            async for page in pages:
+                self.cache.extend(page, self.cursor)
+                if first:
+                    self.new += len(page)
+                yield page
+
+    async def refresh(self, session: Any) -> list[dict]:  # noqa: ANN401
+        """Fetch from the top until a page holds a cached post, merging the pages in and returning the new posts.
+
+        The pages read are taken off `pages`, leaving what's left for the older pages.
+        """
+        fetched, used = [], 0
+        async with aclosing(super().fetch(session)) as pages:
+            async for page in pages:
+                fetched.extend(page)
+                used += 1
+                if self.cache.knows(page):
+                    break
+        self.pages -= used
+        with TRACER.span("refresh merge", "operator") as args:
+            if self.cache.knows(fetched):
+                new = self.cache.merge(fetched)
+            else:
+                # more is new than the pages read from the top, so they start the cache again
+                self.cache.replace(fetched, self.cursor)
+                new = fetched
+            self.new = len(new)
+            args.update(new=self.new, cached=len(self.cache.rows))
+        return new
+
+    def describe(self) -> str:
+        """Describe the source and how much of it is cached."""
+        if not self.cache.rows:
+            return f"{super().describe()}, caching the posts for the next REFRESH"
+        return f"{super().describe()}, stopping at the first of {len(self.cache.rows)} cached posts"
+
+
+@dataclass
+class IndexScan(Scan):
+    """Read the rows holding every MATCH word from the text index of an earlier scan of the same source.
+
+    If that scan stopped before the last page, this carries on fetching from its cursor, flattening and
+    indexing the new pages, until it has read as many pages as a fresh scan would.
+    """
+
+    name: str = "IndexScan"
+    terms: list[str] = field(default_factory=list)
+
+    async def fetch(self, session: Any) -> AsyncIterator[list[dict]]:  # noqa: ANN401
+        """Yield the indexed rows that match, then the pages the index doesn't have yet."""
+        start = time.perf_counter()
+        rows = self.index.search(self.terms)
+        end = time.perf_counter()
+        self.elapsed += end - start
+        self.rows_in += len(self.index.rows)
+        self.rows_out += len(rows)
+        TRACER.add("index search", "operator", start, end, rows=len(rows))
+        yield rows
+
+        if self.index.complete:
+            return
+        self.cursor = self.index.cursor
+        self.pages -= self.index.pages
+        async with aclosing(super().fetch(session)) as pages:
+            async for page in pages:
+                rows = flatten_rows(page)
+                self.index.add(rows)
+                yield rows
+
+    def describe(self) -> str:
+        """Describe the index and what's left to fetch."""
+        detail = f"{len(self.index.rows)} indexed rows of {self.table}, words of {self.index.column}"
+        if self.index.complete:
+            return detail
+        left = max(0, self.pages - self.index.pages)
+        return f"{detail}, then up to {left} more page(s) of {self.endpoint.nsid} from its cursor"
+
+
+@dataclass
+class StreamScan(Scan):
+    """Subscribe to Jetstream, yielding the events as they arrive until the query stops taking them.
+
+    The collections and DIDs named in the WHERE are sent as the subscription's filters, so the server only
+    sends those events. Events the query falls too far behind on are dropped, oldest first.
+    """
+
+    name: str = "Subscribe"
+    wanted: dict[str, list[str]] = field(default_factory=dict)  # Filter -> the values sent for it
+
+    async def fetch(self, session: Any) -> AsyncIterator[list[dict]]:  # noqa: ANN401
+        """Yield each batch of events received since the last, as rows."""
+        subscription = Subscription(
+            session.stream_host, self.wanted.get("wantedCollections", []), self.wanted.get("wantedDids", [])
+        )
+        try:
+            async with aclosing(subscription.batches()) as batches:
+                async for rows in batches:
+                    self.rows_out += len(rows)
+                    yield rows
+        except ConnectionError as e:
+            msg = f"The stream closed: {e}"
+            raise QueryError(msg) from e
+        finally:
+            self.http_calls, self.bytes = subscription.connections, subscription.bytes
+            if subscription.dropped:
+                self.detail += f", dropped {subscription.dropped} events the query fell behind on"
+
+    def describe(self) -> str:
+        """Describe the subscription's filters."""
+        filters = "".join(f" {name}={values}" for name, values in self.wanted.items()) or " every event"
+        return f"jetstream subscribe{filters}, buffering up to {BUFFER_EVENTS} events"
+
+
+def run_operators(operators: list[Operator], rows: list[dict]) -> list[dict]:
+    """Push a batch of rows through a chain of streaming operators."""
+    for op in operators:
+        rows = op.push(rows)
+    return rows
+
+
+@dataclass
+class HashJoin(Operator):
+    """Join two tables on equal column values through an in-memory hash table.
+
+    Both sides are paged alternately, and whichever runs out first is the smaller side that gets built
+    into the hash table; the other side's pages then stream past and probe it. When the right side is a
+    lookup table, like `profile`, its rows are instead fetched in batches for the keys on each left page.
+    """
+
+    name: str = "HashJoin"
+    left: str = ""
+    right: str = ""
+    left_key: str = ""
+    right_key: str = ""
+    left_scan: Scan | None = None
+    right_scan: Scan | None = None
+    left_operators: list[Operator] = field(default_factory=list)
+    right_operators: list[Operator] = field(default_factory=list)
+    built_on: str = ""
+    table: dict[Any, list[dict]] = field(default_factory=dict)
+
+    @property
+    def steps(self) -> list[Operator]:
+        """Every step feeding the join, then the join itself."""
+        return [self.left_scan, *self.left_operators, self.right_scan, *self.right_operators, self]
+
+    async def fetch(self, session: Any) -> AsyncIterator[list[dict]]:  # noqa: ANN401
+        """Yield batches of joined rows."""
+        pages = self._lookup_join(session) if isinstance(self.right_scan, Lookup) else self._hash_join(session)
+        async with aclosing(pages):
+            async for batch in pages:
+                yield batch
+
+    async def _lookup_join(self, session: Any) -> AsyncIterator[list[dict]]:  # noqa: ANN401
+        self.built_on = self.right
+        looked_up = set()
+        async with aclosing(self.left_scan.fetch(session)) as pages:
+            async for page in pages:
+                rows = run_operators(self.left_operators, page)
+                keys = [k for k in dict.fromkeys(row.get(self.left_key) for row in rows) if k not in looked_up]
+                keys = [key for key in keys if key is not None and key != ""]
+                if keys:
+                    looked_up.update(keys)
+                    found = await self.right_scan.fetch_keys(session, keys)
+                    self.build(run_operators(self.right_operators, found))
+                yield self.push(rows)
+
+    async def _hash_join(self, session: Any) -> AsyncIterator[list[dict]]:  # noqa: ANN401
+        sides = [
+            (self.left, self.left_scan.fetch(session), self.left_operators),
+            (self.right, self.right_scan.fetch(session), self.right_operators),
+        ]
+        try:
+            buffered = {self.left: [], self.right: []}
+            while not self.built_on:
+                for name, pages, operators in sides:
+                    page = await anext(pages, None)
+                    if page is None:
+                        self.built_on = name
+                        break
+                    buffered[name].extend(run_operators(operators, page))
+
+            self.detail += f", built on {self.built_on}"
+            self.build(buffered.pop(self.built_on))
+            (_, probe), *_ = buffered.items()
+            yield self.push(probe)
+
+            _, pages, operators = next(side for side in sides if side[0] != self.built_on)
+            async for page in pages:
+                yield self.push(run_operators(operators, page))
+        finally:
+            # a side left unfinished, like the stream, closes now rather than whenever it's collected
+            for _, pages, _ in sides:
+                await pages.aclose()
+
+    def build(self, rows: list[dict]) -> None:
+        """Add rows from the build side to the hash table."""
+        start = time.perf_counter()
+        key = self.right_key if self.built_on == self.right else self.left_key
+        for row in rows:
+            value = row.get(key)
+            if value is not None and value != "":
+                self.table.setdefault(value, []).append(row)
+        self.elapsed += time.perf_counter() - start
+
+    def process(self, rows: list[dict]) -> list[dict]:
+        """Probe the hash table with rows from the other side."""
+        probe_right = self.built_on == self.left
+        key = self.right_key if probe_right else self.left_key
+        result = []
+        for row in rows:
+            for match in self.table.get(row.get(key), ()):
+                left, right = (match, row) if probe_right else (row, match)
+                joined = {f"{self.left}.{k}": v for k, v in left.items()}
+                joined |= {f"{self.right}.{k}": v for k, v in right.items()}
+                result.append(joined)
+        return result
+
+
+@dataclass
+class Plan:
+    """The source and local operators used to answer a query."""
+
+    table: str
+    source: Scan | HashJoin
+    operators: list[Operator]
+    fields: list[str]
+    explain: str | None = None
+    outfile: str | None = None  # Where INTO OUTFILE streams the rows, instead of the table
+    watch: int | None = None  # Seconds between the refreshes of a WATCH query, which then runs until cancelled
+
+    @property
+    def steps(self) -> list[Operator]:
+        """Every step of the plan in execution order."""
+        if isinstance(self.source, HashJoin):
+            return [*self.source.steps, *self.operators]
+        return [self.source, *self.operators]
+
+    @property
+    def live(self) -> bool:
+        """Whether the plan reads the stream, so its rows keep arriving until the LIMIT or a cancel."""
+        return any(isinstance(step, StreamScan) for step in self.steps)
+
+
+def _route(table: str, predicates: list[tuple[str, str, str]]) -> tuple[Endpoint | None, str | list[str] | None]:
+    """Pick the endpoint for a table, and the WHERE value passed to it."""
+    if table not in TABLES:
+        msg = f"Unknown table '{table}'. Try: SELECT * FROM tables"  # noqa: S608 Not sql injection
+        raise QueryError(msg)
+
+    endpoints = TABLES[table]
+    routing = next((p for p in predicates if p[0] in endpoints), None)
+    if table == "tables":
+        return None, None
+    if routing is not None and routing[1] == "IN":
+        if table not in LOOKUPS:
+            msg = f"{routing[0]} IN (...) only works on: {', '.join(LOOKUPS)}"
+            raise QueryError(msg)
+        return LOOKUPS[table], routing[2]
+    if routing is not None:
+        return endpoints[routing[0]], routing[2]
+    if None in endpoints:
+        return endpoints[None], None
+
+    names = ", ".join(name for name in endpoints if name)
+    msg = f"Table '{table}' needs a WHERE on one of: {names}"
+    raise QueryError(msg)
+
+
+def _search_text(op: str, literal: str) -> str:
+    """Turn a LIKE pattern into the words to search for, passing MATCH words through."""
+    return " ".join(filter(None, re.split(r"[%_\s]+", literal))) if op == "LIKE" else literal
+
+
+def _pushdown(table: str, predicates: list[tuple[str, str, str]]) -> tuple[dict[str, str], list[tuple]]:
+    """Split a search table's WHERE into the search parameters and the predicates checked after fetching."""
+    pushable = PUSHDOWN.get(table, {})
+    names = {name for name, _ in pushable}
+    rechecks = RECHECKS.get(table, {})
+    arguments, residual = {}, []
+    for col, op, lit in predicates:
+        param = pushable.get((col, op))
+        if param is None and col in names:
+            ops = ", ".join(f"{name} {op}" for name, op in pushable if name == col)
+            msg = f"{table} can't search on {col} {op}, try: {ops}"
+            raise QueryError(msg)
+        if param is None:
+            residual.append((col, op, lit))
+        elif param == "q":
+            arguments["q"] = " ".join(filter(None, [arguments.get("q"), _search_text(op, lit)]))
+        else:
+            arguments[param] = lit
+        if col in rechecks:
+            residual.append((rechecks[col], op, lit))
+
+    if not arguments.get("q") and pushable:
+        if table in NEEDS_QUERY:
+            msg = f"Table '{table}' needs a WHERE on text LIKE or text MATCH"
+            raise QueryError(msg)
+        arguments["q"] = "*"
+    return arguments, residual
+
+
+def _stream_filters(predicates: list[tuple[str, str, str]]) -> dict[str, list[str]]:
+    """Pick the WHERE predicates Jetstream can filter on, by `=`, IN, or a collection prefix with LIKE."""
+    wanted = {}
+    for col, op, lit in predicates:
+        param = STREAM_FILTERS.get(col.lower())
+        if param is None or param in wanted:
+            # a second predicate on the same name narrows the first, which the subscription can't do
+            continue
+        if op == "=":
+            wanted[param] = [lit]
+        elif op == "IN":
+            wanted[param] = list(lit)
+        elif op == "LIKE" and param == "wantedCollections" and re.fullmatch(r"[\w.-]+\.%", lit):
+            wanted[param] = [f"{lit[:-1]}*"]
+    return wanted
+
+
+def _plan_source(table: str, predicates: list[tuple[str, str, str]]) -> Scan:
+    """Build the scan for a table, or a lookup when the WHERE lists the keys to fetch."""
+    temp = temp_tables.get(table)
+    if temp is not None:
+        return TempScan(table=table, temp=temp)
+    if table == STREAM_TABLE:
+        return StreamScan(table=table, wanted=_stream_filters(predicates))
+    endpoint, value = _route(table, predicates)
+    if isinstance(value, list):
+        return Lookup(table=table, endpoint=endpoint, keys=value)
+    return Scan(table=table, endpoint=endpoint, value=value, arguments=_pushdown(table, predicates)[0])
+
+
+def _plan_filter(table: str, predicates: list[tuple[str, str, str]]) -> list[Operator]:
+    """Build the filter step for the WHERE predicates that aren't endpoint arguments or search parameters."""
+    if table in PUSHDOWN:
+        residual = _pushdown(table, predicates)[1]
+    elif temp_tables.get(table) is not None or table == STREAM_TABLE:
+        # a temp table has no endpoint, every name is a column, and the stream still sends events the
+        # subscription filters don't cover, like identity events whatever the collection
+        residual = predicates
+    else:
+        residual = [p for p in predicates if p[0] not in PARAMETERS]
+    if not residual:
+        return []
+    detail = " AND ".join(f"{col} {op} {lit!r}" for col, op, lit in residual)
+    return [Filter(detail=detail, predicates=residual)]
+
+
+def _flatten(scan: Scan) -> list[Operator]:
+    """Build the step flattening what a scan fetches, which a temp table's rows have already been through."""
+    return [] if isinstance(scan, TempScan) else [Flatten()]
+
+
+def _plan_text_index(
+    scan: Scan, predicates: list[tuple[str, str, str]], operators: list[Operator]
+) -> tuple[Scan, list[Operator]]:
+    """Answer MATCH from the text index of an earlier scan of the same source, or index this scan's rows.
+
+    Search tables are left alone, the server already finds the rows with the words.
+    """
+    column = next((col.lower() for col, op, _ in predicates if op == "MATCH"), None)
+    if column is None or type(scan) is not Scan or scan.endpoint is None or scan.table in PUSHDOWN:
+        return scan, operators
+
+    key = (scan.table, scan.endpoint.nsid, scan.value, column)
+    index = text_index.lookup(key)
+    if index is None:
+        scan.index = text_index.build(key)
+        return scan, [operators[0], IndexPages(detail=f"words of {column}", index=scan.index), *operators[1:]]
+
+    terms = [word for col, op, lit in predicates if op == "MATCH" and col.lower() == column for word in words(lit)]
+    index_scan = IndexScan(table=scan.table, endpoint=scan.endpoint, value=scan.value, index=index, terms=terms)
+    # the index holds flattened rows, and flattens what it fetches itself
+    return index_scan, operators[1:]
+
+
+def _posts(endpoint: Endpoint | None) -> bool:
+    """Check whether an endpoint pages through feed items, newest first."""
+    return endpoint is not None and endpoint.paginated and (endpoint.key == "feed" or endpoint.wrap == "post")
+
+
+def _plan_refresh(scan: Scan) -> RefreshScan:
+    """Read a source of posts through its feed cache, so only the posts newer than last time are fetched."""
+    endpoint = scan.endpoint
+    if type(scan) is not Scan or not _posts(endpoint):
+        tables = ", ".join(table for table, routes in TABLES.items() if any(map(_posts, routes.values())))
+        msg = f"REFRESH and WATCH only work on tables of posts: {tables}"
+        raise QueryError(msg)
+    key = (scan.table, endpoint.nsid, scan.value, tuple(sorted(scan.arguments.items())))
+    return RefreshScan(
+        table=scan.table,
+        endpoint=endpoint,
+        value=scan.value,
+        arguments=scan.arguments,
+        cache=feed_cache.get(key),
+        key=key,
+    )
+
+
+def _plan_scan(scan: Scan, limit: int | None, *, exhaustive: bool) -> Scan:
+    """Size the pages of a scan, either to cover the limit or to read everything."""
+    if exhaustive or limit is None:
+        scan.pages = MAX_SCAN_PAGES
+    else:
+        scan.rows_wanted = limit
+        scan.pages = max(1, math.ceil(limit / PAGE_SIZE))
+        scan.page_size = min(PAGE_SIZE, max(1, limit))
+    scan.detail = scan.describe()
+    return scan
+
+
+def _plan_join(
+    tree: Tree, table: str, predicates: list[tuple[str, str, str]], limit: int | None, *, exhaustive: bool
+) -> HashJoin:
+    """Build the two sides of a JOIN, pushing each side's WHERE predicates below the join."""
+    right, condition = extract_join(tree)
+    if get_refresh(tree) or get_watch(tree) is not None:
+        msg = "REFRESH and WATCH can't be used with JOIN, refresh a table of posts on its own"
+        raise QueryError(msg)
+    if right == table:
+        msg = f"Can't join {table} to itself"
+        raise QueryError(msg)
+
+    split = {table: [], right: []}
+    for col, op, lit in predicates:
+        side, _, column = col.rpartition(".")
+        if (side or table) not in split:
+            msg = f"Unknown table '{side}' in WHERE, expected {table} or {right}"
+            raise QueryError(msg)
+        split[side or table].append((column, op, lit))
+
+    on = [p for p in walk_where(condition) if isinstance(p, tuple)]
+    if len(on) != 1 or on[0][1] != "=":
+        msg = "JOIN ... ON needs a single `=` between a column of each table"
+        raise QueryError(msg)
+    (first, _, second) = on[0]
+    if {first.rpartition(".")[0], second.rpartition(".")[0]} - {"", table, right}:
+        msg = f"JOIN ... ON can only use columns of {table} and {right}"
+        raise QueryError(msg)
+    if first.rpartition(".")[0] == right or second.rpartition(".")[0] == table:
+        first, second = second, first
+    left_key, right_key = first.rpartition(".")[2].lower(), second.rpartition(".")[2].lower()
+
+    left_filters, right_filters = _plan_filter(table, split[table]), _plan_filter(right, split[right])
+    left_scan = _plan_source(table, split[table])
+    left_operators = [*_flatten(left_scan), *left_filters]
+    if right in LOOKUPS:
+        if right_key not in LOOKUP_KEYS:
+            msg = f"Join {right} on one of: {', '.join(f'{right}.{key}' for key in LOOKUP_KEYS)}"
+            raise QueryError(msg)
+        # every left row finds at most one row to join, so unless something filters them, reading up to
+        # the limit is enough
+        _plan_scan(left_scan, limit, exhaustive=exhaustive or bool(left_filters or right_filters))
+        right_scan = Lookup(table=right, endpoint=LOOKUPS[right])
+        right_scan.detail = right_scan.describe()
+        right_operators = [Flatten(), *right_filters]
+    else:
+        # the build side has to be read in full, and we only know which side that is once one runs out
+        right_scan = _plan_source(right, split[right])
+        right_operators = [*_flatten(right_scan), *right_filters]
+        _plan_scan(left_scan, limit, exhaustive=True)
+        _plan_scan(right_scan, limit, exhaustive=True)
+
+    return HashJoin(
+        detail=f"{table}.{left_key} = {right}.{right_key}",
+        left=table,
+        right=right,
+        left_key=left_key,
+        right_key=right_key,
+        left_scan=left_scan,
+        right_scan=right_scan,
+        left_operators=left_operators,
+        right_operators=right_operators,
+    )
+
+
+def _plan_aggregate(tree: Tree, qualify: Callable[[str], str]) -> HashAggregate | None:
+    """Build the aggregation step, if the query has aggregates or a GROUP BY."""
+    stmt = get_statement(tree)
+    field_nodes = extract_fields(tree)
+    group_by = [qualify(column) for column in extract_group(tree)]
+    calls = [
+        call
+        for c in stmt.children
+        if c.kind in (ParentKind.FIELD_LIST, ParentKind.ORDER_CLAUSE)
+        for call in find_calls(c)
+    ]
+    if not calls and not group_by:
+        return None
+
+    aggregates = {}
+    for call in calls:
+        function, arg = call.children[0].text.upper(), call.children[2]
+        if function not in AGGREGATES:
+            msg = f"Unknown function {function}, try one of: {', '.join(AGGREGATES)}"
+            raise QueryError(msg)
+        if arg.kind is TokenKind.STAR and function != "COUNT":
+            msg = f"{function}(*) isn't supported, name a column"
+            raise QueryError(msg)
+        column = None if arg.kind is TokenKind.STAR else qualify(expr_name(arg)).lower()
+        aggregates[expr_name(call).lower()] = (function, column, expr_name(call).lower())
+
+    for node in field_nodes:
+        if node.kind is TokenKind.STAR or (
+            node.kind is not ParentKind.EXPR_CALL and qualify(expr_name(node)) not in group_by
+        ):
+            msg = f"{expr_name(node)} must be in the GROUP BY or inside an aggregate like COUNT"
+            raise QueryError(msg)
+
+    detail = ", ".join(dict.fromkeys(expr_name(call) for call in calls))
+    if group_by:
+        detail += f" GROUP BY {', '.join(group_by)}"
+    return HashAggregate(
+        detail=detail.strip(),
+        group_by=[column.lower() for column in group_by],
+        aggregates=list(aggregates.values()),
+    )
+
+
+def _plan_limit(tree: Tree, *, exhaustive: bool) -> int | None:
+    """Get how many rows a query returns, or None for a query of the stream that runs until it's cancelled."""
+    limit = get_limit(tree)
+    join = extract_join(tree)
+    streamed = STREAM_TABLE in (extract_table(tree), join and join[0])
+    if streamed and exhaustive:
+        msg = (
+            "The stream never ends, so it can't be sorted or aggregated. Collect some of it first: "
+            "CREATE TEMP TABLE recent AS SELECT * FROM stream LIMIT 1000"
+        )
+        raise QueryError(msg)
+    if limit is not None:
+        return limit
+    if get_created(tree) or get_outfile(tree):
+        # a temp table or a file keeps everything a scan can read, rather than a screenful
+        return MAX_SCAN_PAGES * PAGE_SIZE
+    return None if streamed else DEFAULT_LIMIT
+
+
+def _plan_watch(tree: Tree, *, aggregated: bool) -> int | None:
+    """Get the seconds between a WATCH query's refreshes, making sure its new rows can be added to those shown."""
+    seconds = get_watch(tree)
+    if seconds is None:
+        return None
+    if seconds < WATCH_MIN_SECONDS:
+        msg = f"WATCH needs at least {WATCH_MIN_SECONDS} seconds between refreshes"
+    elif aggregated or extract_order(tree) is not None:
+        msg = "WATCH adds the new rows to the ones shown, so it can't be used with aggregates or ORDER BY"
+    elif get_created(tree) or get_outfile(tree):
+        msg = "WATCH runs until it's cancelled, so it can't be used with CREATE TEMP TABLE or INTO OUTFILE"
+    else:
+        return seconds
+    raise QueryError(msg)
+
+
+def _plan_drop(name: str) -> Plan:
+    """Build the plan dropping a temp table."""
+    if temp_tables.get(name) is None:
+        kind = "a built-in table" if name in TABLES else "not a temp table"
+        msg = f"Can't drop '{name}', it's {kind}. Try: SELECT * FROM tables"  # noqa: S608 Not sql injection
+        raise QueryError(msg)
+    drop = DropTable(table=name)
+    drop.detail = drop.describe()
+    return Plan(name, drop, [], [])
+
+
+def _plan_create(name: str, outfile: str | None) -> Materialize:
+    """Build the step storing a query's rows as a new temp table."""
+    if name in TABLES:
+        msg = f"'{name}' is a built-in table, pick another name"
+        raise QueryError(msg)
+    if temp_tables.get(name) is not None:
+        msg = f"Temp table '{name}' already exists, DROP TABLE {name} first"
+        raise QueryError(msg)
+    if outfile:
+        msg = "CREATE TEMP TABLE can't go INTO OUTFILE too, export the temp table afterwards"
+        raise QueryError(msg)
+    return Materialize(detail=name, table=TempTable(name))
+
+
+def plan_query(tree: Tree) -> Plan:
+    """Pick the endpoint, page count and local operators for a query."""
+    dropped = get_dropped(tree)
+    if dropped is not None:
+        return _plan_drop(dropped)
+    created = get_created(tree)
+    table = extract_table(tree)
+    joined = extract_join(tree) is not None
+
+    def qualify(name: str) -> str:
+        # in a join, plain column names refer to the FROM table
+        if not joined or "." in name or "(" in name:
+            return name
+        return f"{table}.{name}"
+
+    fields = [qualify(name) for name in get_fields(tree)]
+    predicates = [i for i in extract_where(tree) if isinstance(i, tuple)]
+    order = extract_order(tree)
+    aggregate = _plan_aggregate(tree, qualify)
+    watch = _plan_watch(tree, aggregated=aggregate is not None)
+    # we can't tell which rows sort first or fall in which group, so page through everything
+    exhaustive = order is not None or aggregate is not None
+    limit = _plan_limit(tree, exhaustive=exhaustive)
+
+    if joined:
+        source = _plan_join(tree, table, predicates, limit, exhaustive=exhaustive)
+        operators = []
+    else:
+        scan = _plan_source(table, predicates)
+        if get_refresh(tree) or watch is not None:
+            scan = _plan_refresh(scan)
+        filters = _plan_filter(table, predicates)
+        # with a filter we can't tell how many rows will match either
+        exhaustive = exhaustive or bool(filters)
+        source, operators = _plan_text_index(scan, predicates, [*_flatten(scan), *filters])
+        source = _plan_scan(source, limit, exhaustive=exhaustive)
+
+    if aggregate is not None:
+        operators.append(aggregate)
+    if order is not None:
+        column, descending = qualify(order[0]), order[1]
+        detail = f"{column} {'DESC' if descending else 'ASC'}, k={limit}"
+        operators.append(TopK(detail=detail, column=column, descending=descending, k=limit))
+    elif limit is not None:
+        operators.append(Limit(detail=str(limit), remaining=limit))
+    operators.append(Project(detail=", ".join(fields) or "*", fields=fields))
+    if created:
+        operators.append(_plan_create(created, get_outfile(tree)))
+        # the query gives back the row describing the new table, not the columns it selected
+        fields = []
+
+    return Plan(table, source, operators, fields, get_explain(tree), get_outfile(tree), watch)
+
+
+def compile_query(query: str) -> Plan:
+    """Parse and plan a query, with no browser involved, raising QueryError for syntax errors."""
+    with TRACER.span("parse"):
+        tree = parse(tokenize(query))
+    errors = syntax_errors(tree)
+    if errors:
+        msg = "\n".join(errors)
+        raise QueryError(msg)
+    with TRACER.span("plan"):
+        return plan_query(tree)
+
+
+async def stream(plan: Plan, session: Any) -> AsyncIterator[list[dict]]:  # noqa: ANN401
+    """Run a plan, yielding batches of result rows as pages arrive."""
+    # a LIMIT 0 is done before it starts, and needs no call to the API
+    if not any(op.done for op in plan.operators):
+        # closed as soon as the operators are done, so the scan's cleanup runs now rather than whenever it's collected
+        async with aclosing(plan.source.fetch(session)) as pages:
+            async for page in pages:
+                batch = page
+                for op in plan.operators:
+                    batch = op.push(batch)
+                if batch:
+                    yield batch
+                if any(op.done for op in plan.operators):
+                    break
+
+    for index, op in enumerate(plan.operators):
+        batch = op.finish()
+        for later in plan.operators[index + 1 :]:
+            batch = later.push(batch)
+        if batch:
+            yield batch
+
+
+async def execute(plan: Plan, session: Any) -> list[dict]:  # noqa: ANN401
+    """Run a plan and collect every result row."""
+    return [row async for batch in stream(plan, session) for row in batch]
+
+
+def columns(plan: Plan, rows: list[dict]) -> list[str]:
+    """Get the column headers for a set of result rows."""
+    if plan.fields:
+        return list(plan.fields)
+    head = []
+    for row in rows:
+        head.extend(k for k in row if k not in head)
+    return head
+
+
+def scan_stats(plan: Plan) -> Counter:
+    """Add up the HTTP calls, bytes and cache hits of a plan's scans once it has run."""
+    stats = Counter()
+    for step in plan.steps:
+        if isinstance(step, Scan):
+            stats.update(http_calls=step.http_calls, bytes=step.bytes, cache_hits=step.cache_hits)
+    return stats
+
+
+def explain_rows(plan: Plan, *, analyze: bool = False) -> list[dict]:
+    """Describe each step of a plan as a row, with its counters if it has run."""
+    rows = []
+    for step in plan.steps:
+        row = {"operator": step.name, "detail": step.detail}
+        if analyze:
+            row |= {
+                "time_ms": f"{step.elapsed * 1000:.2f}",
+                "rows_in": step.rows_in,
+                "rows_out": step.rows_out,
+            }
+            if isinstance(step, Scan):
+                row |= {"http_calls": step.http_calls, "bytes": step.bytes, "cache_hits": step.cache_hits}
+        rows.append(row)
+    return rows
+
+
+class _FakeClient:
+    def __init__(self) -> None:
+        self.stats = Counter()
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.stats[name] += amount
+        call = CALL_STATS.get()
+        if call is not None:
+            call[name] += amount
+
+
+class _FakeFollowers:
+    """A session serving `total` numbered followers of any actor, a page per call."""
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.client = _FakeClient()
+        self.limits = []
+
+    async def get_followers(self, _: str, limit: int, cursor: str | None) -> dict:
+        start = int(cursor or 0)
+        end = min(start + limit, self.total)
+        self.limits.append(limit)
+        self.client.count("http_calls")
+        await asyncio.sleep(0)  # lets other queries run meanwhile, like waiting for the response would
+        return {
+            "followers": [{"handle": f"user{i}.test", "followersCount": i % 7} for i in range(start, end)],
+            "cursor": str(end) if end < self.total else None,
+        }
+
+
+def test_top_k_order_and_ties() -> None:
+    """Tests that TopK keeps the best k rows across batches, with ties in the order they arrived."""
+    top = TopK(column="likes", descending=True, k=3)
+    top.push([{"id": 1, "likes": 5}, {"id": 2, "likes": 9}, {"id": 3}])
+    top.push([{"id": 4, "likes": 5}, {"id": 5, "likes": 1}, {"id": 6, "likes": 5}])
+    assert [row["id"] for row in top.finish()] == [2, 1, 4]
+
+    # ascending puts missing values first
+    top = TopK(column="likes", k=2)
+    top.push([{"id": 1, "likes": 5}, {"id": 2, "likes": "text"}, {"id": 3}, {"id": 4, "likes": 1}])
+    assert [row["id"] for row in top.finish()] == [3, 4]
+
+
+def test_hash_aggregate() -> None:
+    """Tests that HashAggregate folds rows per group, and without GROUP BY gives a row for empty input."""
+    aggregates = [("COUNT", None, "count(*)"), ("SUM", "likes", "sum(likes)"), ("AVG", "likes", "avg(likes)")]
+    assert HashAggregate(aggregates=aggregates).finish() == [{"count(*)": 0, "sum(likes)": None, "avg(likes)": None}]
+    assert HashAggregate(group_by=["author"], aggregates=aggregates).finish() == []
+
+    grouped = HashAggregate(group_by=["author"], aggregates=aggregates)
+    assert grouped.push([{"author": "a", "likes": 1}, {"author": "b", "likes": ""}]) == []
+    grouped.push([{"author": "a", "likes": "3"}])
+    assert grouped.finish() == [
+        {"author": "a", "count(*)": 2, "sum(likes)": 4, "avg(likes)": 2},
+        {"author": "b", "count(*)": 1, "sum(likes)": None, "avg(likes)": None},
+    ]
+
+
+def test_execute_pages_to_limit() -> None:
+    """Tests that a LIMIT asks for just enough rows, over as many pages as it takes."""
+    session = _FakeFollowers(250)
+    plan = compile_query("SELECT handle FROM followers WHERE actor = 'a' LIMIT 150")
+    rows = asyncio.run(execute(plan, session))
+    assert rows == [{"handle": f"user{i}.test"} for i in range(150)]
+    assert session.limits == [100, 50]
+    assert scan_stats(plan)["http_calls"] == len(session.limits)
+
+
+def test_execute_order_by() -> None:
+    """Tests that ORDER BY reads every page before picking the top rows."""
+    session = _FakeFollowers(250)
+    plan = compile_query("SELECT handle FROM followers WHERE actor = 'a' ORDER BY followerscount DESC LIMIT 3")
+    rows = asyncio.run(execute(plan, session))
+    assert rows == [{"handle": "user6.test"}, {"handle": "user13.test"}, {"handle": "user20.test"}]
+    assert session.limits == [100, 100, 100]
+
+
+def test_execute_limit_zero() -> None:
+    """Tests that LIMIT 0 gives no rows without calling the API, ordered, aggregated or not."""
+    session = _FakeFollowers(250)
+    queries = [
+        "SELECT handle FROM followers WHERE actor = 'a' LIMIT 0",
+        "SELECT handle FROM followers WHERE actor = 'a' ORDER BY followerscount DESC LIMIT 0",
+        "SELECT COUNT(*) FROM followers WHERE actor = 'a' LIMIT 0",
+    ]
+    plans = [compile_query(query) for query in queries]
+    assert [asyncio.run(execute(plan, session)) for plan in plans] == [[], [], []]
+    assert session.limits == []
+
+
+def test_where_errors() -> None:
+    """Tests that WHERE refuses an aggregate, pointing to HAVING, and a list on the left."""
+    import pytest  # noqa: PLC0415 Only the tests need pytest
+
+    with pytest.raises(QueryError, match=r"COUNT\(\*\) can't go in WHERE, .* needs HAVING"):
+        compile_query("SELECT COUNT(*) FROM timeline WHERE COUNT(*) > 3")
+    with pytest.raises(QueryError, match=r"SUM\(likecount\) can't go in WHERE"):
+        compile_query("SELECT author FROM timeline WHERE author = 'a' AND 10 < SUM(likecount)")
+    with pytest.raises(QueryError, match="goes on the right of IN"):
+        compile_query("SELECT * FROM timeline WHERE (a, b) = 1")
+
+
+def test_concurrent_scan_stats() -> None:
+    """Tests that queries running at once over one session each count only their own HTTP calls."""
+    session = _FakeFollowers(250)
+    queries = [
+        "SELECT handle FROM followers WHERE actor = 'a' LIMIT 250",
+        "SELECT handle FROM followers WHERE actor = 'b' LIMIT 10",
+    ]
+    plans = [compile_query(query) for query in queries]
+
+    async def run() -> None:
+        await asyncio.gather(*(execute(plan, session) for plan in plans))
+
+    asyncio.run(run())
+    assert [scan_stats(plan)["http_calls"] for plan in plans] == [3, 1]
+    assert session.client.stats["http_calls"] == len(session.limits)
@@ -0,0 +1,341 @@
+"""Stream query results into CSV, NDJSON or Parquet files as the pages arrive.
+
+An exporter only encodes, turning each batch of rows into bytes that are handed to a sink straight away: a
+file under CPython, or a download in the browser. Nothing holds more than one batch, or one Parquet row group,
+so exports run in the same memory however many rows they have.
+"""
+
+import abc
+import asyncio
+import csv
+import io
+import json
+from pathlib import Path, PurePosixPath
+from typing import Any, Protocol
+
+import temp_tables
+from executor import Plan, QueryError, columns, compile_query, stream
+
+ROW_GROUP_ROWS = 10_000  # Rows buffered into each Parquet row group
+
+
+class Sink(Protocol):
+    """Somewhere the encoded bytes go."""
+
+    async def write(self, data: bytes) -> None:
+        """Take the next chunk of the file."""
+
+    async def close(self) -> None:
+        """Finish the file."""
+
+
+class FileSink:
+    """Write straight to a file on disk, for cli.py, which isn't made until the export writes or finishes."""
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self.file = None
+
+    async def write(self, data: bytes) -> None:
+        """Append a chunk to the file."""
+        if self.file is None:
+            self.file = self.path.open("wb")
+        self.file.write(data)
+
+    async def close(self) -> None:
+        """Close the file, making it if nothing was written."""
+        if self.file is None:
+            self.file = self.path.open("wb")
+        self.file.close()
+
+
+class Exporter(abc.ABC):
+    """Encode batches of rows into one file format."""
+
+    media_type = "application/octet-stream"
+
+    @classmethod  # noqa: B027 Most formats take any columns, so overriding it is optional
+    def check(cls, head: list[str]) -> None:
+        """Raise QueryError if the format can't take the columns a query selects, none for SELECT *."""
+
+    def start(self, head: list[str]) -> bytes:
+        """Return what goes before the first batch, like a header, from the columns the query selects."""
+        self.check(head)
+        return b""
+
+    @abc.abstractmethod
+    def encode(self, head: list[str], rows: list[dict]) -> bytes:
+        """Encode a batch of rows, returning the bytes ready to go out."""
+
+    def finish(self) -> bytes:
+        """Return anything held back until the end, like a file footer."""
+        return b""
+
+
+class CsvExporter(Exporter):
+    """Write CSV with the header of the columns the query selects, blanking the ones a row is missing.
+
+    The header goes out before the first row, even when there are none, so SELECT * can't be exported as CSV,
+    there's no telling which columns its rows will have.
+    """
+
+    media_type = "text/csv"
+
+    def __init__(self) -> None:
+        self.buffer = io.StringIO()
+        self.writer = None
+
+    @classmethod
+    def check(cls, head: list[str]) -> None:
+        """Refuse SELECT *, whose columns aren't known until its rows arrive."""
+        if not head:
+            msg = "A CSV header needs the columns named, and SELECT * doesn't say which. SELECT them, or try .ndjson"
+            raise QueryError(msg)
+
+    def start(self, head: list[str]) -> bytes:
+        """Encode the header line."""
+        self.check(head)
+        self.writer = csv.DictWriter(self.buffer, head, extrasaction="ignore", restval="")
+        self.writer.writeheader()
+        return self._take()
+
+    def encode(self, head: list[str], rows: list[dict]) -> bytes:  # noqa: ARG002 The header is already out
+        """Encode a batch of rows as CSV lines."""
+        self.writer.writerows(rows)
+        return self._take()
+
+    def _take(self) -> bytes:
+        data = self.buffer.getvalue().encode()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+class NdjsonExporter(Exporter):
+    """Write each row as a JSON object on its own line."""
+
+    media_type = "application/x-ndjson"
+
+    def encode(self, head: list[str], rows: list[dict]) -> bytes:
+        """Encode a batch of rows as JSON lines."""
+        return "".join(json.dumps({k: row.get(k) for k in head}, default=str) + "\n" for row in rows).encode()
+
+
+class _Drain(io.RawIOBase):
+    """A write-only stream whose contents are taken out as they're written, for pyarrow to write into."""
+
+    def __init__(self) -> None:
+        self.chunks = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ParquetExporter(Exporter):
+    """Write Parquet row groups with pyarrow, the schema taken from the first row group.
+
+    Later row groups are cast to that schema, so a column that was empty at first takes text, and whole numbers
+    take a column of decimals. A column first seen after the first row group, or values that can't be cast,
+    raise QueryError rather than being left out.
+    """
+
+    media_type = "application/vnd.apache.parquet"
+
+    def __init__(self) -> None:
+        try:
+            import pyarrow as pa  # noqa: PLC0415 Optional, only needed for Parquet
+            import pyarrow.parquet as pq  # noqa: PLC0415
+        except ImportError as e:
+            msg = "Parquet export needs pyarrow, try .csv or .ndjson"
+            raise QueryError(msg) from e
+        self.pa, self.pq = pa, pq
+        self.drain = _Drain()
+        self.writer = None
+        self.pending: list[dict] = []
+        self.head: list[str] = []
+
+    def encode(self, head: list[str], rows: list[dict]) -> bytes:
+        """Buffer rows until there's a row group's worth, then encode it."""
+        late = [name for name in head if name not in self.head]
+        if late and self.writer is not None:
+            msg = (
+                f"{', '.join(late)} first turned up after the Parquet schema was written. "
+                "SELECT the columns to export, or export to .ndjson"
+            )
+            raise QueryError(msg)
+        self.head.extend(late)
+        self.pending.extend(rows)
+        if len(self.pending) < ROW_GROUP_ROWS:
+            return b""
+        return self._flush()
+
+    def finish(self) -> bytes:
+        """Encode the last row group and the footer."""
+        data = self._flush() if self.pending or self.writer is None else b""
+        self.writer.close()
+        return data + self.drain.take()
+
+    def _flush(self) -> bytes:
+        rows, self.pending = self.pending, []
+        table = self.pa.table({name: self._column(name, [row.get(name) for row in rows]) for name in self.head})
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.drain, table.schema)
+        self.writer.write_table(table)
+        return self.drain.take()
+
+    def _column(self, name: str, values: list) -> Any:  # noqa: ANN401
+        errors = (self.pa.ArrowInvalid, self.pa.ArrowTypeError, self.pa.ArrowNotImplementedError)
+        try:
+            column = self.pa.array(values)
+        except errors as e:
+            msg = f"{name} holds values of more than one type, which a Parquet column can't, try .csv or .ndjson"
+            raise QueryError(msg) from e
+        if self.writer is None:
+            # a column that's empty in the first group can't be typed from it, so keep it as text
+            return column.cast(self.pa.string()) if self.pa.types.is_null(column.type) else column
+
+        kind = self.writer.schema.field(name).type
+        try:
+            return column.cast(kind)
+        except errors as e:
+            msg = f"{name} started out as {kind} and later held {column.type}, try .csv or .ndjson"
+            raise QueryError(msg) from e
+
+
+EXPORTERS: dict[str, type[Exporter]] = {
+    ".csv": CsvExporter,
+    ".ndjson": NdjsonExporter,
+    ".jsonl": NdjsonExporter,
+    ".parquet": ParquetExporter,
+}
+
+
+def exporter_for(path: str) -> type[Exporter]:
+    """Pick the exporter for a file name by its extension."""
+    suffix = PurePosixPath(path).suffix.lower()
+    if suffix not in EXPORTERS:
+        msg = f"Can't export to {path}, use one of: {', '.join(EXPORTERS)}"
+        raise QueryError(msg)
+    return EXPORTERS[suffix]
+
+
+async def export(plan: Plan, session: Any, exporter: Exporter, sink: Sink) -> int:  # noqa: ANN401
+    """Run a plan, streaming its rows through the exporter into the sink, and return how many there were.
+
+    An export the format can't take raises QueryError before the sink is written to or closed.
+    """
+    data = exporter.start(columns(plan, []))
+    count = 0
+    try:
+        if data:
+            await sink.write(data)
+        async for batch in stream(plan, session):
+            data = exporter.encode(columns(plan, batch), batch)
+            if data:
+                await sink.write(data)
+            count += len(batch)
+        await sink.write(exporter.finish())
+    finally:
+        await sink.close()
+    return count
+
+
+class _MemorySink:
+    def __init__(self) -> None:
+        self.data = b""
+        self.closed = False
+
+    async def write(self, data: bytes) -> None:
+        self.data += data
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def test_csv() -> None:
+    """Tests that CSV gets one header, quoting, and blanks for the columns a row is missing."""
+    exporter = CsvExporter()
+    data = exporter.start(["a", "b"])
+    data += exporter.encode(["a", "b"], [{"a": 1, "b": "x, y"}])
+    data += exporter.encode(["a", "b"], [{"a": 2}])
+    assert data + exporter.finish() == b'a,b\r\n1,"x, y"\r\n2,\r\n'
+
+
+def test_ndjson() -> None:
+    """Tests that NDJSON writes each row as an object of the selected columns."""
+    exporter = NdjsonExporter()
+    assert exporter.encode(["a", "b"], [{"a": 1, "c": 3}, {"a": "x", "b": [1]}]) == (
+        b'{"a": 1, "b": null}\n{"a": "x", "b": [1]}\n'
+    )
+
+
+def test_parquet_schema() -> None:
+    """Tests that later Parquet row groups are cast to the first one's schema, or raise QueryError if they can't be."""
+    import pytest  # noqa: PLC0415 Only the tests need pytest
+
+    pq = pytest.importorskip("pyarrow.parquet")
+    exporter = ParquetExporter()
+    data = exporter.encode(["id", "n"], [{"id": i} for i in range(ROW_GROUP_ROWS)])
+    data += exporter.encode(["id", "n"], [{"id": ROW_GROUP_ROWS, "n": 7}])
+    table = pq.read_table(io.BytesIO(data + exporter.finish()))
+    assert table.column("n").to_pylist()[-2:] == [None, "7"]
+    assert table.column("id").to_pylist()[-1] == ROW_GROUP_ROWS
+
+    exporter = ParquetExporter()
+    exporter.encode(["id"], [{"id": i} for i in range(ROW_GROUP_ROWS)])
+    exporter.encode(["id"], [{"id": 1.5}])
+    with pytest.raises(QueryError, match="id started out as int64"):
+        exporter.finish()
+    with pytest.raises(QueryError, match="extra first turned up"):
+        exporter.encode(["id", "extra"], [{"id": 1, "extra": 2}])
+
+
+def test_export() -> None:
+    """Tests that export streams every row a query has into the sink, not just a screenful, and closes it."""
+    table = temp_tables.TempTable("export_test")
+    table.append([{"n": i} for i in range(100)])
+    temp_tables.add(table)
+    try:
+        sink = _MemorySink()
+        plan = compile_query("SELECT n FROM export_test WHERE n > 0 INTO OUTFILE 'n.ndjson'")
+        count = asyncio.run(export(plan, None, exporter_for(plan.outfile)(), sink))
+        assert (count, sink.data) == (99, "".join(f'{{"n": {i}}}\n' for i in range(1, 100)).encode())
+        assert sink.closed
+    finally:
+        temp_tables.drop("export_test")
+
+
+def test_export_csv() -> None:
+    """Tests that a CSV export always has its header, even with no rows, and refuses SELECT * before writing."""
+    import pytest  # noqa: PLC0415 Only the tests need pytest
+
+    table = temp_tables.TempTable("export_csv_test")
+    table.append([{"n": 1}, {"n": 2, "m": 3}])
+    temp_tables.add(table)
+    try:
+        sink = _MemorySink()
+        plan = compile_query("SELECT n, m FROM export_csv_test WHERE n > 5 INTO OUTFILE 'n.csv'")
+        assert asyncio.run(export(plan, None, CsvExporter(), sink)) == 0
+        assert (sink.data, sink.closed) == (b"n,m\r\n", True)
+
+        sink = _MemorySink()
+        plan = compile_query("SELECT * FROM export_csv_test INTO OUTFILE 'n.csv'")
+        with pytest.raises(QueryError, match="SELECT \\* doesn't say which"):
+            asyncio.run(export(plan, None, CsvExporter(), sink))
+        assert (sink.data, sink.closed) == (b"", False)
+    finally:
+        temp_tables.drop("export_csv_test")
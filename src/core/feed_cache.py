@@ -0,0 +1,114 @@
+"""The posts a REFRESH query has read from each source, newest first, so the next refresh fetches only new ones.
+
+A refresh reads from the top of the source until it reaches a post it already has, then puts the pages it
+fetched in front of the cached posts they don't repeat. If the cache is too far behind for that, the fetched
+pages replace it.
+"""
+
+from collections import OrderedDict
+
+CACHE_LIMIT = 16  # Sources cached at once, the least recently refreshed is dropped first
+CACHE_ROWS = 5000  # Most posts kept per source, the oldest are dropped first
+
+# (table, nsid, WHERE value, search parameters) -> the posts read from that source
+Key = tuple[str, str, str | None, tuple]
+
+
+def item_key(row: dict) -> tuple[str | None, str | None]:
+    """Identify a feed item by its post and, for a repost, when it was reposted, so reposts aren't mistaken."""
+    reason = row.get("reason") or {}
+    return row.get("post", {}).get("uri"), reason.get("indexedAt")
+
+
+class FeedCache:
+    """The raw rows read from a source, newest first, and the cursor that carries on after the last."""
+
+    def __init__(self) -> None:
+        self.rows: list[dict] = []
+        self.keys: set[tuple] = set()
+        self.cursor: str | None = ""  # Where the rows end, None once there are no more pages
+
+    def extend(self, rows: list[dict], cursor: str | None) -> None:
+        """Add older rows after the ones cached, up to where `cursor` carries on."""
+        self.rows.extend(rows)
+        self.keys.update(item_key(row) for row in rows)
+        self.cursor = cursor
+        self._trim()
+
+    def merge(self, rows: list[dict]) -> list[dict]:
+        """Put freshly fetched rows, which reach back to one already cached, in front, returning the new ones.
+
+        Rows fetched again replace their cached copies, so their counts are up to date.
+        """
+        new = [row for row in rows if item_key(row) not in self.keys]
+        fetched = {item_key(row) for row in rows}
+        self.rows = [*rows, *(row for row in self.rows if item_key(row) not in fetched)]
+        self.keys |= fetched
+        self._trim()
+        return new
+
+    def replace(self, rows: list[dict], cursor: str | None) -> None:
+        """Start again from freshly fetched rows, when they don't reach back to the cached ones."""
+        self.rows, self.keys = [], set()
+        self.extend(rows, cursor)
+
+    def knows(self, rows: list[dict]) -> bool:
+        """Check whether any of the rows are already cached."""
+        return any(item_key(row) in self.keys for row in rows)
+
+    def _trim(self) -> None:
+        if len(self.rows) > CACHE_ROWS:
+            dropped = self.rows[CACHE_ROWS:]
+            self.rows = self.rows[:CACHE_ROWS]
+            self.keys.difference_update(item_key(row) for row in dropped)
+            # the cursor pointed after the dropped rows, which would now be skipped
+            self.cursor = None
+
+
+_caches: OrderedDict[Key, FeedCache] = OrderedDict()
+
+
+def get(key: Key) -> FeedCache:
+    """Get the cache of a source, empty if it hasn't been refreshed before."""
+    cache = _caches.get(key)
+    if cache is None:
+        cache = _caches[key] = FeedCache()
+    _caches.move_to_end(key)
+    while len(_caches) > CACHE_LIMIT:
+        _caches.popitem(last=False)
+    return cache
+
+
+def clear() -> None:
+    """Forget every source, like when the session changes and the posts it read might not be visible."""
+    _caches.clear()
+
+
+def _item(uri: str, reposted: str | None = None, likes: int = 0) -> dict:
+    row = {"post": {"uri": uri, "likeCount": likes}}
+    if reposted:
+        row["reason"] = {"indexedAt": reposted}
+    return row
+
+
+def test_merge() -> None:
+    """Tests that merging puts the new posts in front, replacing the ones fetched again."""
+    cache = FeedCache()
+    cache.extend([_item("c"), _item("b")], "next")
+    assert not cache.knows([_item("d"), _item("c", reposted="later")])
+
+    # a repost of a cached post is a new item
+    new = cache.merge([_item("d"), _item("b", reposted="later"), _item("c", likes=2)])
+    assert new == [_item("d"), _item("b", reposted="later")]
+    assert cache.rows == [_item("d"), _item("b", reposted="later"), _item("c", likes=2), _item("b")]
+    assert cache.cursor == "next"
+    assert cache.knows([_item("d")])
+
+
+def test_trim() -> None:
+    """Tests that a cache past CACHE_ROWS drops its oldest posts, and the cursor that followed them."""
+    cache = FeedCache()
+    cache.extend([_item(str(i)) for i in range(CACHE_ROWS + 1)], "next")
+    assert len(cache.rows) == CACHE_ROWS
+    assert not cache.knows([_item(str(CACHE_ROWS))])
+    assert cache.cursor is None
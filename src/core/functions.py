@@ -1,31 +1,32 @@
 """The main script file for Pyodide."""
 
+from collections import Counter
+from collections.abc import AsyncIterator
+
 import frontend
-from frontend import CLEAR_BUTTON, EXECUTE_BUTTON, QUERY_INPUT, clear_interface, update_table
+from engine_client import QueryCancelledError, cancel_queries, set_hidden
+from executor import QueryError, StealthModeError, get_explain, get_fields, get_outfile, syntax_errors
+from export import ParquetExporter, exporter_for
+from frontend import (
+    CANCEL_BUTTON,
+    CLEAR_BUTTON,
+    EXECUTE_BUTTON,
+    PERF_BUTTON,
+    QUERY_INPUT,
+    TRACE_BUTTON,
+    DownloadSink,
+    TableStream,
+    clear_interface,
+    export_trace,
+    toggle_perf_hud,
+    update_table,
+)
+from image_modal import cancel_prefetches
 from js import Event, document, window
-from parser import Parent, ParentKind, Token, TokenKind, Tree, parse, tokenize
+from parser import Tree, parse, tokenize
 from pyodide.ffi import create_proxy
 from pyodide.ffi.wrappers import set_timeout
-
-
-def flatten_response(data: dict) -> dict:
-    """Flatten a dictionary."""
-    flattened_result = {}
-
-    def _flatten(current: dict, name: str = "") -> dict:
-        if isinstance(current, dict):
-            for field, value in current.items():
-                _flatten(value, name + field + "_")
-        elif isinstance(current, list):
-            """old code
-            # for idx, i in enumerate(current):
-            #     _flatten(i, name + str(idx) + "_")
-            """
-        else:
-            flattened_result[name[:-1].lower()] = current  # Drops the extra _
-
-    _flatten(data)
-    return flattened_result
+from tracing import TRACER
 
 
 def blue_screen_of_death() -> None:
@@ -75,90 +76,6 @@ def blue_screen_of_death() -> None:
     set_timeout(create_proxy(remove_bsod), 4000)
 
 
-def clean_value(text: str) -> str:
-    """Remove surrounding single/double quotes if present."""
-    if isinstance(text, str) and (text[0] == text[-1]) and text[0] in ("'", '"'):
-        return text[1:-1]
-    return text
-
-
-def get_text(node: Tree) -> str:
-    """Recursively get the string value from a node (Parent or Token)."""
-    if hasattr(node, "text"):
-        return node.text
-    if hasattr(node, "children"):
-        return " ".join(get_text(child) for child in node.children)
-    return str(node)
-
-
-def walk_where(node: Tree) -> list[tuple | str]:
-    """Flatten sql expressions into [tuple, 'AND', tuple, ...]."""
-    if getattr(node, "kind", None).name == "EXPR_BINARY":
-        left, op, right = node.children
-        op_text = getattr(op, "text", None)
-
-        if op_text in ("AND", "OR"):
-            return [*walk_where(left), op_text, *walk_where(right)]
-
-        return [(clean_value(get_text(left)), op_text, clean_value(get_text(right)))]
-
-    if hasattr(node, "children"):
-        result = []
-        for child in node.children:
-            result.extend(walk_where(child))
-        return result
-
-    return []
-
-
-def get_limit(node: Tree) -> int | None:
-    """Get what the LIMIT clause of this SQL query contains."""
-    assert node.kind is ParentKind.FILE
-    stmt = node.children[0]
-    for it in stmt.children:
-        if it.kind is ParentKind.LIMIT_CLAUSE:
-            return int(it.children[1].text)
-
-    return None
-
-
-def extract_where(tree: Tree) -> tuple[str, str] | None:
-    """Extract the where clause from the tree."""
-    if not tree.kind == ParentKind.FILE:
-        raise ValueError
-    stmt = tree.children[0]
-    for c in stmt.children:
-        if c.kind == ParentKind.WHERE_CLAUSE:
-            return walk_where(c.children[1])
-    return []
-
-
-def extract_fields(tree: Tree) -> list[Token] | None:
-    """Extract the fields from the tree."""
-    if not tree.kind == ParentKind.FILE:
-        raise ValueError
-    stmt = tree.children[0]
-    for c in stmt.children:
-        if c.kind == ParentKind.FIELD_LIST:
-            return c.children[::2]
-    return []
-
-
-def extract_table(tree: Tree) -> str:
-    """Extract the Table from the tree."""
-    if tree.kind != ParentKind.FILE:
-        raise ValueError
-
-    stmt = tree.children[0]  # SELECT_STMT
-    for c in stmt.children:
-        if c.kind == ParentKind.FROM_CLAUSE:
-            for child in c.children:
-                if child.kind == TokenKind.IDENTIFIER:
-                    return child.text
-            break
-    return ""
-
-
 async def parse_input(_: Event) -> None:
     """Start of the parser."""
     query = QUERY_INPUT.value.strip()
@@ -172,175 +89,172 @@ async def parse_input(_: Event) -> None:
     tree = parse(tokenize(query))
     if not check_query(tree):
         return
-
-    await sql_to_api_handler(tree)
-
-
-async def processor(api: tuple[str, str], table: str, limit: int | None) -> dict:  # noqa: C901, PLR0912, PLR0915
-    """Process the sql statements into a api call."""
-    val = {}
-    if table == "feed":
-        if api[0] in ["actor", "author"]:
-            feed = await window.session.get_author_feed(api[2], limit=limit)
-            val = feed["feed"]
-        elif api[0] == "feed":
-            feed = await window.session.get_feed(api[2], limit=limit)
-            val = feed["feed"]
-
-    elif table == "timeline":
-        feed = await window.session.get_timeline()
-        val = feed["feed"]
-    elif table == "profile":
-        if api[0] in ["actor", "author"]:
-            feed = await window.session.get_profile(api[2])
-            val = feed
-        else:
-            feed = await window.session.get_profile(None)
-            if isinstance(feed, dict) and feed.get("stealth_error"):
-                return "stealth_error"
-            val = feed
-    elif table == "suggestions":
-        feed = await window.session.get_suggestions(limit=limit)
-        val = feed["actors"]
-    elif table == "suggested_feed":
-        feed = await window.session.get_suggested_feeds(limit=limit)
-        val = feed["feeds"]
-    elif table == "likes":
-        if api[0] in ["actor", "author"]:
-            feed = await window.session.get_actor_likes(api[2], limit=limit)
-            val = feed["feeds"]
-        else:
-            pass
-    elif table == "followers":
-        if api[0] in ["actor", "author"]:
-            feed = await window.session.get_followers(api[2], limit=limit)
-            val = feed["followers"]
-        else:
-            pass
-    elif table == "following":
-        if api[0] in ["actor", "author"]:
-            feed = await window.session.get_follows(api[2], limit=limit)
-            val = feed["followers"]
-        else:
-            pass
-    elif table == "mutuals":
-        if api[0] in ["actor", "author"]:
-            feed = await window.session.get_mutual_follows(api[2], limit=limit)
-            val = feed["followers"]
-        else:
-            pass
-    elif table == "tables":
-        val = [
-            {"Table_Name": _}
-            for _ in [
-                "feed",
-                "timeline",
-                "profile",
-                "suggestions",
-                "suggested_feed",
-                "likes",
-                "followers",
-                "following",
-                "mutuals",
-            ]
-        ]
-    return val
-
-
-def _extract_images_from_post(data: dict) -> str:
-    """Extract any embedded images from a post and return them as a delimited string."""
-    if not isinstance(data, dict):
-        return ""
-
-    if "post" not in data:
-        return ""
-
-    post = data["post"]
-
-    # Check if the post has embedded content
-    if "embed" not in post:
-        return ""
-
-    embed_type = post["embed"].get("$type", "")
-
-    # Only process image embeds
-    if embed_type != "app.bsky.embed.images#view":
-        return ""
-
-    images = post["embed"].get("images", [])
-    if not images:
-        return ""
-
-    image_links = []
-    for image in images:
-        image_link = f"{image['thumb']},{image['fullsize']},{image['alt']}"
-        image_links.append(image_link)
-
-    return " | ".join(image_links)
-
-
-async def sql_to_api_handler(tree: Tree) -> dict:
-    """Handle going from SQL to the API."""
-    where_expr = extract_where(tree)
-    table = extract_table(tree)
-    fields = extract_fields(tree)
-    field_tokens = [i.children[0] for i in fields if i.kind != TokenKind.STAR]
-
-    for i in where_expr:
-        if i[0] in ["actor", "author", "feed"]:
-            api = i
-            break
-    else:
-        # No Where Expression Matches
-        api = ["", ""]
-
-    limit = get_limit(tree)
-    val = await processor(api, table, limit if limit is not None else 50)
-    if not val:
+    # the table is about to be replaced, so its images aren't worth converting any more
+    cancel_prefetches()
+    record = TRACER.begin_query(query)
+    summary = {}
+    frontend.set_buttons_disabled(disabled=True)
+    try:
+        summary = await sql_to_api_handler(query, tree)
+    finally:
+        frontend.set_buttons_disabled(disabled=False)
+        # the engine worker did the query's work, so its spans and counters come back with the summary
+        TRACER.add_relative(record, summary.get("spans", []))
+        TRACER.end_query(record, summary.get("rows", 0), Counter(summary.get("stats", {})))
+        frontend.update_perf_hud()
+
+
+async def sql_to_api_handler(query: str, tree: Tree) -> dict:
+    """Handle going from SQL to the API, returning the summary of the query the engine worker sends back."""
+    try:
+        explain = get_explain(tree)
+        if get_outfile(tree) and explain is None:
+            return await export_to_file(query, get_outfile(tree), get_fields(tree))
+        return await run_query(query, analyze=explain is not None)
+    except StealthModeError as e:
         frontend.show_empty_table()
-        frontend.update_status(f"Error getting from {table}. Try: SELECT * FROM tables", "error")  # noqa: S608 Not sql injection
+        frontend.update_status(str(e), "warning")
         frontend.trigger_electric_wave()
-        return {}
-
-    # Handle stealth mode error for profile queries
-    if val == "stealth_error":
+    except QueryCancelledError as e:
+        frontend.update_status(str(e), "warning")
+    except QueryError as e:
         frontend.show_empty_table()
-        frontend.update_status(
-            "Cannot get own profile in stealth mode. Try: SELECT * FROM profile WHERE actors = 'username.bsky.social'",
-            "warning",
+        frontend.update_status(str(e), "error")
+        frontend.trigger_electric_wave()
+    return {}
+
+
+async def run_query(query: str, *, analyze: bool) -> dict:
+    """Run a query in the engine worker, rendering each page of rows as soon as it arrives."""
+    table = TableStream()
+    head, rows = [], []
+    messages = window.session.query(query)
+    message = None
+    async for message in messages:
+        if message["type"] == "watching":
+            return await follow_query(message, messages, table)
+        if message["type"] != "page":
+            continue
+        if analyze:
+            # EXPLAIN ANALYZE, so keep the rows to build off-screen and see what rendering would cost
+            head.extend(k for k in message["head"] if k not in head)
+            rows.extend(message["rows"])
+        else:
+            table.add(message["head"], message["rows"])
+    summary = final_message(message)
+
+    if summary["explain"] is not None and not analyze:
+        update_table(["operator", "detail"], summary["explain"])
+        frontend.update_status(f"Query plan for {summary['table']}", "success")
+    elif analyze:
+        render_time = frontend.measure_render(head, rows)
+        explain = summary["explain"]
+        explain.append(
+            {
+                "operator": "Render",
+                "detail": f"{len(head)} column(s)",
+                "time_ms": f"{render_time * 1000:.2f}",
+                "rows_in": len(rows),
+                "rows_out": len(rows),
+            }
         )
+        update_table(list(explain[0]), explain)
+        frontend.update_status(f"Query plan for {summary['table']}, {len(rows)} row(s) produced", "success")
+    elif not table.rows:
+        frontend.show_empty_table()
+        frontend.update_status(f"Error getting from {summary['table']}. Try: SELECT * FROM tables", "error")  # noqa: S608 Not sql injection
         frontend.trigger_electric_wave()
-        return {}
+    else:
+        table.finish()
+        frontend.update_status(f"Data successfully retrieved from {summary['table']}", "success")
+    return summary
 
-    if isinstance(val, dict):
-        val = [val]
 
-    tb = document.getElementById("table-body")
-    tb.innerHTML = ""
-    head = []
-    if field_tokens:
-        head = [j.text for j in field_tokens]
-    body = []
+def final_message(message: dict | None) -> dict:
+    """Check that a query's replies ended with the done message every finished query sends, and return it."""
+    if message is None or message["type"] != "done":
+        msg = "The engine worker stopped before the query finished, try running it again"
+        raise QueryError(msg)
+    return message
 
-    for i in val:
-        data = i
 
-        # Only try to extract images if the data structure supports it
-        images = _extract_images_from_post(data)
-        if images and "post" in data:
-            data["post"]["images"] = images
+async def follow_query(summary: dict, messages: AsyncIterator[dict], table: TableStream) -> dict:
+    """Add the rows each refresh of a WATCH query finds, or each batch of the stream, to the table until it ends.
 
-        d = flatten_response(data)
+    Returns the summary of a WATCH query's first run, or the stream's done message, which is what the perf HUD shows.
+    """
+    name, live = summary["table"], summary["watch"] is None
+    if live:
+        # the newest events go on top, and only the last screenfuls are kept
+        table.keep = frontend.STREAM_ROWS
+        frontend.show_empty_table()
+        frontend.update_status(f"Streaming {name}", "success")
+    else:
+        if not table.rows:
+            frontend.show_empty_table()
+        table.finish()
+        frontend.update_status(f"Watching {name}, refreshing every {summary['watch']}s", "success")
+    try:
+        async for message in messages:
+            if message["type"] == "done":
+                table.finish()
+                frontend.update_status(f"Reached the LIMIT of {table.rows} row(s) from {name}", "success")
+                return message
+            if message["type"] == "status":
+                frontend.update_status(
+                    f"Watching {name}, {message['message']}, trying again in {summary['watch']}s", "warning"
+                )
+            elif live:
+                table.add_newest(message["head"], message["rows"][::-1])
+                shown = min(table.rows, table.keep)
+                frontend.update_status(f"Streaming {name}, {table.rows} row(s) so far, {shown} shown", "success")
+            else:
+                table.add_newest(message["head"], message["rows"])
+                new = len(message["rows"])
+                frontend.update_status(f"Watching {name}, {new} new row(s) on the last refresh", "success")
+    except QueryCancelledError:
+        frontend.update_connection_info(table.rows, "connected")
+        frontend.update_status(f"Stopped {'streaming' if live else 'watching'} {name}", "info")
+    return summary
+
+
+async def export_to_file(query: str, outfile: str, head: list[str]) -> dict:
+    """Stream the rows of an INTO OUTFILE query into a download, without putting them in the table.
+
+    `head` is the columns the query selects, checked against the format before a file is picked.
+    """
+    exporter_type = exporter_for(outfile)
+    exporter_type.check(head)
+    # the save dialog has to open while the click that ran the query still counts as recent
+    sink = await DownloadSink.open(outfile, exporter_type.media_type)
+    if sink is None:
+        frontend.update_status("Export cancelled", "warning")
+        return {}
+    if exporter_type is ParquetExporter:
+        frontend.update_status("Loading Parquet support", "info")
+
+    message = None
+    try:
+        async for message in window.session.query(query):
+            if message["type"] == "chunk":
+                await sink.write(message["data"])
+    finally:
+        await sink.close()
+    summary = final_message(message)
+    frontend.show_empty_table()
+    frontend.update_connection_info(summary["rows"], "exported")
+    frontend.update_status(f"Exported {summary['rows']} row(s) from {summary['table']} to {outfile}", "success")
+    return summary
+
+
+def cancel_query(_: Event) -> None:
+    """Stop the running query, keeping the rows it has already shown."""
+    cancel_queries()
 
-        if field_tokens:
-            body.append({j: d.get(j.lower(), "") for j in head})
-        else:
-            body.append(d)
-            [head.append(k) for k in d if k not in head]
 
-    update_table(head, body)
-    frontend.update_status(f"Data successfully retrieved from {table}", "success")
-    return val
+def page_visibility(_: Event) -> None:
+    """Hold WATCH refreshes while the page is hidden, catching up once it's shown again."""
+    set_hidden(hidden=document.hidden)
 
 
 async def check_query_input(_: Event) -> None:
@@ -350,8 +264,7 @@ async def check_query_input(_: Event) -> None:
 
 def check_query(tree: Tree) -> bool:
     """Check a given query and update the status bar."""
-    errors = []
-    _check_query(tree, errors)
+    errors = syntax_errors(tree)
     if errors:
         frontend.update_status("\n".join(errors), "error")
         return False
@@ -359,16 +272,32 @@ def check_query(tree: Tree) -> bool:
     return True
 
 
-def _check_query(tree: Tree, errors: list[str]) -> None:
-    """Check a given query recursively."""
-    errors.extend([f"- {error}" for error in tree.errors])
-    if isinstance(tree, Parent):
-        for child in tree.children:
-            _check_query(child, errors)
-    if tree.kind is ParentKind.ERROR_TREE:
-        errors.append("- large error")
-
-
 EXECUTE_BUTTON.addEventListener("click", create_proxy(parse_input))
 CLEAR_BUTTON.addEventListener("click", create_proxy(clear_interface))
+CANCEL_BUTTON.addEventListener("click", create_proxy(cancel_query))
+PERF_BUTTON.addEventListener("click", create_proxy(toggle_perf_hud))
+TRACE_BUTTON.addEventListener("click", create_proxy(export_trace))
 QUERY_INPUT.addEventListener("keydown", create_proxy(check_query_input))
+document.addEventListener("visibilitychange", create_proxy(page_visibility))
+
+
+class _SilentSession:
+    """A session whose queries end without a reply, like one whose worker died."""
+
+    async def query(self, _query: str) -> AsyncIterator[dict]:
+        return
+        yield
+
+
+def test_no_done_message(monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that a query ending without its done message raises a QueryError rather than a NameError."""
+    import asyncio  # noqa: PLC0415 Only the test runs a query to the end
+
+    import pytest  # noqa: PLC0415 Only the tests need pytest
+
+    monkeypatch.setattr(window, "session", _SilentSession(), raising=False)
+    with pytest.raises(QueryError, match="stopped before the query finished"):
+        asyncio.run(run_query("SELECT * FROM timeline", analyze=False))
+    with pytest.raises(QueryError, match="stopped before the query finished"):
+        final_message({"type": "page", "head": [], "rows": []})
+    assert final_message({"type": "done", "rows": 0})["rows"] == 0
@@ -23,10 +23,28 @@ class TokenKind(Enum):
     """What the token represents."""
 
     # keywords
+    EXPLAIN = auto()
+    ANALYZE = auto()
     SELECT = auto()
     FROM = auto()
+    JOIN = auto()
+    ON = auto()
     WHERE = auto()
+    GROUP = auto()
+    ORDER = auto()
+    BY = auto()
+    ASC = auto()
+    DESC = auto()
     LIMIT = auto()
+    INTO = auto()
+    OUTFILE = auto()
+    CREATE = auto()
+    TEMP = auto()
+    TABLE = auto()
+    AS = auto()
+    DROP = auto()
+    REFRESH = auto()
+    WATCH = auto()
 
     # literals
     STRING = auto()
@@ -39,19 +57,45 @@ class TokenKind(Enum):
     AND = auto()
     GT = auto()
     LT = auto()
+    IN = auto()
+    LIKE = auto()
+    MATCH = auto()
 
     # structure
     COMMA = auto()
+    LPAREN = auto()
+    RPAREN = auto()
     ERROR = auto()
     EOF = auto()  # this is a fake token only made and used in the parser
 
 
 KEYWORDS = {
+    "EXPLAIN": TokenKind.EXPLAIN,
+    "ANALYZE": TokenKind.ANALYZE,
     "SELECT": TokenKind.SELECT,
     "FROM": TokenKind.FROM,
+    "JOIN": TokenKind.JOIN,
+    "ON": TokenKind.ON,
     "WHERE": TokenKind.WHERE,
     "AND": TokenKind.AND,
+    "IN": TokenKind.IN,
+    "LIKE": TokenKind.LIKE,
+    "MATCH": TokenKind.MATCH,
+    "GROUP": TokenKind.GROUP,
+    "ORDER": TokenKind.ORDER,
+    "BY": TokenKind.BY,
+    "ASC": TokenKind.ASC,
+    "DESC": TokenKind.DESC,
     "LIMIT": TokenKind.LIMIT,
+    "INTO": TokenKind.INTO,
+    "OUTFILE": TokenKind.OUTFILE,
+    "CREATE": TokenKind.CREATE,
+    "TEMP": TokenKind.TEMP,
+    "TABLE": TokenKind.TABLE,
+    "AS": TokenKind.AS,
+    "DROP": TokenKind.DROP,
+    "REFRESH": TokenKind.REFRESH,
+    "WATCH": TokenKind.WATCH,
 }
 
 
@@ -74,7 +118,7 @@ class Cursor:
         return c
 
 
-def tokenize(query: str) -> list[Token]:  # noqa: PLR0912, C901
+def tokenize(query: str) -> list[Token]:  # noqa: PLR0912, PLR0915, C901
     """Turn a query into a list of tokens."""
     result = []
 
@@ -116,6 +160,12 @@ def tokenize(query: str) -> list[Token]:  # noqa: PLR0912, C901
         elif char == "*":
             result.append(Token(TokenKind.STAR, "*", idx, cursor.index))
 
+        elif char == "(":
+            result.append(Token(TokenKind.LPAREN, "(", idx, cursor.index))
+
+        elif char == ")":
+            result.append(Token(TokenKind.RPAREN, ")", idx, cursor.index))
+
         elif char == "'":
             # idk escaping rules in SQL lol
             char = cursor.peek()
@@ -220,16 +270,26 @@ class Parent:
 class ParentKind(Enum):
     """Kinds of syntax tree elements that have children."""
 
+    EXPLAIN_STMT = auto()
+    CREATE_STMT = auto()
+    DROP_STMT = auto()
     SELECT_STMT = auto()
     ERROR_TREE = auto()
     FIELD_LIST = auto()
     FROM_CLAUSE = auto()
+    JOIN_CLAUSE = auto()
     WHERE_CLAUSE = auto()
+    GROUP_CLAUSE = auto()
+    ORDER_CLAUSE = auto()
     LIMIT_CLAUSE = auto()
+    WATCH_CLAUSE = auto()
+    INTO_CLAUSE = auto()
     EXPR_NAME = auto()
     EXPR_STRING = auto()
     EXPR_INTEGER = auto()
     EXPR_BINARY = auto()
+    EXPR_CALL = auto()
+    EXPR_LIST = auto()
     FILE = auto()
 
 
@@ -281,12 +341,54 @@ def parse(tokens: list[Token]) -> Tree:
 
 # free parser functions
 def _parse_stmt(parser: Parser) -> None:
-    # <select_stmt>
+    # <explain_stmt> | <create_stmt> | <drop_stmt> | <select_stmt>
+    if parser.at(TokenKind.EXPLAIN):
+        _parse_explain_stmt(parser)
+    elif parser.at(TokenKind.CREATE):
+        _parse_create_stmt(parser)
+    elif parser.at(TokenKind.DROP):
+        _parse_drop_stmt(parser)
+    else:
+        _parse_select_stmt(parser)
+
+
+def _parse_explain_stmt(parser: Parser) -> None:
+    # 'EXPLAIN' [ 'ANALYZE' ] <select_stmt>
+    start = parser.open()
+    parser.advance()
+    if parser.at(TokenKind.ANALYZE):
+        parser.advance()
+
     _parse_select_stmt(parser)
+    parser.close(ParentKind.EXPLAIN_STMT, start)
+
+
+def _parse_create_stmt(parser: Parser) -> None:
+    # 'CREATE' 'TEMP' 'TABLE' IDENTIFIER 'AS' <select_stmt>
+    start = parser.open()
+    parser.advance()
+    parser.expect(TokenKind.TEMP, "only CREATE TEMP TABLE is supported")
+    parser.expect(TokenKind.TABLE, "expected TABLE after TEMP")
+    parser.expect(TokenKind.IDENTIFIER, "expected a name for the table")
+    parser.expect(TokenKind.AS, "expected AS before the SELECT")
+
+    _parse_select_stmt(parser)
+    parser.close(ParentKind.CREATE_STMT, start)
+
+
+def _parse_drop_stmt(parser: Parser) -> None:
+    # 'DROP' 'TABLE' IDENTIFIER
+    start = parser.open()
+    parser.advance()
+    parser.expect(TokenKind.TABLE, "expected TABLE after DROP")
+    parser.expect(TokenKind.IDENTIFIER, "expected the table to drop")
+    parser.close(ParentKind.DROP_STMT, start)
 
 
 def _parse_select_stmt(parser: Parser) -> None:
-    # 'SELECT' <field> [ ',' <field> ]* [ 'FROM' IDENTIFIER ] [ 'WHERE' <expr> ]
+    # 'SELECT' <field> [ ',' <field> ]* [ 'FROM' IDENTIFIER [ 'JOIN' IDENTIFIER 'ON' <expr> ] ] [ 'WHERE' <expr> ]
+    # [ 'GROUP' 'BY' <expr> [ ',' <expr> ]* ] [ 'ORDER' 'BY' <expr> [ 'ASC' | 'DESC' ] ] [ 'LIMIT' INTEGER ]
+    # [ 'REFRESH' ] [ 'WATCH' INTEGER ] [ 'INTO' 'OUTFILE' STRING ]
     start = parser.open()
     parser.expect(TokenKind.SELECT, "only SELECT is supported")
 
@@ -298,12 +400,7 @@ def _parse_select_stmt(parser: Parser) -> None:
     parser.close(ParentKind.FIELD_LIST, fields_start)
 
     if parser.at(TokenKind.FROM):
-        # from clause
-        from_start = parser.open()
-        parser.advance()
-
-        parser.expect(TokenKind.IDENTIFIER, "expected to select from a table")
-        parser.close(ParentKind.FROM_CLAUSE, from_start)
+        _parse_from_clause(parser)
 
     if parser.at(TokenKind.WHERE):
         # where clause
@@ -313,13 +410,72 @@ def _parse_select_stmt(parser: Parser) -> None:
         _parse_expr(parser)
         parser.close(ParentKind.WHERE_CLAUSE, where_start)
 
+    if parser.at(TokenKind.GROUP):
+        group_start = parser.open()
+        parser.advance()
+        parser.expect(TokenKind.BY, "expected BY after GROUP")
+
+        _parse_expr(parser)
+        while parser.at(TokenKind.COMMA):
+            parser.advance()
+            _parse_expr(parser)
+        parser.close(ParentKind.GROUP_CLAUSE, group_start)
+
+    if parser.at(TokenKind.ORDER):
+        order_start = parser.open()
+        parser.advance()
+        parser.expect(TokenKind.BY, "expected BY after ORDER")
+
+        _parse_expr(parser)
+        if parser.at(TokenKind.ASC) or parser.at(TokenKind.DESC):
+            parser.advance()
+        parser.close(ParentKind.ORDER_CLAUSE, order_start)
+
+    _parse_output_clauses(parser)
+    parser.close(ParentKind.SELECT_STMT, start)
+
+
+def _parse_output_clauses(parser: Parser) -> None:
+    # [ 'LIMIT' INTEGER ] [ 'REFRESH' ] [ 'WATCH' INTEGER ] [ 'INTO' 'OUTFILE' STRING ]
     if parser.at(TokenKind.LIMIT):
         limit_start = parser.open()
         parser.advance()
         parser.expect(TokenKind.INTEGER, "expected an integer")
         parser.close(ParentKind.LIMIT_CLAUSE, limit_start)
 
-    parser.close(ParentKind.SELECT_STMT, start)
+    if parser.at(TokenKind.REFRESH):
+        parser.advance()
+
+    if parser.at(TokenKind.WATCH):
+        watch_start = parser.open()
+        parser.advance()
+        parser.expect(TokenKind.INTEGER, "expected the seconds between refreshes")
+        parser.close(ParentKind.WATCH_CLAUSE, watch_start)
+
+    if parser.at(TokenKind.INTO):
+        into_start = parser.open()
+        parser.advance()
+        parser.expect(TokenKind.OUTFILE, "expected OUTFILE after INTO")
+        parser.expect(TokenKind.STRING, "expected a file name")
+        parser.close(ParentKind.INTO_CLAUSE, into_start)
+
+
+def _parse_from_clause(parser: Parser) -> None:
+    # 'FROM' IDENTIFIER [ 'JOIN' IDENTIFIER 'ON' <expr> ]
+    from_start = parser.open()
+    parser.advance()
+
+    parser.expect(TokenKind.IDENTIFIER, "expected to select from a table")
+    parser.close(ParentKind.FROM_CLAUSE, from_start)
+
+    if parser.at(TokenKind.JOIN):
+        join_start = parser.open()
+        parser.advance()
+
+        parser.expect(TokenKind.IDENTIFIER, "expected a table to join")
+        parser.expect(TokenKind.ON, "expected ON after the joined table")
+        _parse_expr(parser)
+        parser.close(ParentKind.JOIN_CLAUSE, join_start)
 
 
 def _parse_field(parser: Parser) -> None:
@@ -354,11 +510,17 @@ def _parse_expr_inner(parser: Parser, left_op: TokenKind) -> None:
 
 
 def _parse_small_expr(parser: Parser) -> int:
-    # IDENTIFIER
+    # IDENTIFIER | IDENTIFIER '(' ( '*' | <expr> ) ')' | STRING | INTEGER | '(' <expr> [ ',' <expr> ]* ')'
     # TODO: it looks like this parser.open() is unnecessary
     start = parser.open()
     if parser.at(TokenKind.IDENTIFIER):
         parser.advance()
+        if parser.at(TokenKind.LPAREN):
+            # function call, like COUNT(*)
+            parser.advance()
+            _parse_field(parser)
+            parser.expect(TokenKind.RPAREN, "expected ')'")
+            return parser.close(ParentKind.EXPR_CALL, start)
         return parser.close(ParentKind.EXPR_NAME, start)
     if parser.at(TokenKind.STRING):
         parser.advance()
@@ -366,11 +528,23 @@ def _parse_small_expr(parser: Parser) -> int:
     if parser.at(TokenKind.INTEGER):
         parser.advance()
         return parser.close(ParentKind.EXPR_INTEGER, start)
+    if parser.at(TokenKind.LPAREN):
+        # list of values, like the right of `actor IN ('a', 'b')`
+        parser.advance()
+        _parse_expr(parser)
+        while parser.at(TokenKind.COMMA):
+            parser.advance()
+            _parse_expr(parser)
+        parser.expect(TokenKind.RPAREN, "expected ')'")
+        return parser.close(ParentKind.EXPR_LIST, start)
     parser.advance_with_error("expected expression")
     return parser.close(ParentKind.ERROR_TREE, start)
 
 
-TABLE = [[TokenKind.AND], [TokenKind.EQUALS, TokenKind.GT, TokenKind.LT]]
+TABLE = [
+    [TokenKind.AND],
+    [TokenKind.EQUALS, TokenKind.GT, TokenKind.LT, TokenKind.IN, TokenKind.LIKE, TokenKind.MATCH],
+]
 
 
 def right_goes_first(left: TokenKind, right: TokenKind) -> bool:
@@ -459,9 +633,32 @@ def test_simple_tokens() -> None:
     check_tok("FROM", TokenKind.FROM)
     check_tok("WHERE", TokenKind.WHERE)
     check_tok("AND", TokenKind.AND)
+    check_tok("EXPLAIN", TokenKind.EXPLAIN)
+    check_tok("ANALYZE", TokenKind.ANALYZE)
+    check_tok("ORDER", TokenKind.ORDER)
+    check_tok("BY", TokenKind.BY)
+    check_tok("ASC", TokenKind.ASC)
+    check_tok("DESC", TokenKind.DESC)
     check_tok("'hello :)'", TokenKind.STRING)
     check_tok("12345", TokenKind.INTEGER)
     check_tok(",", TokenKind.COMMA)
+    check_tok("(", TokenKind.LPAREN)
+    check_tok(")", TokenKind.RPAREN)
+    check_tok("GROUP", TokenKind.GROUP)
+    check_tok("JOIN", TokenKind.JOIN)
+    check_tok("ON", TokenKind.ON)
+    check_tok("IN", TokenKind.IN)
+    check_tok("LIKE", TokenKind.LIKE)
+    check_tok("MATCH", TokenKind.MATCH)
+    check_tok("CREATE", TokenKind.CREATE)
+    check_tok("TEMP", TokenKind.TEMP)
+    check_tok("TABLE", TokenKind.TABLE)
+    check_tok("AS", TokenKind.AS)
+    check_tok("DROP", TokenKind.DROP)
+    check_tok("REFRESH", TokenKind.REFRESH)
+    check_tok("WATCH", TokenKind.WATCH)
+    check_tok("INTO", TokenKind.INTO)
+    check_tok("OUTFILE", TokenKind.OUTFILE)
     check_tok("*", TokenKind.STAR)
     check_tok("username", TokenKind.IDENTIFIER)
     check_tok("username_b", TokenKind.IDENTIFIER)
@@ -551,6 +748,316 @@ def test_parse_simple() -> None:
     )
 
 
+def test_parse_explain() -> None:
+    """Tests that EXPLAIN wraps a select statement."""
+    assert (
+        stringify_tree(parse(tokenize("EXPLAIN ANALYZE SELECT * FROM timeline")))
+        == textwrap.dedent("""
+        FILE
+            EXPLAIN_STMT
+                EXPLAIN ("EXPLAIN")
+                ANALYZE ("ANALYZE")
+                SELECT_STMT
+                    SELECT ("SELECT")
+                    FIELD_LIST
+                        STAR ("*")
+                    FROM_CLAUSE
+                        FROM ("FROM")
+                        IDENTIFIER ("timeline")
+            """).strip()
+    )
+
+    assert (
+        stringify_tree(parse(tokenize("EXPLAIN SELECT 4")))
+        == textwrap.dedent("""
+        FILE
+            EXPLAIN_STMT
+                EXPLAIN ("EXPLAIN")
+                SELECT_STMT
+                    SELECT ("SELECT")
+                    FIELD_LIST
+                        EXPR_INTEGER
+                            INTEGER ("4")
+            """).strip()
+    )
+
+
+def test_parse_order_by() -> None:
+    """Tests that ORDER BY sits between the WHERE and LIMIT clauses."""
+    assert (
+        stringify_tree(parse(tokenize("SELECT * WHERE author = 'a' ORDER BY post_likecount DESC LIMIT 10")))
+        == textwrap.dedent("""
+        FILE
+            SELECT_STMT
+                SELECT ("SELECT")
+                FIELD_LIST
+                    STAR ("*")
+                WHERE_CLAUSE
+                    WHERE ("WHERE")
+                    EXPR_BINARY
+                        EXPR_NAME
+                            IDENTIFIER ("author")
+                        EQUALS ("=")
+                        EXPR_STRING
+                            STRING ("'a'")
+                ORDER_CLAUSE
+                    ORDER ("ORDER")
+                    BY ("BY")
+                    EXPR_NAME
+                        IDENTIFIER ("post_likecount")
+                    DESC ("DESC")
+                LIMIT_CLAUSE
+                    LIMIT ("LIMIT")
+                    INTEGER ("10")
+            """).strip()
+    )
+
+    assert (
+        stringify_tree(parse(tokenize("SELECT * ORDER BY handle")))
+        == textwrap.dedent("""
+        FILE
+            SELECT_STMT
+                SELECT ("SELECT")
+                FIELD_LIST
+                    STAR ("*")
+                ORDER_CLAUSE
+                    ORDER ("ORDER")
+                    BY ("BY")
+                    EXPR_NAME
+                        IDENTIFIER ("handle")
+            """).strip()
+    )
+
+
+def test_parse_group_by() -> None:
+    """Tests that aggregate calls and GROUP BY parse."""
+    assert (
+        stringify_tree(parse(tokenize("SELECT handle, COUNT(*), SUM(likes) GROUP BY handle ORDER BY COUNT(*) DESC")))
+        == textwrap.dedent("""
+        FILE
+            SELECT_STMT
+                SELECT ("SELECT")
+                FIELD_LIST
+                    EXPR_NAME
+                        IDENTIFIER ("handle")
+                    COMMA (",")
+                    EXPR_CALL
+                        IDENTIFIER ("COUNT")
+                        LPAREN ("(")
+                        STAR ("*")
+                        RPAREN (")")
+                    COMMA (",")
+                    EXPR_CALL
+                        IDENTIFIER ("SUM")
+                        LPAREN ("(")
+                        EXPR_NAME
+                            IDENTIFIER ("likes")
+                        RPAREN (")")
+                GROUP_CLAUSE
+                    GROUP ("GROUP")
+                    BY ("BY")
+                    EXPR_NAME
+                        IDENTIFIER ("handle")
+                ORDER_CLAUSE
+                    ORDER ("ORDER")
+                    BY ("BY")
+                    EXPR_CALL
+                        IDENTIFIER ("COUNT")
+                        LPAREN ("(")
+                        STAR ("*")
+                        RPAREN (")")
+                    DESC ("DESC")
+            """).strip()
+    )
+
+
+def test_parse_join() -> None:
+    """Tests that a JOIN follows the FROM clause."""
+    assert (
+        stringify_tree(parse(tokenize("SELECT * FROM followers JOIN profile ON followers.did = profile.did")))
+        == textwrap.dedent("""
+        FILE
+            SELECT_STMT
+                SELECT ("SELECT")
+                FIELD_LIST
+                    STAR ("*")
+                FROM_CLAUSE
+                    FROM ("FROM")
+                    IDENTIFIER ("followers")
+                JOIN_CLAUSE
+                    JOIN ("JOIN")
+                    IDENTIFIER ("profile")
+                    ON ("ON")
+                    EXPR_BINARY
+                        EXPR_NAME
+                            IDENTIFIER ("followers.did")
+                        EQUALS ("=")
+                        EXPR_NAME
+                            IDENTIFIER ("profile.did")
+            """).strip()
+    )
+
+
+def test_parse_in_list() -> None:
+    """Tests that IN takes a parenthesised list of values."""
+    assert (
+        stringify_tree(parse(tokenize("SELECT * FROM profile WHERE actor IN ('a', 'b')")))
+        == textwrap.dedent("""
+        FILE
+            SELECT_STMT
+                SELECT ("SELECT")
+                FIELD_LIST
+                    STAR ("*")
+                FROM_CLAUSE
+                    FROM ("FROM")
+                    IDENTIFIER ("profile")
+                WHERE_CLAUSE
+                    WHERE ("WHERE")
+                    EXPR_BINARY
+                        EXPR_NAME
+                            IDENTIFIER ("actor")
+                        IN ("IN")
+                        EXPR_LIST
+                            LPAREN ("(")
+                            EXPR_STRING
+                                STRING ("'a'")
+                            COMMA (",")
+                            EXPR_STRING
+                                STRING ("'b'")
+                            RPAREN (")")
+            """).strip()
+    )
+
+
+def test_parse_like_match() -> None:
+    """Tests that LIKE and MATCH compare like `=`, binding tighter than AND."""
+    assert (
+        stringify_tree(parse(tokenize("SELECT * FROM posts WHERE text LIKE '%cat%' AND text MATCH 'dog'")))
+        == textwrap.dedent("""
+        FILE
+            SELECT_STMT
+                SELECT ("SELECT")
+                FIELD_LIST
+                    STAR ("*")
+                FROM_CLAUSE
+                    FROM ("FROM")
+                    IDENTIFIER ("posts")
+                WHERE_CLAUSE
+                    WHERE ("WHERE")
+                    EXPR_BINARY
+                        EXPR_BINARY
+                            EXPR_NAME
+                                IDENTIFIER ("text")
+                            LIKE ("LIKE")
+                            EXPR_STRING
+                                STRING ("'%cat%'")
+                        AND ("AND")
+                        EXPR_BINARY
+                            EXPR_NAME
+                                IDENTIFIER ("text")
+                            MATCH ("MATCH")
+                            EXPR_STRING
+                                STRING ("'dog'")
+            """).strip()
+    )
+
+
+def test_parse_into_outfile() -> None:
+    """Tests that INTO OUTFILE comes after the rest of the query."""
+    assert (
+        stringify_tree(parse(tokenize("SELECT * FROM feed LIMIT 5 INTO OUTFILE 'posts.csv'")))
+        == textwrap.dedent("""
+        FILE
+            SELECT_STMT
+                SELECT ("SELECT")
+                FIELD_LIST
+                    STAR ("*")
+                FROM_CLAUSE
+                    FROM ("FROM")
+                    IDENTIFIER ("feed")
+                LIMIT_CLAUSE
+                    LIMIT ("LIMIT")
+                    INTEGER ("5")
+                INTO_CLAUSE
+                    INTO ("INTO")
+                    OUTFILE ("OUTFILE")
+                    STRING ("'posts.csv'")
+            """).strip()
+    )
+
+
+def test_parse_create_drop() -> None:
+    """Tests that CREATE TEMP TABLE wraps a SELECT and DROP TABLE takes a name."""
+    assert (
+        stringify_tree(parse(tokenize("CREATE TEMP TABLE fans AS SELECT handle FROM followers DROP TABLE fans")))
+        == textwrap.dedent("""
+        FILE
+            CREATE_STMT
+                CREATE ("CREATE")
+                TEMP ("TEMP")
+                TABLE ("TABLE")
+                IDENTIFIER ("fans")
+                AS ("AS")
+                SELECT_STMT
+                    SELECT ("SELECT")
+                    FIELD_LIST
+                        EXPR_NAME
+                            IDENTIFIER ("handle")
+                    FROM_CLAUSE
+                        FROM ("FROM")
+                        IDENTIFIER ("followers")
+            DROP_STMT
+                DROP ("DROP")
+                TABLE ("TABLE")
+                IDENTIFIER ("fans")
+            """).strip()
+    )
+
+
+def test_parse_refresh() -> None:
+    """Tests that REFRESH goes after the LIMIT, as a bare keyword of the SELECT."""
+    assert (
+        stringify_tree(parse(tokenize("SELECT * FROM timeline LIMIT 5 REFRESH")))
+        == textwrap.dedent("""
+        FILE
+            SELECT_STMT
+                SELECT ("SELECT")
+                FIELD_LIST
+                    STAR ("*")
+                FROM_CLAUSE
+                    FROM ("FROM")
+                    IDENTIFIER ("timeline")
+                LIMIT_CLAUSE
+                    LIMIT ("LIMIT")
+                    INTEGER ("5")
+                REFRESH ("REFRESH")
+            """).strip()
+    )
+
+
+def test_parse_watch() -> None:
+    """Tests that WATCH takes the seconds between refreshes, after any LIMIT."""
+    assert (
+        stringify_tree(parse(tokenize("SELECT * FROM timeline LIMIT 5 WATCH 30")))
+        == textwrap.dedent("""
+        FILE
+            SELECT_STMT
+                SELECT ("SELECT")
+                FIELD_LIST
+                    STAR ("*")
+                FROM_CLAUSE
+                    FROM ("FROM")
+                    IDENTIFIER ("timeline")
+                LIMIT_CLAUSE
+                    LIMIT ("LIMIT")
+                    INTEGER ("5")
+                WATCH_CLAUSE
+                    WATCH ("WATCH")
+                    INTEGER ("30")
+            """).strip()
+    )
+
+
 if __name__ == "__main__":
     query = input("query> ")
     print(stringify_tokens(query))
@@ -0,0 +1,204 @@
+"""The scheduler that re-runs WATCH queries, refreshing each source they read once for all of them.
+
+A watched source is refreshed through its feed cache as often as the most eager query watching it asks, and
+the posts that are new go through the operators of every query watching it, so several queries over one
+timeline cost one call a refresh. Sources due within a second of each other are refreshed together. Nothing
+is refreshed while the page is hidden, or while the API's rate limit is nearly used up. A refresh that fails is
+reported to the queries watching, which carry on, and the source is tried again when it's next due.
+"""
+
+import asyncio
+import contextlib
+import time
+from collections import Counter
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from typing import Any
+
+import feed_cache
+from executor import Plan, QueryError, compile_query, execute
+from feed_cache import Key
+
+COALESCE_SECONDS = 1.0  # Sources due this soon after one that's due are refreshed along with it
+RATE_RESERVE = 10  # Requests of the rate limit window that refreshes leave for the queries run by hand
+
+
+@dataclass
+class Watch:
+    """A WATCH query, and the new posts of its source waiting to go through its operators, or why a refresh failed."""
+
+    query: str
+    seconds: int
+    session: Any
+    queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+
+
+@dataclass
+class Source:
+    """A source of posts, refreshed for every query watching it."""
+
+    watches: list[Watch]
+    due: float  # When to refresh it next, in time.monotonic() seconds
+
+    @property
+    def seconds(self) -> int:
+        """Get the shortest wait any of the queries watching it asked for."""
+        return min(watch.seconds for watch in self.watches)
+
+
+class Scheduler:
+    """Refresh every watched source when it's due, from one task that runs while there are any."""
+
+    def __init__(self) -> None:
+        self.sources: dict[Key, Source] = {}
+        self.hidden = False
+        self.task: asyncio.Task | None = None
+        self.wake: asyncio.Event | None = None  # Set to look at the sources again, made in the task's loop
+
+    def add(self, key: Key, watch: Watch) -> None:
+        """Start refreshing the source a watch reads, unless another watch already has it refreshed."""
+        source = self.sources.get(key)
+        if source is None:
+            self.sources[key] = Source([watch], time.monotonic() + watch.seconds)
+        else:
+            source.watches.append(watch)
+            source.due = min(source.due, time.monotonic() + watch.seconds)
+        if self.task is None or self.task.done():
+            self.wake = asyncio.Event()
+            self.task = asyncio.ensure_future(self._run())
+        self.wake.set()
+
+    def remove(self, key: Key, watch: Watch) -> None:
+        """Stop refreshing a watch's source for it, and altogether if nothing else watches it."""
+        source = self.sources[key]
+        source.watches.remove(watch)
+        if not source.watches:
+            del self.sources[key]
+        self.wake.set()
+
+    def set_hidden(self, *, hidden: bool) -> None:
+        """Hold the refreshes while the page is hidden, catching up on those due once it's shown again."""
+        self.hidden = hidden
+        if self.wake is not None:
+            self.wake.set()
+
+    async def _run(self) -> None:
+        while self.sources:
+            self.wake.clear()
+            now = time.monotonic()
+            first = min(source.due for source in self.sources.values())
+            if self.hidden or first > now:
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(self.wake.wait(), None if self.hidden else first - now)
+                continue
+
+            due = {key: source for key, source in self.sources.items() if source.due <= now + COALESCE_SECONDS}
+            delay = max(source.watches[0].session.client.rate_limit.delay(RATE_RESERVE) for source in due.values())
+            if delay:
+                for source in due.values():
+                    source.due = now + delay
+                continue
+            await asyncio.gather(*(self._refresh(source) for source in due.values()))
+
+    async def _refresh(self, source: Source) -> None:
+        source.due = time.monotonic() + source.seconds
+        watches = list(source.watches)
+        try:
+            scan = compile_query(watches[0].query).source
+            new = await scan.refresh(watches[0].session)
+        except QueryError as e:
+            new = f"refresh failed, {e}"
+        except Exception as e:  # noqa: BLE001 Reported to the watches, which carry on until the next refresh
+            new = f"refresh failed, {type(e).__name__}: {e}"
+        for watch in watches:
+            watch.queue.put_nowait(new)
+
+
+SCHEDULER = Scheduler()
+
+
+async def follow(query: str, plan: Plan, session: Any) -> AsyncIterator[tuple[Plan, list[dict]] | str]:  # noqa: ANN401
+    """Yield the rows each refresh of a WATCH query's source adds, with the plan that made them, until closed.
+
+    A refresh that failed yields a message saying why instead, and the watch goes on to the next one. `plan` is
+    the query's first run, which filled the feed cache the refreshes carry on from.
+    """
+    watch = Watch(query, plan.watch, session)
+    key = plan.source.key
+    SCHEDULER.add(key, watch)
+    try:
+        while True:
+            new = await watch.queue.get()
+            if isinstance(new, str):
+                yield new
+                continue
+            # a fresh plan each time, so the operators count and limit only this refresh's rows
+            refresh = compile_query(query)
+            refresh.source.pending = new
+            yield refresh, await execute(refresh, session)
+    finally:
+        SCHEDULER.remove(key, watch)
+
+
+class _FakeClient:
+    def __init__(self) -> None:
+        self.stats = Counter()
+
+
+class _FakeTimeline:
+    """A session whose timeline is the posts in `posts`, newest first."""
+
+    def __init__(self, posts: int) -> None:
+        self.client = _FakeClient()
+        self.posts = [{"post": {"uri": f"at://post/{i}"}} for i in reversed(range(posts))]
+        self.limits = []
+        self.error: Exception | None = None  # Raised by the next call instead of answering it
+
+    async def get_timeline(self, limit: int, cursor: str | None) -> dict:
+        self.limits.append(limit)
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        start = int(cursor or 0)
+        end = min(start + limit, len(self.posts))
+        return {"feed": self.posts[start:end], "cursor": str(end) if end < len(self.posts) else None}
+
+
+def test_refresh() -> None:
+    """Tests that a refresh fetches a source once for every watch of it, handing each only the new posts."""
+    feed_cache.clear()
+    session = _FakeTimeline(10)
+    query = "SELECT post_uri FROM timeline WATCH 5"
+
+    async def run() -> None:
+        rows = await execute(compile_query(query), session)
+        assert rows == [{"post_uri": f"at://post/{i}"} for i in reversed(range(10))]
+        session.posts.insert(0, {"post": {"uri": "at://post/new"}})
+        source = Source([Watch(query, 10, session), Watch(query, 5, session)], 0)
+        await Scheduler()._refresh(source)  # noqa: SLF001
+        assert session.limits == [50, 50]
+        assert source.due > time.monotonic() + 4
+        for watch in source.watches:
+            assert watch.queue.get_nowait() == [{"post": {"uri": "at://post/new"}}]
+
+    asyncio.run(run())
+
+
+def test_refresh_failed() -> None:
+    """Tests that a failed refresh is reported to the watches as a message, and the next refresh carries on."""
+    feed_cache.clear()
+    session = _FakeTimeline(3)
+    query = "SELECT post_uri FROM timeline WATCH 5"
+
+    async def run() -> None:
+        await execute(compile_query(query), session)
+        source = Source([Watch(query, 5, session)], 0)
+        session.error = ConnectionResetError("connection reset")
+        await Scheduler()._refresh(source)  # noqa: SLF001
+        assert source.watches[0].queue.get_nowait() == "refresh failed, ConnectionResetError: connection reset"
+
+        session.posts.insert(0, {"post": {"uri": "at://post/new"}})
+        await Scheduler()._refresh(source)  # noqa: SLF001
+        assert source.watches[0].queue.get_nowait() == [{"post": {"uri": "at://post/new"}}]
+
+    asyncio.run(run())
@@ -1,34 +1,179 @@
 """The Setup Script for pyodide."""
 
+import asyncio
+import hashlib
+import json
+import time
+import zipfile
+from io import BytesIO
 from pathlib import Path
+from urllib.parse import urljoin
 
-import micropip
+import js
 from pyodide.http import pyfetch
 
+# Written by build.py, points at a content-hashed zip of every module
+MANIFEST = "./dist/manifest.json"
 
-async def setup_pyodide_scripts() -> None:
-    """Script to do everything for pyodide."""
-    response = await pyfetch("./core/functions.py")
-    with Path.open("functions.py", "wb") as f:
-        f.write(await response.bytes())
+# (url, file name in the pyodide FS) for every module the app imports, used when there's no bundle
+MODULES = [
+    ("./core/functions.py", "functions.py"),
+    ("./core/engine_worker.py", "engine_worker.py"),
+    ("./core/executor.py", "executor.py"),
+    ("./core/text_index.py", "text_index.py"),
+    ("./core/temp_tables.py", "temp_tables.py"),
+    ("./core/feed_cache.py", "feed_cache.py"),
+    ("./core/scheduler.py", "scheduler.py"),
+    ("./core/export.py", "export.py"),
+    ("./core/ascii_image.py", "ascii_image.py"),
+    ("./core/parser.py", "parser.py"),
+    ("./core/tracing.py", "tracing.py"),
+    ("./ui/image_modal.py", "image_modal.py"),
+    ("./ui/frontend.py", "frontend.py"),
+    ("./api/hydrator.py", "hydrator.py"),
+    ("./api/transport.py", "transport.py"),
+    ("./api/jetstream.py", "jetstream.py"),
+    ("./api/auth_session.py", "auth_session.py"),
+    ("./api/engine_client.py", "engine_client.py"),
+    ("./ui/auth_modal.py", "auth_modal.py"),
+]
 
-    response = await pyfetch("./core/parser.py")
-    with Path.open("parser.py", "wb") as f:
-        f.write(await response.bytes())
+# The part of the boot progress bar the module fetches fill, index.html has already moved it to 50%
+PROGRESS_START = 50
+PROGRESS_END = 85
 
-    response = await pyfetch("./ui/image_modal.py")
-    with Path.open("image_modal.py", "wb") as f:
-        f.write(await response.bytes())
 
-    response = await pyfetch("./ui/frontend.py")
-    with Path.open("frontend.py", "wb") as f:
-        f.write(await response.bytes())
-    await micropip.install("ascii_magic")
+def _record_timing(name: str, ms: float) -> None:
+    """Show how long a step took on the boot screen, which the engine worker doesn't have."""
+    if hasattr(js, "bootProgress"):
+        js.bootProgress.recordTiming(name, ms)
 
-    response = await pyfetch("./api/auth_session.py")
-    with Path.open("auth_session.py", "wb") as f:
-        f.write(await response.bytes())
 
-    response = await pyfetch("./ui/auth_modal.py")
-    with Path.open("auth_modal.py", "wb") as f:
+class _Progress:
+    """Report each finished step of the setup to the boot screen, if there is one."""
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.done = 0
+
+    def step(self, name: str, start: float) -> None:
+        self.done += 1
+        _record_timing(name, (time.perf_counter() - start) * 1000)
+        if hasattr(js, "bootProgress"):
+            js.bootProgress.updateProgress(PROGRESS_START + (PROGRESS_END - PROGRESS_START) * self.done / self.total)
+
+
+async def _fetch_module(url: str, name: str, progress: _Progress) -> None:
+    start = time.perf_counter()
+    response = await pyfetch(url)
+    response.raise_for_status()
+    with Path.open(name, "wb") as f:
         f.write(await response.bytes())
+    progress.step(name, start)
+
+
+async def _load_bundle(base: str) -> bool:
+    """Unpack the bundle from build.py, returning False if there isn't a usable one."""
+    progress = _Progress(2)
+    start = time.perf_counter()
+    # the manifest is always revalidated, the bundle it names never changes so it can come from cache
+    response = await pyfetch(urljoin(base, MANIFEST), cache="no-cache")
+    if not response.ok:
+        return False
+    manifest = await response.json()
+    progress.step("manifest", start)
+
+    start = time.perf_counter()
+    response = await pyfetch(urljoin(base, manifest["bundle"]))
+    if not response.ok:
+        return False
+    data = await response.bytes()
+    if hashlib.sha256(data).hexdigest() != manifest["sha256"]:
+        print(f"[-] {manifest['bundle']} doesn't match the manifest, fetching modules one by one")
+        return False
+    with zipfile.ZipFile(BytesIO(data)) as bundle:
+        bundle.extractall()
+    progress.step("bundle", start)
+    return True
+
+
+async def setup_pyodide_scripts(base: str = "./") -> None:
+    """Script to do everything for pyodide.
+
+    Modules come from the bundle built by build.py when there is one, otherwise every module is fetched at
+    once rather than one after the other. Packages aren't installed here, the image workers load Pillow
+    once images are wanted. `base` is where the page is, the engine worker passes it since
+    relative URLs there are resolved against the worker's script.
+    """
+    start = time.perf_counter()
+    if not await _load_bundle(base):
+        progress = _Progress(len(MODULES))
+        await asyncio.gather(*(_fetch_module(urljoin(base, url), name, progress) for url, name in MODULES))
+    _record_timing("setup", (time.perf_counter() - start) * 1000)
+
+
+class _FakeResponse:
+    """Just enough of pyodide's FetchResponse for the setup."""
+
+    def __init__(self, body: bytes | None) -> None:
+        self.body = body
+        self.ok = body is not None
+
+    def raise_for_status(self) -> None:
+        if not self.ok:
+            raise OSError
+
+    async def bytes(self) -> bytes:
+        return self.body
+
+    async def json(self) -> dict:
+        return json.loads(self.body)
+
+
+def test_fetch_modules(tmp_path: Path, monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that without a bundle every module is fetched at once, and each written under its flat name."""
+    in_flight, most = 0, 0
+
+    async def pyfetch(url: str, **_kwargs: object) -> _FakeResponse:
+        nonlocal in_flight, most
+        if url.endswith("manifest.json"):
+            return _FakeResponse(None)
+        in_flight += 1
+        most = max(most, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        return _FakeResponse(f"# {url}".encode())
+
+    monkeypatch.setitem(globals(), "pyfetch", pyfetch)
+    monkeypatch.chdir(tmp_path)
+    asyncio.run(setup_pyodide_scripts("https://app.test/"))
+    assert most == len(MODULES)
+    assert [(tmp_path / name).read_text() for _, name in MODULES] == [
+        f"# {urljoin('https://app.test/', url)}" for url, _ in MODULES
+    ]
+
+
+def test_load_bundle(tmp_path: Path, monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that the bundle the manifest names is unpacked, and one that doesn't match its hash is refused."""
+    from build import build_bundle  # noqa: PLC0415 Only the tests build a bundle
+
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "parser.py").write_text("PARSED = True\n")
+    bundle = build_bundle({"parser.py": tmp_path / "src" / "parser.py"})
+    manifest = {"bundle": "./dist/modules-x.zip", "sha256": hashlib.sha256(bundle).hexdigest()}
+    files = {"https://app.test/dist/manifest.json": json.dumps(manifest).encode()}
+    fetched = []
+
+    async def pyfetch(url: str, **_kwargs: object) -> _FakeResponse:
+        fetched.append(url)
+        return _FakeResponse(files.get(url))
+
+    monkeypatch.setitem(globals(), "pyfetch", pyfetch)
+    monkeypatch.chdir(tmp_path)
+    files["https://app.test/dist/modules-x.zip"] = bundle
+    assert asyncio.run(_load_bundle("https://app.test/"))
+    assert (tmp_path / "parser.py").read_text() == "PARSED = True\n"
+    assert fetched == ["https://app.test/dist/manifest.json", "https://app.test/dist/modules-x.zip"]
+
+    files["https://app.test/dist/modules-x.zip"] = bundle + b"tampered"
+    assert not asyncio.run(_load_bundle("https://app.test/"))
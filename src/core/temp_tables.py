@@ -0,0 +1,93 @@
+"""Tables materialized by CREATE TEMP TABLE, kept column by column in memory until they're dropped.
+
+Later queries select, filter, join and aggregate them like any other table, without touching the network.
+Each value is counted towards a memory budget shared by every temp table.
+"""
+
+import sys
+from collections.abc import Iterator
+
+TEMP_TABLE_BYTES = 256 * 1024 * 1024  # Memory every temp table together may take
+PAGE_ROWS = 1000  # Rows handed to the operators at a time when a temp table is scanned
+
+_MISSING = object()  # Stands in for a column a row doesn't have
+
+
+class TempTable:
+    """The rows of a query as one list of values per column, with the bytes they take up."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.columns: dict[str, list] = {}
+        self.rows = 0
+        self.bytes = 0  # The lists' pointers and the size of each value they point to
+
+    def append(self, rows: list[dict]) -> None:
+        """Add a batch of rows, starting a column the first time a row has it."""
+        for row in rows:
+            for name in row.keys() - self.columns.keys():
+                self.columns[name] = [_MISSING] * self.rows
+                self.bytes += 8 * self.rows
+            for name, values in self.columns.items():
+                value = row.get(name, _MISSING)
+                values.append(value)
+                self.bytes += 8 if value is _MISSING or value is None else 8 + sys.getsizeof(value)
+            self.rows += 1
+
+    def pages(self, size: int = PAGE_ROWS) -> Iterator[list[dict]]:
+        """Rebuild the rows in pages, leaving out the columns each row didn't have."""
+        names = list(self.columns)
+        for start in range(0, self.rows, size):
+            values = zip(*(column[start : start + size] for column in self.columns.values()), strict=True)
+            yield [
+                {name: value for name, value in zip(names, row, strict=True) if value is not _MISSING}
+                for row in values
+            ]
+
+    def describe(self) -> dict:
+        """Summarize the table as a row of the `tables` list."""
+        return {
+            "table_name": self.name,
+            "rows": self.rows,
+            "columns": len(self.columns),
+            "memory_kb": round(self.bytes / 1024, 1),
+        }
+
+
+_tables: dict[str, TempTable] = {}
+
+
+def get(name: str) -> TempTable | None:
+    """Get a temp table by name."""
+    return _tables.get(name)
+
+
+def tables() -> list[TempTable]:
+    """Get every temp table, oldest first."""
+    return list(_tables.values())
+
+
+def used() -> int:
+    """Get the bytes every temp table takes."""
+    return sum(table.bytes for table in _tables.values())
+
+
+def add(table: TempTable) -> None:
+    """Make a filled temp table available to queries."""
+    _tables[table.name] = table
+
+
+def drop(name: str) -> TempTable | None:
+    """Remove a temp table, freeing its memory, or return None if there's no such table."""
+    return _tables.pop(name, None)
+
+
+def test_columns() -> None:
+    """Tests that rows with different columns come back as they went in, a page at a time."""
+    table = TempTable("t")
+    rows = [{"a": 1}, {"a": 2, "b": None}, {"b": "x"}, {"c": [1, 2]}, {}]
+    table.append(rows[:2])
+    table.append(rows[2:])
+    assert [row for page in table.pages(2) for row in page] == rows
+    assert [len(page) for page in table.pages(2)] == [2, 2, 1]
+    assert table.describe() | {"memory_kb": 0} == {"table_name": "t", "rows": 5, "columns": 3, "memory_kb": 0}
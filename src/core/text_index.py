@@ -0,0 +1,98 @@
+"""Inverted indexes over the text of posts already fetched, so repeated MATCH filters don't refetch them.
+
+A scan filtered with MATCH indexes the words of the matched column as its pages stream in, along with the
+cursor it got to. A later MATCH over the same source reads the rows holding every word from the index,
+and if the first scan stopped early, carries on from its cursor, indexing the new pages too.
+"""
+
+import re
+import time
+from collections import OrderedDict
+
+INDEX_TTL = 300  # Seconds an index is used for before its source is fetched again
+INDEX_LIMIT = 8  # Sources indexed at once, the least recently used is dropped first
+
+# (table, nsid, WHERE value, column) -> the index of that source's rows
+Key = tuple[str, str, str | None, str]
+
+
+def words(text: str) -> list[str]:
+    """Split text into the lowercase words MATCH compares."""
+    return re.findall(r"\w+", text.lower())
+
+
+class TextIndex:
+    """The flattened rows a scan fetched, and for each word of one column, the ids of the rows holding it."""
+
+    def __init__(self, column: str) -> None:
+        self.column = column
+        self.rows: list[dict] = []
+        self.postings: dict[str, list[int]] = {}
+        self.pages = 0
+        self.cursor: str | None = ""  # Where the scan got to, None once it has read every page
+        self.created = time.monotonic()
+        self.busy = False  # Whether a scan is adding to the index right now
+
+    def add(self, rows: list[dict]) -> None:
+        """Index a page of flattened rows, giving each the next id."""
+        for row in rows:
+            row_id = len(self.rows)
+            self.rows.append(row)
+            value = row.get(self.column)
+            for word in set(words(str(value))) if value is not None else ():
+                self.postings.setdefault(word, []).append(row_id)
+
+    def search(self, terms: list[str]) -> list[dict]:
+        """Get the rows whose column holds every term, in the order they were fetched."""
+        if not terms:
+            return list(self.rows)
+        # intersect from the shortest posting list, so rare words narrow things down first
+        postings = sorted((self.postings.get(term, []) for term in set(terms)), key=len)
+        ids = set(postings[0]).intersection(*postings[1:])
+        return [self.rows[row_id] for row_id in sorted(ids)]
+
+    @property
+    def complete(self) -> bool:
+        """Whether the scan read every page there is."""
+        return self.cursor is None
+
+
+_indexes: OrderedDict[Key, TextIndex] = OrderedDict()
+
+
+def lookup(key: Key) -> TextIndex | None:
+    """Get the index of a source, if one was built recently and no scan is adding to it."""
+    index = _indexes.get(key)
+    if index is None or index.busy or not index.pages or time.monotonic() - index.created > INDEX_TTL:
+        return None
+    _indexes.move_to_end(key)
+    return index
+
+
+def build(key: Key) -> TextIndex:
+    """Start a new, empty index of a source, replacing any it had."""
+    index = _indexes[key] = TextIndex(key[3])
+    _indexes.move_to_end(key)
+    while len(_indexes) > INDEX_LIMIT:
+        _indexes.popitem(last=False)
+    return index
+
+
+def clear() -> None:
+    """Drop every index, like when the session changes and the rows it fetched might not be visible."""
+    _indexes.clear()
+
+
+def test_search() -> None:
+    """Tests that a search finds the rows holding every word, in the order they were added."""
+    index = TextIndex("text")
+    index.add([{"text": "Hello, SQL world"}, {"text": None}, {"other": "sql hello"}])
+    index.add([{"text": "sql: hello again"}, {"text": "just sql"}])
+    assert index.search(words("hello SQL")) == [{"text": "Hello, SQL world"}, {"text": "sql: hello again"}]
+    assert index.search(words("sql sql")) == [
+        {"text": "Hello, SQL world"},
+        {"text": "sql: hello again"},
+        {"text": "just sql"},
+    ]
+    assert index.search(words("hello goodbye")) == []
+    assert index.search([]) == index.rows
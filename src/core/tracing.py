@@ -0,0 +1,196 @@
+"""Timing spans for the hot path of a query, kept in a ring buffer and exportable as a Chrome trace."""
+
+import itertools
+import json
+import time
+from collections import Counter, deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, field
+
+SPAN_LIMIT = 4096  # Spans kept, the oldest are dropped first
+QUERY_LIMIT = 64  # Queries kept for their summaries
+
+# The query the running code belongs to, so concurrent queries in cli.py keep their spans apart
+CURRENT_QUERY: ContextVar[int] = ContextVar("query", default=0)
+
+
+@dataclass(slots=True)
+class Span:
+    """A timed step, with `start` and `duration` in seconds on the perf_counter clock."""
+
+    name: str
+    category: str
+    start: float
+    duration: float
+    query: int
+    args: dict = field(default_factory=dict)
+
+
+@dataclass
+class QueryRecord:
+    """One query's text, timing and the session counters it moved."""
+
+    id: int
+    text: str
+    start: float
+    end: float | None = None
+    rows: int = 0
+    stats: Counter = field(default_factory=Counter)
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds from starting the query to finishing it, or until now if it's still running."""
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Tracer:
+    """Collect spans into a bounded buffer, cheap enough to leave on all the time."""
+
+    def __init__(self, limit: int = SPAN_LIMIT) -> None:
+        self.spans: deque[Span] = deque(maxlen=limit)
+        self.queries: deque[QueryRecord] = deque(maxlen=QUERY_LIMIT)
+        self.ids = itertools.count(1)
+
+    def begin_query(self, text: str) -> QueryRecord:
+        """Start a query, tagging the spans recorded from here in this context with it."""
+        record = QueryRecord(next(self.ids), text, time.perf_counter())
+        self.queries.append(record)
+        CURRENT_QUERY.set(record.id)
+        return record
+
+    def end_query(self, record: QueryRecord, rows: int, stats: Counter) -> None:
+        """Finish a query, keeping how many rows it gave and how it moved the session's counters."""
+        record.end = time.perf_counter()
+        record.rows = rows
+        record.stats = stats
+
+    @property
+    def last_query(self) -> QueryRecord | None:
+        """The query started most recently."""
+        return self.queries[-1] if self.queries else None
+
+    def add(
+        self, name: str, category: str, start: float, end: float, query: int | None = None, **args: object
+    ) -> None:
+        """Record a span that has already finished."""
+        query = CURRENT_QUERY.get() if query is None else query
+        self.spans.append(Span(name, category, start, end - start, query, args))
+
+    @contextmanager
+    def span(self, name: str, category: str = "engine", query: int | None = None, **args: object) -> Iterator[dict]:
+        """Time the body as a span, yielding its args so the body can add to them."""
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add(name, category, start, time.perf_counter(), query, **args)
+
+    def relative_spans(self, record: QueryRecord) -> list[tuple]:
+        """Get a query's spans as (name, category, offset, duration, args), timed from the query's start.
+
+        Each thread's clock starts at a different time, so this is how spans are sent between them.
+        """
+        return [
+            (span.name, span.category, span.start - record.start, span.duration, span.args)
+            for span in self.spans
+            if span.query == record.id
+        ]
+
+    def add_relative(self, record: QueryRecord, spans: list[tuple]) -> None:
+        """Record spans from `relative_spans` in another thread as part of a query here."""
+        for name, category, offset, duration, args in spans:
+            start = record.start + offset
+            self.add(name, category, start, start + duration, record.id, **args)
+
+    def breakdown(self, query: int) -> dict[str, tuple[int, float]]:
+        """Sum a query's spans by name, as (count, seconds) in the order they first ran."""
+        totals: dict[str, tuple[int, float]] = {}
+        for span in self.spans:
+            if span.query == query:
+                count, seconds = totals.get(span.name, (0, 0.0))
+                totals[span.name] = (count + 1, seconds + span.duration)
+        return totals
+
+    def summary(self, record: QueryRecord) -> str:
+        """Describe where a query's time went, with its requests, bytes, cache hit rate and throughput.
+
+        Spans that ran concurrently, like overlapping requests, add up to more than the wall time.
+        """
+        steps = [
+            f"{name} {count}x {seconds * 1000:.1f}ms" if count > 1 else f"{name} {seconds * 1000:.1f}ms"
+            for name, (count, seconds) in self.breakdown(record.id).items()
+        ]
+        calls, hits = record.stats["http_calls"], record.stats["cache_hits"]
+        totals = [
+            f"{calls} req",
+            f"{record.stats['bytes'] / 1024:.1f} KB",
+            f"cache {hits / (hits + calls):.0%}" if hits + calls else "cache -",
+            f"{record.rows / record.elapsed:,.0f} rows/s" if record.elapsed > 0 else "- rows/s",
+        ]
+        return " | ".join([", ".join(steps) or "no spans", ", ".join(totals)])
+
+    def chrome_trace(self) -> str:
+        """Export the buffer in the Trace Event Format, for chrome://tracing or ui.perfetto.dev.
+
+        Each query gets its own track, named after the query text.
+        """
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": record.id, "args": {"name": record.text}}
+            for record in self.queries
+        ]
+        events.extend(
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": span.start * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": 1,
+                "tid": span.query,
+                "args": span.args,
+            }
+            for span in self.spans
+        )
+        return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, default=str)
+
+    def clear(self) -> None:
+        """Drop every span and query."""
+        self.spans.clear()
+        self.queries.clear()
+
+
+TRACER = Tracer()
+
+
+def test_span_limit() -> None:
+    """Tests that a full buffer keeps only the newest spans, and that the breakdown sums what's kept."""
+    tracer = Tracer(limit=3)
+    for i in range(5):
+        tracer.add(f"page {i % 2}", "network", i, i + 0.5, query=1)
+    assert [span.name for span in tracer.spans] == ["page 0", "page 1", "page 0"]
+    assert tracer.breakdown(1) == {"page 0": (2, 1.0), "page 1": (1, 0.5)}
+
+
+def test_chrome_trace() -> None:
+    """Tests that each query gets a named track, and each span a complete event on it in microseconds."""
+    tracer = Tracer()
+    record = copy_context().run(tracer.begin_query, "SELECT * FROM tables")
+    tracer.add("fetch", "network", 1.0, 1.5, record.id, url="/xrpc/x")
+    assert json.loads(tracer.chrome_trace()) == {
+        "traceEvents": [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": record.id, "args": {"name": "SELECT * FROM tables"}},
+            {
+                "name": "fetch",
+                "cat": "network",
+                "ph": "X",
+                "ts": 1_000_000.0,
+                "dur": 500_000.0,
+                "pid": 1,
+                "tid": record.id,
+                "args": {"url": "/xrpc/x"},
+            },
+        ],
+        "displayTimeUnit": "ms",
+    }
@@ -1,4 +1,4 @@
-from js import Element, Event, document, window
+from js import Element, Event, URLSearchParams, document, window
 from pyodide.ffi import create_proxy
 from pyodide.ffi.wrappers import set_timeout
 
@@ -6,7 +6,7 @@ try:
     import frontend
 except ImportError:
     frontend = None
-from auth_session import BskySession
+from engine_client import EngineClient
 
 # dom
 AUTH_MODAL = None
@@ -24,6 +24,11 @@ is_modal_visible = False
 crt_enabled = True  # CRT starts enabled by default
 
 
+def pds_host() -> str | None:
+    """Get the server to send every call to from `?pds=` in the page URL, e.g. a local mock_appview.py."""
+    return URLSearchParams.new(window.location.search).get("pds") or None
+
+
 def init_auth_modal() -> None:
     """Initialize the authentication modal."""
     global AUTH_MODAL, LOGIN_BTN, STEALTH_BTN, USERNAME_INPUT, PASSWORD_INPUT, AUTH_FORM, STATUS_TEXT, CRT_TOGGLE_BTN  # noqa: PLW0603
@@ -186,7 +191,7 @@ def handle_authentication() -> None:
 
         # catch and store authentication data
         auth_data = {"username": username, "password": password, "mode": "authenticated"}
-        window.session = BskySession(username, password)
+        window.session = EngineClient(username, password, pds_host())
         is_logged_in = await window.session.login()
         if not is_logged_in:
             handle_failed_auth()
@@ -233,7 +238,7 @@ def handle_stealth_mode() -> None:
 
         # save stealth mode
         auth_data = {"mode": "stealth"}
-        window.session = BskySession("", "")
+        window.session = EngineClient("", "", pds_host())
         STEALTH_BTN.innerHTML = "STEALTH ACTIVE ✓"
         STEALTH_BTN.style.background = "#444400"
 
@@ -1,14 +1,18 @@
+import time
 from typing import Literal
 
-from image_modal import show_image_modal
-from js import Element, Event, Math, document
-from pyodide.ffi import create_proxy
+from image_modal import cancel_prefetches, observe_image, show_image_modal
+from js import URL, Blob, Element, Event, Math, Object, document, window
+from pyodide.ffi import JsException, JsProxy, create_proxy, to_js
 from pyodide.ffi.wrappers import set_interval, set_timeout
+from tracing import CURRENT_QUERY, TRACER
 
 # constants for random effects
 ELECTRIC_WAVE_PROBABILITY = 0.03
 SCREEN_FLICKER_PROBABILITY = 0.05
 
+STREAM_ROWS = 500  # Rows of the stream kept on screen, the oldest are removed as newer ones arrive
+
 QUERY_INPUT = document.getElementById("query-input")
 EXECUTE_BUTTON = document.getElementById("execute-btn")
 CANCEL_BUTTON = document.getElementById("cancel-btn")
@@ -19,6 +23,9 @@ STATUS_MESSAGE = document.getElementById("status-message")
 CONNECTION_INFO = document.getElementById("connection-info")
 LOADING_OVERLAY = document.getElementById("loading-overlay")
 ELECTRIC_WAVE = document.getElementById("electric-wave")
+PERF_HUD = document.getElementById("perf-hud")
+PERF_BUTTON = document.getElementById("perf-btn")
+TRACE_BUTTON = document.getElementById("trace-btn")
 
 
 def electric_wave_trigger() -> None:
@@ -85,8 +92,82 @@ def update_connection_info(row: int, status: str) -> None:
     CONNECTION_INFO.textContent = f"rows: {row} | status: {status}"
 
 
+def update_perf_hud() -> None:
+    """Show where the last query's time went, if the HUD is open."""
+    record = TRACER.last_query
+    if record is not None and not PERF_HUD.hidden:
+        PERF_HUD.textContent = TRACER.summary(record)
+
+
+def toggle_perf_hud(_: Event) -> None:
+    """Open or close the performance HUD."""
+    PERF_HUD.hidden = not PERF_HUD.hidden
+    TRACE_BUTTON.hidden = PERF_HUD.hidden
+    update_perf_hud()
+
+
+def export_trace(_: Event) -> None:
+    """Download the recorded spans as a Chrome trace, to open in chrome://tracing or ui.perfetto.dev."""
+    _download(to_js([TRACER.chrome_trace()]), f"sql-bsky-trace-{int(time.time())}.json", "application/json")
+
+
+def _download(parts: JsProxy, name: str, media_type: str) -> None:
+    """Save a list of Blob parts as a file through a temporary link."""
+    options = to_js({"type": media_type}, dict_converter=Object.fromEntries)
+    url = URL.createObjectURL(Blob.new(parts, options))
+    link = document.createElement("a")
+    link.href = url
+    link.download = name
+    link.click()
+    URL.revokeObjectURL(url)
+
+
+class DownloadSink:
+    """Where INTO OUTFILE exports go in the browser.
+
+    With the File System Access API the chunks are streamed to the file the user picks. Elsewhere each chunk
+    becomes a Blob part as it arrives, which the browser can keep out of the Python heap, and the parts are
+    downloaded together at the end.
+    """
+
+    def __init__(self, name: str, media_type: str, writable: JsProxy | None = None) -> None:
+        self.name = name
+        self.media_type = media_type
+        self.writable = writable
+        self.parts = []
+
+    @classmethod
+    async def open(cls, name: str, media_type: str) -> "DownloadSink | None":
+        """Ask where to save the file if the browser can stream to disk, returning None if the user cancels."""
+        if not hasattr(window, "showSaveFilePicker"):
+            return cls(name, media_type)
+        try:
+            options = to_js({"suggestedName": name}, dict_converter=Object.fromEntries)
+            handle = await window.showSaveFilePicker(options)
+            return cls(name, media_type, await handle.createWritable())
+        except JsException:
+            return None
+
+    async def write(self, data: bytes) -> None:
+        """Send a chunk to the file, or keep it as a Blob part."""
+        chunk = to_js(data)
+        if self.writable is not None:
+            await self.writable.write(chunk)
+        else:
+            self.parts.append(Blob.new(to_js([chunk])))
+
+    async def close(self) -> None:
+        """Finish the file, downloading the collected parts if it wasn't streamed."""
+        if self.writable is not None:
+            await self.writable.close()
+        else:
+            _download(to_js(self.parts), self.name, self.media_type)
+            self.parts = []
+
+
 def clear_interface(_: Event) -> None:
     """Clear the user interface."""
+    cancel_prefetches()
     clear_query_input()
     show_empty_table()
     update_status("interface cleared", "info")
@@ -168,10 +249,11 @@ def _handle_image(image: str) -> Element:
         return _handler
 
     hyperlink.addEventListener("click", create_proxy(create_click_handler(thumbnail_link, full_size_link, alt_text)))
+    observe_image(hyperlink, thumbnail_link)
     return hyperlink
 
 
-def _create_table_rows(headers: list, rows: list[dict]) -> None:
+def _create_table_rows(headers: list, rows: list[dict], body: Element = TABLE_BODY) -> None:
     """Create table rows with appearing effect."""
     for row_index, row_data in enumerate(rows):
         tr = document.createElement("tr")
@@ -190,7 +272,7 @@ def _create_table_rows(headers: list, rows: list[dict]) -> None:
                 td.textContent = str(cell_data) if cell_data else ""
             tr.appendChild(td)
 
-        TABLE_BODY.appendChild(tr)
+        body.appendChild(tr)
 
         # staggered row animation
         def _show_row(element: Element = tr, delay: int = (row_index * 100) + 200) -> None:
@@ -208,6 +290,8 @@ def update_table(headers: list, rows: list[dict]) -> None:
     # fade out effect before updating
     TABLE_HEAD.style.opacity = "0.3"
     TABLE_BODY.style.opacity = "0.3"
+    # the rows are built after this returns, so the render span is tagged with the query by hand
+    query = CURRENT_QUERY.get()
 
     def _update_content() -> None:
         # clear table
@@ -218,8 +302,10 @@ def update_table(headers: list, rows: list[dict]) -> None:
             show_empty_table()
             return
 
-        _create_table_headers(headers)
-        _create_table_rows(headers, rows)
+        with TRACER.span("render", "render", query=query, rows=len(rows)):
+            _create_table_headers(headers)
+            _create_table_rows(headers, rows)
+        update_perf_hud()
 
         # restore container opacity
         def _restore_opacity() -> None:
@@ -240,6 +326,70 @@ def update_table(headers: list, rows: list[dict]) -> None:
     set_timeout(create_proxy(_update_content), 200)
 
 
+class TableStream:
+    """Fill the table a page at a time as a query's rows arrive from the engine worker."""
+
+    def __init__(self) -> None:
+        self.headers: list[str] = []
+        self.rows = 0  # Rows added so far, including any since removed
+        self.keep: int | None = None  # Most rows shown at once, None to keep every row
+
+    def add(self, headers: list, rows: list[dict]) -> None:
+        """Append a page of rows, adding any columns it brings that earlier pages didn't have."""
+        self._render(headers, rows, TABLE_BODY.append)
+        update_connection_info(self.rows, "streaming")
+
+    def add_newest(self, headers: list, rows: list[dict]) -> None:
+        """Put rows newer than all the ones shown above them, like a WATCH refresh's or the stream's.
+
+        Past `keep` rows, the oldest ones are removed.
+        """
+        if rows:
+            skipped = len(rows) - self.keep if self.keep is not None and len(rows) > self.keep else 0
+            self._render(headers, rows[: len(rows) - skipped], TABLE_BODY.prepend)
+            self.rows += skipped
+            self._trim()
+        update_connection_info(self.rows, "watching")
+
+    def _trim(self) -> None:
+        children = TABLE_BODY.children
+        if self.keep is None or children.length <= self.keep:
+            return
+        # removed as one range, so the table lays out once rather than once a row
+        overflow = document.createRange()
+        overflow.setStartBefore(children.item(self.keep))
+        overflow.setEndAfter(TABLE_BODY.lastElementChild)
+        overflow.deleteContents()
+
+    def _render(self, headers: list, rows: list[dict], insert: JsProxy) -> None:
+        new = [header for header in headers if header not in self.headers]
+        with TRACER.span("render", "render", rows=len(rows)):
+            if not self.rows:
+                TABLE_BODY.innerHTML = ""
+            if new:
+                self.headers.extend(new)
+                TABLE_HEAD.innerHTML = ""
+                _create_table_headers(self.headers)
+            # built off the page and inserted in one go, above or below the rows already there
+            fragment = document.createDocumentFragment()
+            _create_table_rows(self.headers, rows, fragment)
+            insert(fragment)
+        self.rows += len(rows)
+
+    def finish(self) -> None:
+        """Settle the table once the last page is in."""
+        update_connection_info(self.rows, "connected")
+        trigger_electric_wave()
+
+
+def measure_render(headers: list, rows: list[dict]) -> float:
+    """Build the table rows off-screen and return how many seconds it took."""
+    rows = [row.copy() for row in rows]
+    start = time.perf_counter()
+    _create_table_rows(headers, rows, document.createDocumentFragment())
+    return time.perf_counter() - start
+
+
 def set_buttons_disabled(*, disabled: bool) -> None:
     """Enable/disable buttons with visual effects."""
     EXECUTE_BUTTON.disabled = disabled
@@ -1,9 +1,11 @@
-from io import BytesIO
+import asyncio
+import itertools
+from collections import OrderedDict
+from functools import partial
 
-from ascii_magic import AsciiArt
-from js import Event, document, window
-from pyodide.ffi import create_proxy
-from pyodide.http import pyfetch
+from engine_client import start_image_workers, to_ascii
+from js import Element, Event, IntersectionObserver, Object, URLSearchParams, document, window
+from pyodide.ffi import JsProxy, create_once_callable, create_proxy, to_js
 
 IMAGE_MODAL = document.getElementById("image-modal")
 ASCII_DISPLAY = document.getElementById("ascii-display")
@@ -11,7 +13,74 @@ ALT_TEXT = document.getElementById("image-alt-text")
 FULL_SIZE_LINK = document.getElementById("image-modal-full-link")
 CLOSE_BUTTON = document.getElementById("image-modal-close")
 
-_image_cache = {}
+ASCII_COLUMNS = 100  # Characters across an image in the modal, unless the page URL has `?columns=`
+MIN_ASCII_COLUMNS = 20  # Fewest `?columns=` allows, any less and there's no telling what the image is
+MAX_ASCII_COLUMNS = 400  # Most `?columns=` allows, more takes seconds to convert and won't fit on screen
+IMAGE_CACHE_BYTES = 2_000_000  # Most ASCII art kept, about 400 images at 100 columns
+PREFETCH_CONCURRENCY = 2  # Images converted ahead of time at once, leaving a worker free for ones opened
+PREFETCH_MARGIN = "200px"  # How far outside the viewport an image link counts as visible
+SPINNER = "|/-\\"
+
+
+def ascii_columns() -> int:
+    """Get how many characters across to draw images, `?columns=200` in the page URL gives more detail.
+
+    A value that isn't a whole number gets the default, and one out of range the nearest it allows.
+    """
+    try:
+        columns = int(URLSearchParams.new(window.location.search).get("columns") or ASCII_COLUMNS)
+    except ValueError:
+        return ASCII_COLUMNS
+    return min(max(columns, MIN_ASCII_COLUMNS), MAX_ASCII_COLUMNS)
+
+
+def ascii_colour() -> bool:
+    """Get whether to draw images in colour, from `?colour` in the page URL, which makes the art HTML."""
+    return URLSearchParams.new(window.location.search).has("colour")
+
+
+class AsciiCache:
+    """Keep converted images by (url, columns), dropping the least recently used past a size in bytes."""
+
+    def __init__(self, limit: int = IMAGE_CACHE_BYTES) -> None:
+        self.limit = limit
+        self.size = 0
+        self.entries: OrderedDict[tuple[str, int], str] = OrderedDict()
+
+    def get(self, url: str, columns: int) -> str | None:
+        """Get an image's ASCII art, if it's cached."""
+        key = (url, columns)
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, url: str, columns: int, text: str) -> None:
+        """Cache an image's ASCII art, making room for it."""
+        key = (url, columns)
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = text
+        # the art is all ASCII, so a character is a byte
+        self.size += len(text)
+        while self.size > self.limit and len(self.entries) > 1:
+            self.size -= len(self.entries.popitem(last=False)[1])
+
+
+IMAGE_CACHE = AsciiCache()
+# Conversions running, so an image opened twice at once is only converted once
+_converting: dict[tuple[str, int], asyncio.Task] = {}
+# Image links in view, in the order they came into view, waiting for the browser to be idle
+_queued: dict[str, None] = {}
+# Conversions started ahead of time that haven't been opened yet, so they can still be dropped
+_speculative: set[tuple[str, int]] = set()
+_idle_scheduled = False
+
+
+async def _spin(message: str) -> None:
+    for frame in itertools.cycle(SPINNER):
+        ASCII_DISPLAY.textContent = f"{message} {frame}"
+        await asyncio.sleep(0.1)
 
 
 async def show_image_modal(thumb_link: str, fullsize_link: str, alt: str) -> None:
@@ -20,8 +89,19 @@ async def show_image_modal(thumb_link: str, fullsize_link: str, alt: str) -> Non
     FULL_SIZE_LINK.href = fullsize_link or thumb_link
     ALT_TEXT.textContent = alt
     ASCII_DISPLAY.textContent = ""
-    ascii_img = await load_image(thumb_link)
-    ASCII_DISPLAY.textContent = ascii_img
+
+    spinner = asyncio.ensure_future(_spin("Loading image"))
+    try:
+        ascii_img = await load_image(thumb_link)
+    except Exception:  # noqa: BLE001 Shown in the modal instead
+        ascii_img = "Couldn't load this image"
+    finally:
+        spinner.cancel()
+    if ascii_colour():
+        # the art is HTML that ascii_image.py built, escaping the characters
+        ASCII_DISPLAY.innerHTML = ascii_img
+    else:
+        ASCII_DISPLAY.textContent = ascii_img
 
 
 def hide_image_modal(_: Event) -> None:
@@ -33,19 +113,221 @@ def hide_image_modal(_: Event) -> None:
 # TODO: Fix styling ;)
 
 
-async def load_image(url: str) -> str:
-    """Load an image as monochrome ascii."""
-    if url in _image_cache:  # "Cache" the images for speeding up things.
-        return _image_cache[url]
+async def load_image(url: str, columns: int | None = None) -> str:
+    """Load an image as ascii, converted in the worker pool."""
+    columns = columns or ascii_columns()
+    text = IMAGE_CACHE.get(url, columns)
+    if text is not None:
+        return text
+    # it's been opened, so a prefetch that started it can't drop it any more
+    _speculative.discard((url, columns))
+    return await asyncio.shield(_start(url, columns))
+
+
+def _start(url: str, columns: int) -> asyncio.Task:
+    # the first image opened or prefetched starts the image workers, a page without images never needs them
+    start_image_workers()
+    key = (url, columns)
+    if key not in _converting:
+        _converting[key] = asyncio.ensure_future(_convert(url, columns))
+    return _converting[key]
+
+
+async def _convert(url: str, columns: int) -> str:
+    try:
+        text = await to_ascii(await window.session.get_blob(url), columns, colour=ascii_colour())
+    finally:
+        del _converting[url, columns]
+    IMAGE_CACHE.put(url, columns, text)
+    return text
+
+
+def observe_image(link: Element, url: str) -> None:
+    """Watch an image link in the table, to convert its image ahead of time while it's in view."""
+    link.setAttribute("data-thumb", url)
+    VISIBLE.observe(link)
+
+
+def cancel_prefetches() -> None:
+    """Stop converting ahead of time for the table that was showing, when it's replaced."""
+    VISIBLE.disconnect()
+    _queued.clear()
+    for url, columns in list(_speculative):
+        _drop(url, columns)
+
+
+def _on_visibility(entries: JsProxy, _observer: JsProxy) -> None:
+    for entry in entries:
+        url = entry.target.getAttribute("data-thumb")
+        if entry.isIntersecting:
+            _queued[url] = None
+        else:
+            _queued.pop(url, None)
+            _drop(url, ascii_columns())
+    _schedule_prefetch()
+
+
+def _drop(url: str, columns: int) -> None:
+    """Cancel a conversion started ahead of time, if it hasn't been opened since."""
+    key = (url, columns)
+    if key in _speculative:
+        _speculative.discard(key)
+        task = _converting.get(key)
+        if task is not None:
+            task.cancel()
+
+
+def _schedule_prefetch() -> None:
+    global _idle_scheduled  # noqa: PLW0603
+    if _idle_scheduled or not _queued or len(_speculative) >= PREFETCH_CONCURRENCY:
+        return
+    _idle_scheduled = True
+    if hasattr(window, "requestIdleCallback"):
+        window.requestIdleCallback(create_once_callable(_prefetch))
+    else:
+        window.setTimeout(create_once_callable(_prefetch), 0)
+
 
-    blob_url = await window.session.get_blob(url)
-    res = await pyfetch(blob_url)
-    bites = BytesIO(await res.bytes())
-    ascii_image = AsciiArt.from_image(bites)
-    ascii_image = AsciiArt.from_image(bites)
-    ascii_str = ascii_image.to_ascii(columns=100, monochrome=True)
-    _image_cache[url] = ascii_str
-    return ascii_str
+def _prefetch(*_: object) -> None:
+    """Start converting the images that came into view first, a few at a time."""
+    global _idle_scheduled  # noqa: PLW0603
+    _idle_scheduled = False
+    while _queued and len(_speculative) < PREFETCH_CONCURRENCY:
+        url = next(iter(_queued))
+        del _queued[url]
+        key = (url, ascii_columns())
+        if key in _converting or IMAGE_CACHE.get(*key) is not None:
+            continue
+        _speculative.add(key)
+        _start(*key).add_done_callback(partial(_prefetched, key))
 
 
+def _prefetched(key: tuple[str, int], task: asyncio.Task) -> None:
+    _speculative.discard(key)
+    if not task.cancelled() and task.exception() is not None:
+        # it'll be tried again, and shown as an error, if the image is opened
+        print(f"[-] Couldn't prefetch {key[0]}: {task.exception()}")
+    _schedule_prefetch()
+
+
+VISIBLE = IntersectionObserver.new(
+    create_proxy(_on_visibility), to_js({"rootMargin": PREFETCH_MARGIN}, dict_converter=Object.fromEntries)
+)
 CLOSE_BUTTON.addEventListener("click", create_proxy(hide_image_modal))
+
+
+class _SearchParams:
+    """The browser's URLSearchParams, for the page URLs the tests make up."""
+
+    def __init__(self, search: str) -> None:
+        from urllib.parse import parse_qs  # noqa: PLC0415 Only the tests parse the URL in Python
+
+        self.params = parse_qs(search.removeprefix("?"), keep_blank_values=True)
+
+    @classmethod
+    def new(cls, search: str) -> "_SearchParams":
+        return cls(search)
+
+    def get(self, name: str) -> str | None:
+        return self.params.get(name, [None])[0]
+
+    def has(self, name: str) -> bool:
+        return name in self.params
+
+
+class _Window:
+    """A page without requestIdleCallback, whose session's blobs are their URLs, holding back its timeouts."""
+
+    def __init__(self, search: str = "") -> None:
+        self.location = type("Location", (), {"search": search})
+        self.session = self
+        self.timeouts = []
+
+    async def get_blob(self, url: str) -> str:
+        return f"blob:{url}"
+
+    def setTimeout(self, callback: object, _delay: int) -> None:  # noqa: N802 The browser's name
+        self.timeouts.append(callback)
+
+
+class _Entry:
+    """An IntersectionObserver entry for an image link."""
+
+    def __init__(self, url: str, *, visible: bool) -> None:
+        self.target = self
+        self.url = url
+        self.isIntersecting = visible
+
+    def getAttribute(self, _name: str) -> str:  # noqa: N802 The browser's name
+        return self.url
+
+
+def test_cache() -> None:
+    """Tests that the least recently used art is dropped past the limit, but never the only entry."""
+    cache = AsciiCache(limit=10)
+    cache.put("a", 100, "aaaa")
+    cache.put("b", 100, "bbbb")
+    assert cache.get("a", 100) == "aaaa"
+    cache.put("c", 100, "cccc")
+    assert [cache.get(url, 100) for url in "abc"] == ["aaaa", None, "cccc"]
+    cache.put("d", 100, "d" * 20)
+    assert (list(cache.entries), cache.size) == ([("d", 100)], 20)
+
+
+def test_prefetch(monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that links in view are converted a few at a time once the page is idle.
+
+    A link scrolled away stops its conversion, unless it's been opened since. The image workers aren't
+    started until the first conversion.
+    """
+    page = _Window()
+    monkeypatch.setitem(globals(), "window", page)
+    monkeypatch.setitem(globals(), "URLSearchParams", _SearchParams)
+    monkeypatch.setitem(globals(), "IMAGE_CACHE", AsciiCache())
+    workers_started = []
+    monkeypatch.setitem(globals(), "start_image_workers", lambda: workers_started.append(True))
+    started = []
+
+    async def run() -> str:
+        release = asyncio.Event()
+
+        async def fake_to_ascii(blob: str, _columns: int, *, colour: bool) -> str:  # noqa: ARG001 Always monochrome
+            started.append(blob)
+            await release.wait()
+            return f"art of {blob}"
+
+        monkeypatch.setitem(globals(), "to_ascii", fake_to_ascii)
+        _on_visibility([_Entry(url, visible=True) for url in "abc"], None)
+        assert not workers_started
+        page.timeouts.pop()()
+        opened = asyncio.ensure_future(load_image("a"))
+        await asyncio.sleep(0.01)
+        _on_visibility([_Entry("a", visible=False), _Entry("b", visible=False)], None)
+        await asyncio.sleep(0.01)
+        page.timeouts.pop()()
+        await asyncio.sleep(0.01)
+        release.set()
+        text = await opened
+        await asyncio.sleep(0.01)
+        return text
+
+    try:
+        text = asyncio.run(run())
+    finally:
+        cancel_prefetches()
+    # b was cancelled once out of view, freeing its place for c
+    assert (text, started) == ("art of blob:a", ["blob:a", "blob:b", "blob:c"])
+    assert list(IMAGE_CACHE.entries) == [("a", ASCII_COLUMNS), ("c", ASCII_COLUMNS)]
+    assert [_converting, _queued, _speculative, page.timeouts] == [{}, {}, set(), []]
+    assert workers_started
+
+
+def test_ascii_columns(monkeypatch) -> None:  # noqa: ANN001 pytest's fixture
+    """Tests that `?columns=` is clamped to the range allowed, and anything but a whole number ignored."""
+    monkeypatch.setitem(globals(), "URLSearchParams", _SearchParams)
+    searches = ["", "?columns=", "?columns=150", "?columns=5", "?columns=9000", "?columns=abc", "?columns=1e3"]
+    columns = []
+    for search in searches:
+        monkeypatch.setitem(globals(), "window", _Window(search))
+        columns.append(ascii_columns())
+    assert columns == [ASCII_COLUMNS, ASCII_COLUMNS, 150, MIN_ASCII_COLUMNS, MAX_ASCII_COLUMNS, *[ASCII_COLUMNS] * 2]
@@ -34,6 +34,7 @@ let continuePressed = false;
 let currentMessageIndex = 0;
 let bootContent = null;
 let progressCallbacks = {};
+let bootTimings = {};
 
 
 window.bootProgress = {
@@ -46,9 +47,17 @@ window.bootProgress = {
   isComplete: () => isBootComplete,
 
   updateProgress: updateCurrentProgress,
-  setProgressMessage: setProgressMessage
+  setProgressMessage: setProgressMessage,
+  recordTiming: recordTiming,
+  timings: () => ({ ...bootTimings })
 };
 
+// remember how long a boot step took, in milliseconds
+function recordTiming(step, ms) {
+  bootTimings[step] = Math.round(ms * 10) / 10;
+  console.log(`Boot step ${step}: ${bootTimings[step]}ms`);
+}
+
 // update current progress bar to a specific percentage
 function updateCurrentProgress(percentage) {
   const currentProgressBars = document.querySelectorAll('[id^="progress-bar-"]');
@@ -0,0 +1,33 @@
+// engine-worker.js
+// runs the query engine in a pyodide of its own, so big queries don't freeze the page
+// the messages it answers are described in api/engine_client.py
+
+importScripts("https://cdn.jsdelivr.net/pyodide/v0.28.1/full/pyodide.js");
+
+// the page's directory, which the module URLs in setup.py are relative to
+const BASE = new URL("../", self.location).href;
+
+async function loadEngine() {
+  const pyodide = await loadPyodide();
+  const response = await fetch(new URL("core/setup.py", BASE));
+  pyodide.FS.writeFile("setup.py", new Uint8Array(await response.arrayBuffer()));
+  await pyodide.pyimport("setup").setup_pyodide_scripts(BASE);
+  return pyodide.pyimport("engine_worker");
+}
+
+const engine = loadEngine();
+
+// messages that arrive while pyodide loads wait here, and are handled in the order they came
+self.onmessage = async (event) => {
+  try {
+    (await engine).handle(event.data);
+  } catch (error) {
+    console.error("Query engine failed to load:", error);
+    self.postMessage({
+      type: "error",
+      id: event.data.id,
+      error: "QueryError",
+      message: `Query engine failed to load: ${error}`
+    });
+  }
+};